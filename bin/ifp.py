@@ -44,6 +44,7 @@ from job_manager import JobManager
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
 import common
 import common_db
+import common_journal
 import common_pyqt5
 
 # Import install config settings.
@@ -259,7 +260,7 @@ class MainWindow(QMainWindow):
             else:
                 dir_path = os.path.dirname(self.ifp_config_file)
 
-                if os.path.exists(os.path.join(dir_path, status_file_name)):
+                if os.path.exists(os.path.join(dir_path, status_file_name)) or common_journal.StatusJournal(os.path.join(dir_path, status_file_name)).exists():
                     self.ifp_status_file = os.path.join(os.path.join(dir_path, status_file_name))
                 else:
                     self.ifp_status_file = os.path.join(os.getcwd(), f'{status_file_name}.read_mode_temp_file')
@@ -267,6 +268,9 @@ class MainWindow(QMainWindow):
 
                 self.ifp_cache_dir = os.path.join(dir_path, cache_dir_name)
 
+            # Task status of self.ifp_status_file is saved incrementally, yaml status file is exported for APIs and on exit
+            self.status_journal = common_journal.StatusJournal(self.ifp_status_file)
+
             self.ifp_pnum = -1
             self.memos_logger = common.MemosLogger(log_path=os.path.join(self.ifp_cache_dir, 'memos.log'))
 
@@ -1202,7 +1206,10 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
     # MultipleSelectWindow (end)
 
     # Process status/config files (start) #
-    def save_status_file(self, status_file=''):
+    def save_status_file(self, status_file='', export=True):
+        """
+        Status of self.ifp_status_file goes to status journal, export=True also dumps the whole table into yaml status file.
+        """
         if self.read_mode:
             return
 
@@ -1217,33 +1224,59 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
             if not caller_info.function == 'generate_main_tab_api_menu':
                 self.update_message_text({'message': 'Save status into file "' + str(status_file) + '".', 'color': 'black'})
 
-            # Seitch self.main_table_info_list into a dict.
-            main_table_info_dic = {i: {'Block': main_table_info['Block'],
-                                       'Version': main_table_info['Version'],
-                                       'Flow': main_table_info['Flow'],
-                                       'Task': main_table_info['Task'],
-                                       'Status': main_table_info['Status'],
-                                       'BuildStatus': main_table_info['BuildStatus'],
-                                       'RunStatus': main_table_info['RunStatus'],
-                                       'CheckStatus': main_table_info['CheckStatus'],
-                                       'SummarizeStatus': main_table_info['SummarizeStatus'],
-                                       'ReleaseStatus': main_table_info['ReleaseStatus'],
-                                       'Job': main_table_info['Job'],
-                                       'Runtime': main_table_info['Runtime'],
-                                       'Visible': main_table_info['Visible'],
-                                       'Selected': main_table_info['Selected']}
-                                   for i, main_table_info in enumerate(self.main_table_info_list)}
-
-            with open(status_file, 'w', encoding='utf-8') as SF:
-                yaml.dump(main_table_info_dic, SF, indent=4, sort_keys=False, Dumper=yaml.CDumper)
+            if self.is_project_status_file(status_file):
+                self.status_journal.save(self.get_status_row_dic())
+
+            if export or not self.is_project_status_file(status_file):
+                # Seitch self.main_table_info_list into a dict.
+                main_table_info_dic = {i: self.get_status_row(main_table_info) for i, main_table_info in enumerate(self.main_table_info_list)}
+
+                with open(status_file, 'w', encoding='utf-8') as SF:
+                    yaml.dump(main_table_info_dic, SF, indent=4, sort_keys=False, Dumper=yaml.CDumper)
+
+                if self.is_project_status_file(status_file):
+                    self.status_journal.record_export(status_file)
 
         self.save_api_for_read_mode()
 
+    def is_project_status_file(self, status_file: str) -> bool:
+        return os.path.abspath(status_file) == os.path.abspath(self.ifp_status_file)
+
+    @staticmethod
+    def get_status_row(main_table_info: dict) -> dict:
+        return {'Block': main_table_info['Block'],
+                'Version': main_table_info['Version'],
+                'Flow': main_table_info['Flow'],
+                'Task': main_table_info['Task'],
+                'Status': main_table_info['Status'],
+                'BuildStatus': main_table_info['BuildStatus'],
+                'RunStatus': main_table_info['RunStatus'],
+                'CheckStatus': main_table_info['CheckStatus'],
+                'SummarizeStatus': main_table_info['SummarizeStatus'],
+                'ReleaseStatus': main_table_info['ReleaseStatus'],
+                'Job': main_table_info['Job'],
+                'Runtime': main_table_info['Runtime'],
+                'Visible': main_table_info['Visible'],
+                'Selected': main_table_info['Selected']}
+
+    @staticmethod
+    def get_status_uuid(main_table_info: dict) -> str:
+        return common.generate_uuid_from_components(item_list=[main_table_info['Block'], main_table_info['Version'], main_table_info['Flow'], main_table_info['Task']])
+
+    def get_status_row_dic(self) -> Dict[str, dict]:
+        return {self.get_status_uuid(main_table_info): self.get_status_row(main_table_info) for main_table_info in self.main_table_info_list}
+
     def load_status_file(self, status_file='', api_reload: bool = True):
         if not status_file:
             (status_file, file_type) = QFileDialog.getOpenFileName(self, 'Load status file', '.', '*')
 
-        if status_file and os.path.exists(status_file):
+        journal_row_dic = self.status_journal.load() if status_file and self.is_project_status_file(status_file) and self.status_journal.exists() else None
+
+        # Journal wins unless yaml status file was replaced or edited after it
+        if journal_row_dic is not None and self.status_journal.is_current(status_file):
+            self.update_message_text({'message': 'Load status with file "' + str(status_file) + '".', 'color': 'black'})
+            self.apply_status_row_dic(journal_row_dic, api_reload=api_reload)
+        elif status_file and os.path.exists(status_file):
             self.update_message_text({'message': 'Load status with file "' + str(status_file) + '".', 'color': 'black'})
 
             # Get status from status file.
@@ -1258,31 +1291,45 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
                     self.update_message_text({'message': 'Failed load status with file "' + str(status_file) + '" due to format is wrong.', 'color': 'red'})
                     return
 
-            # Update self.main_table_info_list with new status_file.
-            for (i, main_table_info) in enumerate(self.main_table_info_list):
-                for (j, status_dic) in saved_status_dic.items():
-                    if (main_table_info['Block'] == status_dic['Block']) and (main_table_info['Version'] == status_dic['Version']) and (main_table_info['Flow'] == status_dic['Flow']) and (main_table_info['Task'] == status_dic['Task']):
-                        status = status_dic['Status']
-                        # runtime = status_dic['Runtime']
-                        job = status_dic['Job']
-
-                        if status == common.status.running:
-                            status = self._update_main_tab_job_status(status=status, job=job, api_reload=api_reload)
-
-                        self.main_table_info_list[i]['Status'] = status
-                        self.main_table_info_list[i]['BuildStatus'] = status_dic['BuildStatus']
-                        self.main_table_info_list[i]['RunStatus'] = status_dic['RunStatus']
-                        self.main_table_info_list[i]['CheckStatus'] = status_dic['CheckStatus']
-                        self.main_table_info_list[i]['SummarizeStatus'] = status_dic['SummarizeStatus']
-                        self.main_table_info_list[i]['ReleaseStatus'] = status_dic['ReleaseStatus']
-                        self.main_table_info_list[i]['Job'] = status_dic['Job']
-                        self.main_table_info_list[i]['Runtime'] = status_dic['Runtime']
-                        self.main_table_info_list[i]['Visible'] = status_dic['Visible']
-                        self.main_table_info_list[i]['Selected'] = status_dic['Selected']
-
-            # Update related GUI parts.
-            self.update_main_table()
-            self.update_status_table()
+            self.apply_status_row_dic({self.get_status_uuid(status_dic): status_dic for status_dic in saved_status_dic.values()}, api_reload=api_reload)
+
+            if journal_row_dic is not None and not self.read_mode:
+                self.status_journal.reset(self.get_status_row_dic())
+
+    def apply_status_row_dic(self, status_row_dic: Dict[str, dict], api_reload: bool = True):
+        """
+        Update self.main_table_info_list with saved status {uuid: row}, jobs still running are reconciled together.
+        """
+        matched_list = []
+
+        for (i, main_table_info) in enumerate(self.main_table_info_list):
+            status_dic = status_row_dic.get(self.get_status_uuid(main_table_info))
+
+            if status_dic:
+                matched_list.append((i, status_dic))
+
+        job_status_dic = self._update_main_tab_job_status([status_dic['Job'] for (i, status_dic) in matched_list if status_dic['Status'] == common.status.running], api_reload=api_reload)
+
+        for (i, status_dic) in matched_list:
+            status = status_dic['Status']
+
+            if status == common.status.running:
+                status = job_status_dic.get(status_dic['Job']) or status
+
+            self.main_table_info_list[i]['Status'] = status
+            self.main_table_info_list[i]['BuildStatus'] = status_dic['BuildStatus']
+            self.main_table_info_list[i]['RunStatus'] = status_dic['RunStatus']
+            self.main_table_info_list[i]['CheckStatus'] = status_dic['CheckStatus']
+            self.main_table_info_list[i]['SummarizeStatus'] = status_dic['SummarizeStatus']
+            self.main_table_info_list[i]['ReleaseStatus'] = status_dic['ReleaseStatus']
+            self.main_table_info_list[i]['Job'] = status_dic['Job']
+            self.main_table_info_list[i]['Runtime'] = status_dic['Runtime']
+            self.main_table_info_list[i]['Visible'] = status_dic['Visible']
+            self.main_table_info_list[i]['Selected'] = status_dic['Selected']
+
+        # Update related GUI parts.
+        self.update_main_table()
+        self.update_status_table()
 
     def clear_task_status(self):
         reply = QMessageBox.question(self, 'Clear task status', 'Sure to clear all task status (including Job ID and Runtime info)?', QMessageBox.Yes | QMessageBox.Cancel)
@@ -1290,22 +1337,14 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
         if not reply == QMessageBox.Yes:
             return
 
-        status_file = './.ifp.status.yaml'
         clear_dic = {}
 
-        for (i, main_table_info) in enumerate(self.main_table_info_list):
-            block = main_table_info['Block']
-            version = main_table_info['Version']
-            flow = main_table_info['Flow']
-            task = main_table_info['Task']
-            visible = main_table_info['Visible']
-            selected = main_table_info['Selected']
-
-            clear_dic[i] = {
-                'Block': block,
-                'Version': version,
-                'Flow': flow,
-                'Task': task,
+        for main_table_info in self.main_table_info_list:
+            clear_dic[self.get_status_uuid(main_table_info)] = {
+                'Block': main_table_info['Block'],
+                'Version': main_table_info['Version'],
+                'Flow': main_table_info['Flow'],
+                'Task': main_table_info['Task'],
                 'Status': '',
                 'BuildStatus': '',
                 'RunStatus': '',
@@ -1314,26 +1353,34 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
                 'ReleaseStatus': '',
                 'Job': '',
                 'Runtime': '',
-                'Visible': visible,
-                'Selected': selected,
+                'Visible': main_table_info['Visible'],
+                'Selected': main_table_info['Selected'],
             }
 
-        with open(status_file, 'w') as f:
-            yaml.dump(clear_dic, f, indent=4, sort_keys=False)
+        self.apply_status_row_dic(clear_dic)
+        self.save_status_file(self.ifp_status_file)
 
-        self.load_status_file(status_file)
+    def _update_main_tab_job_status(self, job_list: List[str], api_reload: bool = False) -> Dict[str, str]:
+        """
+        Get {job: status} of running jobs, all LSF jobs are checked with one bjobs command.
+        """
+        job_status_dic = {}
+        lsf_job_dic = {}
 
-    def _update_main_tab_job_status(self, status: str, job: str, api_reload: bool = False) -> str:
-        check, job_dic = TaskJobCheckWorker.check_job_id(job_id=job)
-        new_status = ''
+        for job in job_list:
+            check, job_dic = TaskJobCheckWorker.check_job_id(job_id=job)
 
-        if check:
-            if job_dic.get('job_type') == 'LSF':
-                new_status = TaskJobCheckWorker.get_lsf_job_status(job_id=str(job_dic['job_id']), api_reload=api_reload)
-            elif job_dic.get('job_type') == 'LOCAL':
-                new_status = TaskJobCheckWorker.get_local_job_status(job_id=str(job_dic['job_id']))
+            if check:
+                if job_dic.get('job_type') == 'LSF':
+                    lsf_job_dic[str(job_dic['job_id'])] = job
+                elif job_dic.get('job_type') == 'LOCAL':
+                    job_status_dic[job] = TaskJobCheckWorker.get_local_job_status(job_id=str(job_dic['job_id']))
 
-        return new_status if new_status else status
+        if lsf_job_dic:
+            for (job_id, status) in TaskJobCheckWorker.get_lsf_job_status_batch(list(lsf_job_dic.keys()), api_reload=api_reload).items():
+                job_status_dic[lsf_job_dic[job_id]] = status
+
+        return job_status_dic
 
     def save(self, save_mode='keep'):
         """
@@ -1377,7 +1424,7 @@ Copyright © 2021 ByteDance. All Rights Reserved worldwide.""")
                     self.progress_dialog.close()
                     return
 
-                self.save_status_file(self.ifp_status_file)
+                self.save_status_file(self.ifp_status_file, export=False)
                 self.update_message_text({'message': 'Load config file "' + str(config_file) + '".', 'color': 'black'})
                 # Update self.config_dic and self.main_table_info_list with new config_file.
                 self.update_dict_by_load_config_file(config_file)
@@ -4910,20 +4957,13 @@ class GlobalEventFilter(QObject):
         return super().eventFilter(obj, event)
 
 
-def cleanup():
-    global dispatcher_process, watcher_process
-    print('Exiting, killing child processes...')
+scheduler_process = None
 
-    # if dispatcher_process:
-    #     dispatcher_process.kill()
-    #     dispatcher_process.wait()
 
-    # if watcher_process:
-    #     watcher_process.kill()
-    #     watcher_process.wait()
+def cleanup():
+    print('Exiting, killing child processes...')
 
-    for proc in [dispatcher_process, watcher_process]:
-        terminate_popen(proc)
+    terminate_popen(scheduler_process)
 
 
 def terminate_popen(p: subprocess.Popen, timeout=5):
@@ -4961,7 +5001,7 @@ def signal_handler(signum, frame):
 # Main Process #
 def main():
     signal.signal(signal.SIGINT, signal_handler)
-    global dispatcher_process, watcher_process
+    global scheduler_process
     try:
         (config_file, read, debug, auto_execute_action, title) = common.readArgs()
         data_dir = os.path.join(os.path.dirname(config_file), common.gen_cache_file_name(config_file=os.path.basename(config_file))[-1])
@@ -4985,13 +5025,9 @@ def main():
             os.makedirs(data_dir, exist_ok=True)
             common_db.initialize_database(db_path)
 
-            dispatcher_process = subprocess.Popen(
-                ['python3', os.path.join(os.path.dirname(__file__), 'job_dispatcher.py'), *sys.argv[1:]],
-                env=env,
-                start_new_session=True
-            )
-            watcher_process = subprocess.Popen(
-                ['python3', os.path.join(os.path.dirname(__file__), 'job_watcher.py'), *sys.argv[1:]],
+            # Dispatcher and watcher run in one asyncio scheduler process
+            scheduler_process = subprocess.Popen(
+                ['python3', os.path.join(os.path.dirname(__file__), 'job_scheduler.py'), *sys.argv[1:]],
                 env=env,
                 start_new_session=True
             )
@@ -1,15 +1,17 @@
 import datetime
 import os
 import re
+import selectors
 import shlex
 import sys
 import threading
 import time
 import subprocess
 import traceback
+import uuid as uuid_lib
 from concurrent.futures import ThreadPoolExecutor
 import getpass
-from typing import Union
+from typing import List, Union
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -21,6 +23,8 @@ from config import config
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
 import common
 import common_db
+import common_event
+import common_lsf
 import common_prediction
 
 log_file = os.environ.get('IFP_LOG_FILE', None)
@@ -39,18 +43,27 @@ def _drain(stream):
 class JobDispatcher:
     dispatch_lock = threading.Lock()
 
-    def __init__(self, session_factory, interval=1, max_workers=10):
+    def __init__(self, session_factory, interval=1, max_workers=10, event_fifo=None, fallback_interval=10, local_supervisor=True):
         # Initialize dispatcher with thread pool and polling interval
         self.session_factory = session_factory
         self.interval = interval
+        # Woken up by JobBuffer through event fifo, polling is only a fallback
+        self.event_fifo = event_fifo
+        self.event_channel = None
+        self.fallback_interval = fallback_interval
         self.stop_event = threading.Event()
         self.thread = threading.Thread(target=self.dispatch_loop, daemon=True)
         # self.dispatch_lock = threading.Lock()
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self.predict = True if hasattr(config, 'mem_prediction') and config.mem_prediction else False
-        self.predictor = LSFPrediction()
+        self.predictor = LSFPrediction() if self.predict else None
         self.log_dir = os.path.join(os.path.dirname(log_file), 'job_logs')
         os.makedirs(self.log_dir, exist_ok=True)
+        # Job scheduler reaps local jobs in its own event loop
+        self.local_supervisor = LocalJobSupervisor(self.session_factory) if local_supervisor else None
+        # Merge LSF jobs with identical bsub options into one job array
+        self.job_array = True if hasattr(config, 'lsf_job_array') and config.lsf_job_array else False
+        self.job_array_max_size = int(config.lsf_job_array_max_size) if hasattr(config, 'lsf_job_array_max_size') and config.lsf_job_array_max_size else 1000
 
     def start(self):
         """
@@ -64,6 +77,17 @@ class JobDispatcher:
         self.clean_obsolete_jobs()
         logger.info('[Dispatcher] Cleanup completed. Starting dispatch loop.')
 
+        if self.local_supervisor:
+            self.local_supervisor.start()
+
+        if self.event_fifo and not self.event_channel:
+            self.event_channel = common_event.open_channel(self.event_fifo)
+
+            if self.event_channel:
+                logger.info(f'[Dispatcher] Listening job notifications on {self.event_fifo}.')
+            else:
+                logger.warning(f'[Dispatcher] Failed to create {self.event_fifo}, fall back to polling every {self.interval}s.')
+
         self.stop_event.clear()
         self.thread = threading.Thread(target=self.dispatch_loop, daemon=True)
         self.thread.start()
@@ -89,7 +113,14 @@ class JobDispatcher:
         if self.thread and self.thread.is_alive():
             self.thread.join()
 
+        if self.event_channel:
+            self.event_channel.close()
+            self.event_channel = None
+
         self.executor.shutdown(wait=True)
+
+        if self.local_supervisor:
+            self.local_supervisor.stop()
         logger.info('[Dispatcher] Dispatcher stopped.')
 
     def clean_obsolete_jobs(self):
@@ -97,17 +128,14 @@ class JobDispatcher:
         Delete all jobs where status is not 'running'.
         """
         session = self.session_factory()
-        jobs_to_delete = session.query(common_db.JobStore).filter(common_db.JobStore.status != common_db.JobStatus.running).all()
-        deleted = len(jobs_to_delete)
-        for job in jobs_to_delete:
-            session.delete(job)
+        deleted = session.query(common_db.JobStore).filter(common_db.JobStore.status != common_db.JobStatus.running).delete(synchronize_session=False)
         session.commit()
         session.close()
         logger.info(f'[Dispatcher] Cleaned {deleted} obsolete jobs.')
 
     def dispatch_loop(self):
         """
-        Main dispatcher loop with periodic database polling.
+        Main dispatcher loop, wake up on job notification or periodic database polling.
         """
         while not self.stop_event.is_set():
             try:
@@ -115,32 +143,180 @@ class JobDispatcher:
                     self.dispatch_once()
             except Exception as e:
                 logger.error(f'[Dispatcher] Exception during dispatch: {str(e)}')
+
+            self.wait_for_jobs()
+
+    def wait_for_jobs(self):
+        """
+        Block until JobBuffer notifies new jobs, or fallback interval expires.
+        """
+        if self.event_channel:
+            self.event_channel.wait(self.fallback_interval)
+        else:
             time.sleep(self.interval)
 
     def dispatch_once(self):
         """
         Fetch all jobs waiting for dispatch and submit them asynchronously.
         """
+        session = self.session_factory()
+        try:
+            job_data = common_db.claim_awaiting_jobs(session)
+            session.commit()
+
+            if job_data:
+                logger.info(f'[Dispatcher] Locked {len(job_data)} jobs for dispatch.')
+
+        finally:
+            session.close()
+
+        # Predict memory of all LSF jobs in this cycle with one request, before bsub options are grouped into job arrays
+        if self.predictor and job_data:
+            self.predictor.predict_batch([job['command_file'] for job in job_data if job['job_type'] == common_db.JobType.lsf.value])
+
+        if self.job_array:
+            job_array_list, job_data = self.group_job_array(job_data)
+
+            for job_array in job_array_list:
+                self.executor.submit(self.submit_job_array, job_array)
+
+        for job in job_data:
+            self.executor.submit(self.submit_job, job)
+
+    def group_job_array(self, job_list):
         """
+        Group LSF jobs with identical bsub options, return (job_array_list, single_job_list).
+        Every item of job_array is (job, element) which element is parsed from job command file.
+        """
+        group_dic = {}
+        single_job_list = []
+
+        for job in job_list:
+            element = None
+
+            if job['job_type'] == common_db.JobType.lsf.value:
+                try:
+                    element = self.parse_job_array_element(job['command_file'])
+                except Exception as error:
+                    logger.warning(f'[Dispatcher] Failed to parse {job["command_file"]} for job array: {str(error)}')
+
+            if element:
+                group_dic.setdefault(tuple(element['options']), []).append((job, element))
+            else:
+                single_job_list.append(job)
+
+        job_array_list = []
+
+        for group in group_dic.values():
+            if len(group) < 2:
+                single_job_list.extend([job for (job, element) in group])
+                continue
+
+            for i in range(0, len(group), self.job_array_max_size):
+                job_array_list.append(group[i:i + self.job_array_max_size])
+
+        return job_array_list, single_job_list
+
+    @staticmethod
+    def parse_job_array_element(command_file):
+        """
+        Command file is "export ..." lines followed by "[cd <path>;] bsub <options> <command>".
+        Return None if the job cannot be an element of job array.
+        """
+        with open(command_file, 'r') as f:
+            lines = f.read().rstrip('\n').split('\n')
+
+        if my_match := re.match(r'^(.*?)\bbsub\b(.*)$', lines[-1]):
+            (option_list, command) = common_lsf.split_bsub_command('bsub' + my_match.group(2))
+
+            if option_list is None:
+                return None
+
+            array_option_list = common_lsf.get_job_array_options(option_list)
+
+            if array_option_list is None:
+                return None
+
+            return {'options': array_option_list,
+                    'setup': [line for line in lines[:-1] if not line.startswith('#!')],
+                    'command': my_match.group(1) + command}
+
+        return None
+
+    def submit_job_array(self, job_array):
+        """
+        Submit grouped jobs with one bsub, element i runs the command of i-th job.
         """
         session = self.session_factory()
+        uuid_list = [job['uuid'] for (job, element) in job_array]
+
         try:
-            jobs = session.query(common_db.JobStore).filter(
-                common_db.JobStore.status == common_db.JobStatus.awaiting_dispatch
-            ).all()
+            lsf_job_id = self.submit_lsf_job_array(job_array)
+            job_in_db_dic = {job.uuid: job for job in session.query(common_db.JobStore).filter(common_db.JobStore.uuid.in_(uuid_list)).all()}
 
-            for job in jobs:
-                job.status = common_db.JobStatus.dispatching
-                logger.info(f'[Dispatcher] Locking job {job.uuid} for dispatch.')
+            for (index, (job, element)) in enumerate(job_array, start=1):
+                job_in_db = job_in_db_dic.get(job['uuid'])
+
+                if job_in_db is None:
+                    logger.info('[Dispatcher] {} -> {} -> {} -> {} is not in database.'.format(job['block'], job['version'], job['flow'], job['task']))
+                    continue
+
+                job_in_db.status = common_db.JobStatus.dispatched
+
+                if lsf_job_id:
+                    job_in_db.job_id = lsf_job_id
+                    job_in_db.job_index = index
 
             session.commit()
-            job_data = [job.to_dict() for job in jobs]
+
+            if lsf_job_id:
+                logger.info(f'[Dispatcher] {len(job_array)} LSF jobs submitted as job array {lsf_job_id}.')
+            else:
+                logger.info('[Dispatcher] Failed to submit LSF job array for {}'.format(', '.join(uuid_list)))
+
+        except Exception as e:
+            logger.info(f'[Dispatcher] Exception while submitting job array: {str(e)}')
+            logger.info(f'[Dispatcher] Traceback: {traceback.format_exc()}')
 
         finally:
             session.close()
 
-        for job in job_data:
-            self.executor.submit(self.submit_job, job)
+    def submit_lsf_job_array(self, job_array) -> Union[int, None]:
+        """
+        Write one script per element and submit them with "bsub -J name[1-N]".
+        """
+        array_dir = os.path.join(self.log_dir, 'job_array', uuid_lib.uuid4().hex)
+        os.makedirs(array_dir, exist_ok=True)
+
+        for (index, (job, element)) in enumerate(job_array, start=1):
+            stdout_file = os.path.join(self.log_dir, '{}_{}_{}_{}.stdout.log'.format(job['block'], job['version'], job['task'], job['action']))
+            stderr_file = os.path.join(self.log_dir, '{}_{}_{}_{}.stderr.log'.format(job['block'], job['version'], job['task'], job['action']))
+            element_file = os.path.join(array_dir, f'{index}.sh')
+
+            with open(element_file, 'w') as f:
+                f.write('#!/bin/bash\n')
+                f.write('exec > "{}" 2> "{}"\n'.format(stdout_file, stderr_file))
+                f.write('\n'.join(element['setup'] + [element['command']]) + '\n')
+
+            os.chmod(element_file, 0o755)
+
+        (first_job, first_element) = job_array[0]
+        job_name = 'IFP_{}_{}[1-{}]'.format(first_job['block'], first_job['version'], len(job_array))
+        bsub_command = ['bsub', *first_element['options'], '-J', job_name, '-o', os.path.join(array_dir, '%I.lsf.log'), '/bin/bash {}/${{LSB_JOBINDEX}}.sh'.format(array_dir)]
+
+        try:
+            process = subprocess.run(bsub_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+
+            if match := common.get_jobid(process.stdout):
+                return int(match)
+            else:
+                logger.info(f'[Dispatcher] Failed to extract LSF Job ID. Output: {process.stdout.strip()} {process.stderr.strip()}')
+        except subprocess.TimeoutExpired:
+            logger.error('[Dispatcher] LSF job array submission timeout: {}'.format(array_dir))
+        except Exception as e:
+            logger.error(f'[Dispatcher] LSF job array submission exception: {str(e)}')
+
+        return None
 
     def submit_job(self, job):
         """
@@ -171,18 +347,8 @@ class JobDispatcher:
 
                 elif job['job_type'] == common_db.JobType.local.value:
                     logger.info('[Dispatcher] Submitting local job: {}'.format(job['command_file']))
-                    env = os.environ.copy()
-                    env.update({
-                        "UUID": uuid,
-                        "USER_COMMAND": job['command_file'],
-                        "IFP_LOG_FILE": self.log_dir,
-                        "BLOCK": job['block'],
-                        "VERSION": job['version'],
-                        "TASK": job['task'],
-                        'ACTION': job['action'],
-                    })
-                    command = '{}'.format(os.path.join(os.environ['IFP_INSTALL_PATH'], 'tools/local.sh'))
-                    process = common.spawn_process_with_env(command, shell=True, env=env)
+                    process = self.spawn_local_job(job)
+                    self.local_supervisor.add_process(uuid, process)
                     job_in_db.job_id = process.pid
                     job_in_db.status = common_db.JobStatus.dispatched
                     logger.info(f'[Dispatcher] Local job [{uuid} submitted successfully. PID: {process.pid}')
@@ -196,14 +362,28 @@ class JobDispatcher:
         finally:
             session.close()
 
+    def spawn_local_job(self, job) -> subprocess.Popen:
+        """
+        Run local job command file through tools/local.sh.
+        """
+        env = os.environ.copy()
+        env.update({
+            "UUID": job['uuid'],
+            "USER_COMMAND": job['command_file'],
+            "IFP_LOG_FILE": self.log_dir,
+            "BLOCK": job['block'],
+            "VERSION": job['version'],
+            "TASK": job['task'],
+            'ACTION': job['action'],
+        })
+        command = '{}'.format(os.path.join(os.environ['IFP_INSTALL_PATH'], 'tools/local.sh'))
+        return common.spawn_process_with_env(command, shell=True, env=env)
+
     def submit_lsf_job(self, job) -> Union[int, None]:
         """
         Submit LSF job quickly and parse Job ID.
         """
         try:
-            # if self.predict:
-            #     self.predictor.predict(command_file=command) "${LOG_DIR}/${BLOCK}_${VERSION}_${TASK}_${ACTION}.stdout.log"
-
             stdout_file = os.path.join(self.log_dir, '{}_{}_{}_{}.stdout.log'.format(job['block'], job['version'], job['task'], job['action']))
             stderr_file = os.path.join(self.log_dir, '{}_{}_{}_{}.stderr.log'.format(job['block'], job['version'], job['task'], job['action']))
 
@@ -239,19 +419,174 @@ class JobDispatcher:
         return None
 
 
+class LocalJobSupervisor:
+    """
+    Own local job processes spawned by dispatcher, get exit code as soon as child exits
+    (pidfd readiness, or Popen.poll on kernels without pidfd) and save final status into job_store.
+    """
+    def __init__(self, session_factory, fallback_interval=0.2):
+        self.session_factory = session_factory
+        self.fallback_interval = fallback_interval
+        self.use_pidfd = hasattr(os, 'pidfd_open')
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.new_process_list = []
+        # pid: (uuid, return_code), finished jobs whose status is not saved yet
+        self.finished_dic = {}
+        # pid: (uuid, process)
+        self.process_dic = {}
+        # pid: pidfd
+        self.pidfd_dic = {}
+        self.stop_event = threading.Event()
+        (self.wake_read_fd, self.wake_write_fd) = os.pipe()
+        os.set_blocking(self.wake_read_fd, False)
+        self.selector.register(self.wake_read_fd, selectors.EVENT_READ, data=None)
+        self.thread = threading.Thread(target=self.supervise_loop, daemon=True)
+
+    def start(self):
+        if not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.supervise_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake()
+
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def wake(self):
+        try:
+            os.write(self.wake_write_fd, b'1')
+        except OSError:
+            pass
+
+    def add_process(self, uuid, process):
+        with self.lock:
+            self.new_process_list.append((uuid, process))
+
+        self.wake()
+
+    def supervise_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.register_new_processes()
+                timeout = None if self.use_pidfd else self.fallback_interval
+
+                # Retry saving status which GUI has not acknowledged yet
+                if self.finished_dic:
+                    timeout = self.fallback_interval
+
+                for (key, _) in self.selector.select(timeout=timeout):
+                    if key.data is None:
+                        try:
+                            while os.read(self.wake_read_fd, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self.reap(key.data)
+
+                if not self.use_pidfd:
+                    for (pid, (uuid, process)) in list(self.process_dic.items()):
+                        if process.poll() is not None:
+                            self.reap(pid)
+
+                if self.finished_dic:
+                    self.save_finished_jobs()
+            except Exception as e:
+                logger.error(f'[Supervisor] Exception during supervising local jobs: {str(e)}')
+                time.sleep(self.fallback_interval)
+
+    def register_new_processes(self):
+        with self.lock:
+            new_process_list = self.new_process_list
+            self.new_process_list = []
+
+        for (uuid, process) in new_process_list:
+            self.process_dic[process.pid] = (uuid, process)
+
+            if self.use_pidfd:
+                try:
+                    pidfd = os.pidfd_open(process.pid)
+                    self.selector.register(pidfd, selectors.EVENT_READ, data=process.pid)
+                    self.pidfd_dic[process.pid] = pidfd
+                except OSError:
+                    # Process already exited, reap it immediately
+                    self.reap(process.pid)
+
+    def reap(self, pid):
+        if pid in self.pidfd_dic:
+            pidfd = self.pidfd_dic.pop(pid)
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+        if pid not in self.process_dic:
+            return
+
+        (uuid, process) = self.process_dic.pop(pid)
+        return_code = process.wait()
+        self.finished_dic[pid] = (uuid, return_code)
+        logger.info(f'[Supervisor] Local job {uuid} (PID: {pid}) exited with {return_code}.')
+
+    def save_finished_jobs(self):
+        """
+        Only update jobs which GUI already picked up (queued/running/undefined),
+        dispatched jobs are retried later so GUI still receives job id first.
+        """
+        session = self.session_factory()
+
+        try:
+            common_db.save_finished_local_jobs(session, self.finished_dic)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning(f'[Supervisor] Failed to save local job status: {str(e)}')
+        finally:
+            session.close()
+
+
 class LSFPrediction:
     def __init__(self):
-        self.predict_model = common_prediction.PredictionModel() if self.predict else None
+        self.predict_model = common_prediction.PredictionModel()
 
     def predict(self, command_file: str):
+        self.predict_batch([command_file])
+
+    def predict_batch(self, command_file_list: List[str]):
+        """
+        Predict memory of all command files with one request, and add "-R rusage[mem=...]" into their bsub commands.
+        """
+        job_list = []
+        predict_file_list = []
+
+        for command_file in command_file_list:
+            try:
+                command = self.read_command(command_file=command_file)
+                job_list.append((self.get_job_info(command=command), command))
+                predict_file_list.append(command_file)
+            except Exception as error:
+                logger.warning(f'[Dispatcher] Failed to read {command_file} for memory prediction: {str(error)}')
+
+        if not job_list:
+            return
+
         try:
-            command = self.read_command(command_file=command_file)
-            job_info = self.get_job_info(command=command)
-            new_command = self.predict_model.predict_job(job_info=job_info, command=command)
-            self.rewrite_command_file(command_file=command_file, new_command=new_command)
+            new_command_list = self.predict_model.predict_jobs(job_list)
         except Exception as error:
             logger.error(f'[Dispatcher] LSF Memory Prediction Failed: {str(error)}')
             logger.debug(f'[Dispatcher] Traceback: {traceback.format_exc()}')
+            return
+
+        for (command_file, (job_info, command), new_command) in zip(predict_file_list, job_list, new_command_list):
+            if new_command == command:
+                continue
+
+            try:
+                self.rewrite_command_file(command_file=command_file, new_command=new_command)
+            except Exception as error:
+                logger.error(f'[Dispatcher] Failed to rewrite {command_file} with predicted memory: {str(error)}')
 
     @staticmethod
     def rewrite_command_file(command_file: str, new_command: str):
@@ -332,7 +667,8 @@ def main():
         data_dir = os.path.join(os.path.dirname(config_file), common.gen_cache_file_name(config_file=os.path.basename(config_file))[-1])
         db_path = f'sqlite:///{os.path.join(data_dir, common_db.JobStoreTable)}'
         Session = sessionmaker(bind=create_engine(db_path, connect_args={'check_same_thread': False}))
-        dispatcher = JobDispatcher(Session, interval=1, max_workers=10)
+        event_fifo = common_event.get_event_fifo(os.path.join(data_dir, common_db.JobStoreTable))
+        dispatcher = JobDispatcher(Session, interval=1, max_workers=10, event_fifo=event_fifo)
         dispatcher.run_forever()
 
     except Exception as error:
@@ -6,25 +6,28 @@
 # Created On  : 2023-09-27 14:59:51
 # Description :
 ################################
+import concurrent.futures
 import datetime
 import getpass
+import hashlib
+import heapq
+import itertools
 import json
 import os
 import random
 import re
+import subprocess
 import sys
 import threading
 import time
 import traceback
-import pandas as pd
-from typing import Dict, Tuple
+from typing import Any, Dict, Tuple
 
 import requests
-from PyQt5.QtCore import pyqtSignal, QThread, Qt, QTimer, QObject, QEventLoop
+from PyQt5.QtCore import pyqtSignal, QThread, Qt, QTimer, QObject
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QColor, QBrush
 from PyQt5.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QTableView, QHeaderView
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 
 import common_pyqt5
 
@@ -33,7 +36,11 @@ sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
 import common
 import common_license
 import common_db
+import common_dependency
+import common_event
+import common_file_watch
 import common_prediction
+import common_resource
 
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/config')
 import config as install_config
@@ -55,17 +62,23 @@ def transfer_formula_to_list(formula):
     if formula == '':
         return []
 
-    for i in range(len(formula.split('|'))):
-        for j in range(len(formula.split('|')[i].split('&'))):
-            for k in range(len(formula.split('|')[i].split('&')[j].split(','))):
-                final_list.append(formula.split('|')[i].split('&')[j].split(',')[k])
+    or_condition_list = formula.split('|')
 
-                if k < len(formula.split('|')[i].split('&')[j].split(',')) - 1:
+    for i in range(len(or_condition_list)):
+        and_condition_list = or_condition_list[i].split('&')
+
+        for j in range(len(and_condition_list)):
+            independent_condition_list = and_condition_list[j].split(',')
+
+            for k in range(len(independent_condition_list)):
+                final_list.append(independent_condition_list[k])
+
+                if k < len(independent_condition_list) - 1:
                     final_list.append(',')
 
-            if j < len(formula.split('|')[i].split('&')) - 1:
+            if j < len(and_condition_list) - 1:
                 final_list.append('&')
-        if i < len(formula.split('|')) - 1:
+        if i < len(or_condition_list) - 1:
             final_list.append('|')
     return final_list
 
@@ -213,6 +226,7 @@ class JobManager(QThread):
     disable_gui_signal = pyqtSignal(bool)
     finish_signal = pyqtSignal(str, str, str, str)
     close_signal = pyqtSignal()
+    launch_signal = pyqtSignal()
 
     def __init__(self, ifp_obj, debug=False):
         super().__init__()
@@ -222,7 +236,23 @@ class JobManager(QThread):
         self.monitor_flag = False
         self.send_result_flag = False
         self.close_flag = False
-        self.current_running_jobs = 0
+        # Slots of RUN actions (MAX_RUNNING_JOBS, RESOURCE section of default yaml)
+        self.resource_controller = common_resource.ResourceAdmissionController()
+        # Resources refused in current launch tick, younger tasks may not take them
+        self.blocked_resource_key_set = set()
+        # Shared lmstat snapshot and licenses granted to tasks which are not checked out yet
+        self.license_service = common_license.LicenseSnapshotService(lmstat_path=install_config.lmstat_path if hasattr(install_config, 'lmstat_path') and install_config.lmstat_path else 'lmstat',
+                                                                     ttl=int(install_config.license_snapshot_ttl) if hasattr(install_config, 'license_snapshot_ttl') and install_config.license_snapshot_ttl else 30,
+                                                                     reservation_timeout=int(install_config.license_reservation_timeout) if hasattr(install_config, 'license_reservation_timeout') and install_config.license_reservation_timeout else 300)
+        # {file path: content hash} of env/command files written by this IFP
+        self.file_hash_dic = {}
+        # (VarDict, its revision, env file) of last get_env_file
+        self.env_file_cache = (None, None, None)
+        # Tasks waiting for DEPENDENCY FILE are woken when files appear
+        self.file_watch_service = common_file_watch.FileWatchService(poll_interval=float(install_config.file_watch_poll_interval) if hasattr(install_config, 'file_watch_poll_interval') and install_config.file_watch_poll_interval else 1.0)
+        # Registration of jobs on In Process Check server
+        self.in_process_check_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='in_process_check')
+        self.action_scheduler = TaskActionScheduler(max_workers=int(install_config.task_action_workers) if hasattr(install_config, 'task_action_workers') and install_config.task_action_workers else 8)
         self.job_buffer = JobBuffer(job_store=os.path.join(self.ifp_obj.ifp_cache_dir, common_db.JobStoreTable))
         self.job_store_path = f'sqlite:///{self.job_buffer.job_store}'
         self.dispatched_dic = {}
@@ -230,14 +260,15 @@ class JobManager(QThread):
         self.undispatched_uuid_list = []
         self.log_dir = os.path.join(self.ifp_obj.ifp_cache_dir, 'job_logs')
 
-        engine = create_engine(self.job_store_path, connect_args={'timeout': 30, 'check_same_thread': False})
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+        # Shares pooled engine with JobBuffer
+        self.session = common_db.get_session_factory(self.job_store_path)()
 
         # Launch Task QTimer
         self.launch_timer = QTimer(self)
         self.launch_timer.start(1000)
         self.launch_timer.timeout.connect(self.launch_task)
+        # Launch immediately for tasks woken by other threads (queued to GUI thread)
+        self.launch_signal.connect(self.launch_task)
 
         # Launch Flush QTimer
         self.flush_timer = QTimer(self)
@@ -251,6 +282,25 @@ class JobManager(QThread):
             self.debug_window.show()
 
         self.job_store_dic = {}
+        # Change feed of job_store, None means next flush loads all jobs
+        self.job_store_rev = None
+        self.full_flush_interval = 60
+        self.flush_count = 0
+        # uuid: TaskObject
+        self.task_uuid_dic = {}
+        # {block: {version: common_dependency.DependencyGraph}}
+        self.dependency_graph_dic = AutoVivification()
+        # Ready queue of launch_task (dict keeps queue order without duplicates)
+        self.ready_lock = threading.Lock()
+        self.ready_task_dic = {}
+        # Tasks whose dependency state changed, their descendants are queued on next launch tick
+        self.dependency_changed_task_dic = {}
+        # Tasks which were launchable but had to wait (max running jobs/process limit/license), retried every tick
+        self.deferred_task_dic = {}
+        # Tasks which own one action
+        self.active_task_set = set()
+        # Bumped whenever dependency state, task status or formula finish flag changes, invalidates memoized strong dependency
+        self.dependency_epoch = 0
 
     @staticmethod
     def record_formula(task_obj=None, task_formula=None, formula=None, run_time=None):
@@ -318,18 +368,20 @@ class JobManager(QThread):
     def update(self, config_dic):
 
         self.config_dic = config_dic
+        self.resource_controller.configure(self.config_dic.get('RESOURCE', {}), self.config_dic.get('VAR', {}).get('MAX_RUNNING_JOBS'))
 
         row = 0
 
-        total_tasks = AutoVivification()
+        # Task name index and adjacency of every block/version
+        last_dependency_graph_dic = self.dependency_graph_dic
+        self.dependency_graph_dic = AutoVivification()
         for block in self.config_dic['BLOCK'].keys():
             for version in self.config_dic['BLOCK'][block].keys():
-                total_tasks[block][version] = []
+                graph = common_dependency.DependencyGraph()
+                self.dependency_graph_dic[block][version] = graph
 
                 for flow in self.config_dic['BLOCK'][block][version].keys():
                     for task in self.config_dic['BLOCK'][block][version][flow].keys():
-                        total_tasks[block][version].append(task)
-
                         if self.all_tasks[block][version][flow][task] == {}:
                             task_obj = TaskObject(self.config_dic, block, version, flow, task, self.ifp_obj, self.debug_window, self)
                             task_obj.update_status_signal.connect(self.ifp_obj.update_task_status)
@@ -344,63 +396,129 @@ class JobManager(QThread):
                             self.all_tasks[block][version][flow][task].config_dic = config_dic
                             self.debug_window.row_mapping[self.all_tasks[block][version][flow][task]] = row
 
+                        graph.add_node(task, self.all_tasks[block][version][flow][task])
                         row += 1
         # update parent/child/formula
         for block in self.config_dic['BLOCK'].keys():
             for version in self.config_dic['BLOCK'][block].keys():
+                graph = self.dependency_graph_dic[block][version]
+                last_graph = last_dependency_graph_dic.get(block, {}).get(version)
+                # Same task name to task mapping, so RUN_AFTER resolves to same task objects as last update
+                graph_unchanged = isinstance(last_graph, common_dependency.DependencyGraph) and last_graph.node_dic == graph.node_dic
+
                 # No repeated tasks belongs to specific block/version
                 for flow in self.config_dic['BLOCK'][block][version].keys():
+                    flow_tasks = self.all_tasks[block][version][flow]
+
                     for task in self.config_dic['BLOCK'][block][version][flow].keys():
+                        task_object = flow_tasks[task]
 
-                        if self.all_tasks[block][version][flow][task].action:
+                        # Keep dependency of tasks which are executing, only record it in graph
+                        if task_object.action:
+                            graph.set_parents(task_object, list(task_object.parent.keys()))
                             continue
 
-                        # run_after_task = []
-                        task_formula = []
+                        # RUN_AFTER and parent edges not changed, only reset formula flags
+                        if graph_unchanged and task_object.run_after == self.config_dic['BLOCK'][block][version][flow][task].get('RUN_AFTER', {}).get('TASK', {}):
+                            parent_list = last_graph.get_parents(task_object)
 
-                        if self.config_dic['BLOCK'][block][version][flow][task].get('RUN_AFTER', {}).get('TASK', {}):
-                            run_after = self.clean_dependency(item_list=total_tasks[block][version], item=task, dependency=self.config_dic['BLOCK'][block][version][flow][task]['RUN_AFTER']['TASK'])
-                            # run_after_task = set(run_after.replace('|', '&').replace(',', '&').split('&'))
-                            task_formula = transfer_formula_to_list(run_after)
+                            if set(parent_list) == set(task_object.parent.keys()):
+                                for formula in task_object.formula_list.values():
+                                    formula['enable'] = False
+                                    formula['finish'] = False
 
-                        for prepositive_task in task_formula:
-                            if prepositive_task in ['', '&', '|', ',']:
+                                graph.set_parents(task_object, parent_list)
+                                self.debug_window.update_info(task_object)
                                 continue
 
-                            for flow2 in self.config_dic['BLOCK'][block][version].keys():
-                                for task2 in self.config_dic['BLOCK'][block][version][flow2].keys():
-                                    if prepositive_task == task2:
+                        self.update_task_dependency(block, version, flow, task, update_gui=False, task_object=task_object)
 
-                                        task_obj = self.all_tasks[block][version][flow2][prepositive_task]
+                for task_obj in graph.get_cycle_nodes():
+                    common.print_warning(f'*Warning*: RUN_AFTER of task {block}/{version}/{task_obj.flow}/{task_obj.task} is cyclic, it will never start.')
 
-                                        if task_obj not in self.all_tasks[block][version][flow][task].parent.keys():
-                                            self.all_tasks[block][version][flow][task].parent[task_obj] = 'True'
+        self.update_task_uuid_dic()
+        self.invalidate_dependency()
+        self.debug_window.update_gui(self.config_dic)
 
-                                        task_formula[task_formula.index(prepositive_task)] = task_obj
+    def update_task_dependency(self, block, version, flow, task, update_gui=True, task_object=None):
+        """
+        Rewire parent/child/formula of one task from its RUN_AFTER setting.
+        update() calls it for every task, it can be called alone when RUN_AFTER of one task changed.
+        """
+        graph = self.dependency_graph_dic[block][version]
+        task_object = task_object if task_object else self.all_tasks[block][version][flow][task]
+        task_formula = []
+        run_after = self.config_dic['BLOCK'][block][version][flow][task].get('RUN_AFTER', {}).get('TASK', {})
+        task_object.run_after = run_after
 
-                        task_object = self.all_tasks[block][version][flow][task]
-                        task_object.formula_list = {}
-                        task_formula_child = []
-                        run_time = 1
-                        if not len(task_formula) == 0:
-                            for j in range(len(task_formula)):
-                                task_obj = task_formula[j]
+        if run_after:
+            run_after = self.clean_dependency(item_list=graph.node_dic, item=task, dependency=run_after)
+            task_formula = transfer_formula_to_list(run_after)
 
-                                if not task_obj == ',' and not j == len(task_formula) - 1:
-                                    task_formula_child.append(task_obj)
-                                    continue
+        parent_list = []
+        parent_set = set()
 
-                                if j == len(task_formula) - 1:
-                                    task_formula_child.append(task_obj)
+        for (i, prepositive_task) in enumerate(task_formula):
+            if prepositive_task in ['', '&', '|', ',']:
+                continue
 
-                                formula = task_formula_child
-                                self.record_formula(task_obj=task_object, task_formula=task_formula_child, formula=formula, run_time=run_time)
-                                run_time += 1
-                                task_formula_child = []
+            task_obj = graph.get_node(prepositive_task)
 
-                        self.debug_window.update_info(task_object)
+            if task_obj is not None:
+                task_formula[i] = task_obj
+                parent_list.append(task_obj)
+                parent_set.add(task_obj)
 
-        self.debug_window.update_gui(self.config_dic)
+        # Drop parents which are not in RUN_AFTER anymore
+        for task_obj in list(task_object.parent.keys()):
+            if task_obj not in parent_set:
+                del task_object.parent[task_obj]
+
+                if task_object in task_obj.child:
+                    task_obj.child.remove(task_object)
+
+        for task_obj in parent_list:
+            if task_obj not in task_object.parent.keys():
+                task_object.parent[task_obj] = 'True'
+
+        graph.set_parents(task_object, parent_list)
+
+        task_object.formula_list = {}
+        task_formula_child = []
+        run_time = 1
+        if not len(task_formula) == 0:
+            for j in range(len(task_formula)):
+                task_obj = task_formula[j]
+
+                if not task_obj == ',' and not j == len(task_formula) - 1:
+                    task_formula_child.append(task_obj)
+                    continue
+
+                if j == len(task_formula) - 1:
+                    task_formula_child.append(task_obj)
+
+                formula = task_formula_child
+                self.record_formula(task_obj=task_object, task_formula=task_formula_child, formula=formula, run_time=run_time)
+                run_time += 1
+                task_formula_child = []
+
+        self.debug_window.update_info(task_object)
+
+        if update_gui:
+            self.invalidate_dependency()
+            self.debug_window.update_gui(self.config_dic)
+
+    def update_task_uuid_dic(self):
+        self.task_uuid_dic = {}
+
+        for block in self.all_tasks.keys():
+            for version in self.all_tasks[block].keys():
+                for flow in self.all_tasks[block][version].keys():
+                    for task in self.all_tasks[block][version][flow].keys():
+                        task_obj = self.all_tasks[block][version][flow][task]
+
+                        if isinstance(task_obj, TaskObject):
+                            self.task_uuid_dic[task_obj.uuid] = task_obj
 
     def receive_action(self, action_name, task_dic_list, run_all_steps=False):
         self.disable_gui_signal.emit(True)
@@ -513,6 +631,7 @@ class JobManager(QThread):
 
             task_obj.current_run_times = 0
 
+        self.invalidate_dependency()
         self.debug_window.update_gui(self.config_dic)
 
     def send_action(self, action_name, task_dic_list, run_all_steps=False):
@@ -547,58 +666,143 @@ class JobManager(QThread):
 
                 task_obj.receive_action(action_name, run_all_steps=run_all_steps)
 
+    def invalidate_dependency(self):
+        with self.ready_lock:
+            self.dependency_epoch += 1
+
+    def enqueue_task(self, task_obj):
+        """
+        Queue task for next launch tick, thread safe.
+        """
+        with self.ready_lock:
+            self.ready_task_dic[task_obj] = None
+
+    def wake_task(self, task_obj):
+        """
+        Task status changed, task itself and its children may become launchable.
+        """
+        with self.ready_lock:
+            self.dependency_epoch += 1
+
+            for wake_task_obj in [task_obj] + task_obj.child:
+                if wake_task_obj.action:
+                    self.ready_task_dic[wake_task_obj] = None
+
+    def get_env_file(self) -> str:
+        """
+        Shared env script which exports all VAR settings, command files source it.
+        File name has hash of its content, so there is one file for every config revision.
+        Content is only rebuilt when revision of VAR settings (VarDict) changed.
+        """
+        var_dic = self.ifp_obj.config_obj.var_dic
+        revision = var_dic.revision if isinstance(var_dic, common.VarDict) else None
+        (cache_var_dic, cache_revision, cache_env_file) = self.env_file_cache
+
+        if (revision is not None) and (cache_var_dic is var_dic) and (cache_revision == revision) and os.path.exists(cache_env_file):
+            return cache_env_file
+
+        env_content = '#!/bin/bash\n' + ''.join(['export %s="%s"\n' % (key, str(value).replace('"', '\\"')) for (key, value) in var_dic.items()])
+        env_hash = hashlib.md5(env_content.encode('utf-8')).hexdigest()[:16]
+        env_file = os.path.join(os.path.abspath(self.ifp_obj.ifp_cache_dir), 'env', 'ifp_env.%s.sh' % env_hash)
+        common.write_file_if_changed(env_file, env_content, mode=0o755, hash_dic=self.file_hash_dic)
+        self.env_file_cache = (var_dic, revision, env_file)
+
+        return env_file
+
+    def wake_file_waiting_task(self, task_obj):
+        """
+        Required files of task_obj appeared, launch it without waiting for next launch tick.
+        """
+        self.enqueue_task(task_obj)
+        self.launch_signal.emit()
+
+    def wake_dependent_tasks(self, task_obj):
+        """
+        Dependency state (parent dict) of task changed, strong dependency of all descendants is affected.
+        """
+        with self.ready_lock:
+            self.dependency_epoch += 1
+            self.dependency_changed_task_dic[task_obj] = None
+
+    def get_ready_tasks(self):
+        """
+        Drain ready queue, return tasks in main table order.
+        """
+        with self.ready_lock:
+            ready_task_dic = self.ready_task_dic
+            ready_task_dic.update(self.deferred_task_dic)
+            dependency_changed_task_list = list(self.dependency_changed_task_dic.keys())
+            self.ready_task_dic = {}
+            self.deferred_task_dic = {}
+            self.dependency_changed_task_dic = {}
+
+        # Walk descendants once for all changed tasks
+        visited_task_set = set()
+
+        while dependency_changed_task_list:
+            task_obj = dependency_changed_task_list.pop()
+
+            if task_obj in visited_task_set:
+                continue
+
+            visited_task_set.add(task_obj)
+
+            if task_obj.action:
+                ready_task_dic[task_obj] = None
+
+            dependency_changed_task_list.extend(task_obj.child)
+
+        return sorted(ready_task_dic.keys(), key=lambda task_obj: self.debug_window.row_mapping.get(task_obj, 0))
+
     def launch_task(self):
         """
         Launch task to execute action
+        Only tasks in ready queue are checked, tasks are queued when they receive action, or their status/dependency changed.
         """
 
         if not self.monitor_flag:
             return
 
-        all_finished_flag = True
-
-        for block in self.all_tasks.keys():
-            for version in self.all_tasks[block].keys():
-                for flow in self.all_tasks[block][version].keys():
-                    for task in self.all_tasks[block][version][flow].keys():
-                        task_obj = self.all_tasks[block][version][flow][task]
-
-                        # Task must already own one action
-                        if not task_obj.action:
-                            continue
-                        else:
-                            all_finished_flag = False
+        # MAX_RUNNING_JOBS can be changed in setting window without config update
+        self.resource_controller.set_limit(common_resource.TOTAL, self.config_dic.get('VAR', {}).get('MAX_RUNNING_JOBS') if self.config_dic else None)
+        self.blocked_resource_key_set = set()
+        ready_task_list = []
 
-                        # Launch when status is not killing or killed for KILL action
-                        if task_obj.action == common.action.kill:
-                            if task_obj.status not in [common.status.killing, common.status.killed]:
-                                check = self.thread_check(block, version, flow, task)
+        for task_obj in self.get_ready_tasks():
+            # Task must already own one action
+            if not task_obj.action:
+                self.resource_controller.forget(task_obj)
+                self.file_watch_service.unwatch(task_obj)
+                continue
 
-                                if not check:
-                                    continue
+            self.active_task_set.add(task_obj)
 
-                                task_obj.launch()
+            # Launch when status is not killing or killed for KILL action
+            if task_obj.action == common.action.kill:
+                launchable = task_obj.status not in [common.status.killing, common.status.killed]
+            # Launch when status is not running for RUN action
+            # If user define run_all_steps, flow will execute build before run
+            elif task_obj.action == common.action.run:
+                launchable = task_obj.status not in [common.status.building, common.status.running]
+            # Launch when status is not ING
+            else:
+                launchable = task_obj.status not in common.status_ing.values()
 
-                        # Launch when status is not running for RUN action
-                        elif task_obj.action == common.action.run:
-                            # If user define run_all_steps, flow will execute build before run
-                            if task_obj.status not in [common.status.building, common.status.running]:
-                                check = self.thread_check(block, version, flow, task)
+            # Status transition queues task again
+            if not launchable:
+                continue
 
-                                if not check:
-                                    continue
+            task_obj.resource_demand = task_obj.get_resource_demand() if task_obj.action == common.action.run else None
+            ready_task_list.append((task_obj, task_obj.resource_demand))
 
-                                task_obj.launch()
-                        # Launch when status is not ING
-                        elif task_obj.status not in common.status_ing.values():
-                            check = self.thread_check(block, version, flow, task)
+        # Queues/flows with least running tasks first, so one queue can not take all slots
+        for (task_obj, _) in self.resource_controller.get_fair_share_order(ready_task_list):
+            if task_obj.launch():
+                self.deferred_task_dic[task_obj] = None
 
-                            if not check:
-                                continue
+        self.active_task_set = {task_obj for task_obj in self.active_task_set if task_obj.action}
 
-                            task_obj.launch()
-
-        if all_finished_flag:
+        if not self.active_task_set:
             self.disable_gui_signal.emit(False)
             self.monitor_flag = False
 
@@ -608,30 +812,47 @@ class JobManager(QThread):
             if self.close_flag:
                 self.close_signal.emit()
 
-    def thread_check(self, block, version, flow, task):
-        self.ifp_obj.pnum += 2
-        is_safe, current, max_allowed = self.all_tasks[block][version][flow][task].process_monitor.is_process_count_safe(current=self.ifp_obj.pnum)
+    def admit_task(self, task_obj) -> bool:
+        """
+        Acquire resource slots for RUN action of task_obj, return False if task has to wait.
+        """
+        if not task_obj.resource_demand:
+            return True
+
+        blocking_key = self.resource_controller.try_acquire(task_obj, task_obj.resource_demand, self.blocked_resource_key_set)
 
-        if not is_safe:
-            self.all_tasks[block][version][flow][task].print_task_progress(
-                self.all_tasks[block][version][flow][task].task,
-                f"Wait! Your user is reaching the system thread/process limit (ulimit -u). "
-                f"Current usage: {current}/{max_allowed}. Please wait for existing jobs to finish."
-            )
+        if blocking_key is None:
+            return True
+
+        limit = self.resource_controller.limit_dic.get(blocking_key)
+        task_obj.print_task_progress(task_obj.task, 'Wait! %s[%s] reached!' % (common_resource.format_resource_key(blocking_key), limit))
 
-        return is_safe
+        return False
 
     def load_job_store(self, retries: int = 3, delay: int = 1):
+        """
+        Load jobs changed since last flush (all jobs on first flush and every full_flush_interval flushes).
+        Return (job_dict, rev), rev is None if job_store can not be read.
+        """
         attempt = 0
+        since_rev = self.job_store_rev
+
+        if self.flush_count % self.full_flush_interval == 0:
+            since_rev = None
 
         while attempt < retries:
             try:
-                jobs = self.session.query(common_db.JobStore).all()
+                jobs, rev = common_db.load_changed_jobs(self.session, since_rev=since_rev)
+
+                # job_store was recreated, sequence restarted
+                if since_rev is not None and rev < since_rev:
+                    jobs, rev = common_db.load_changed_jobs(self.session)
+
                 job_dict = {}
                 for job in jobs:
                     job_dict[job.uuid] = {
                         'job_type': job.job_type,
-                        'job_id': job.job_id,
+                        'job_id': job.job_key,
                         'block': job.block,
                         'version': job.version,
                         'flow': job.flow,
@@ -640,53 +861,55 @@ class JobManager(QThread):
                         'action': job.action,
                         'status': job.status,
                     }
-                return job_dict
+
+                self.session.commit()
+                return job_dict, rev
 
             except Exception:
+                self.session.rollback()
                 attempt += 1
                 time.sleep(delay)
 
-        return {}
+        return {}, None
 
     def flush_task(self):
         if self.ifp_obj.read_mode:
             return
 
         self.flush_timer.stop()
-        self.job_store_dic = self.load_job_store()
+        self.job_store_dic, rev = self.load_job_store()
         self.dispatched_dic = {}
         self.dispatched_uuid_list = []
         self.undispatched_uuid_list = []
         self.delete_uuid_list = []
         self.task_job_history_data = []
 
-        for block in self.all_tasks.keys():
-            for version in self.all_tasks[block].keys():
-                for flow in self.all_tasks[block][version].keys():
-                    for task in self.all_tasks[block][version][flow].keys():
-                        task_obj = self.all_tasks[block][version][flow][task]
-                        job_store = self.job_store_dic.get(task_obj.uuid, {})
-                        job_store_status = job_store.get('status', {})
+        # Only tasks whose job changed since last flush
+        for (uuid, job_store) in self.job_store_dic.items():
+            task_obj = self.task_uuid_dic.get(uuid)
 
-                        if not job_store:
-                            continue
+            if not task_obj or task_obj.uuid != uuid:
+                continue
+
+            (block, version, flow, task) = (task_obj.block, task_obj.version, task_obj.flow, task_obj.task)
+            job_store_status = job_store.get('status', {})
+
+            try:
+                if job_store_status in [common_db.JobStatus.dispatched]:
+                    self.flush_task_job_id(block=block, version=version, flow=flow, task=task, task_obj=task_obj)
+                else:
+                    self.flush_task_status(block=block, version=version, flow=flow, task=task, job_store=job_store)
+            except Exception as error:
+                print("error:", error)
+                print("traceback:", traceback.format_exc())
+
+        # Changes are consumed only if their follow-up updates are saved, otherwise reload them next time
+        if self.flush_task_store() and rev is not None:
+            self.job_store_rev = rev
+            self.flush_count += 1
 
-                        try:
-                            if job_store_status in [common_db.JobStatus.dispatched]:
-                                self.flush_task_job_id(block=block, version=version, flow=flow, task=task, task_obj=task_obj)
-                            else:
-                                self.flush_task_status(block=block, version=version, flow=flow, task=task, job_store=job_store)
-                            # elif job_store_action != task_obj.action and task_obj.status in [common.status.passed, common.status.failed]:
-                            #     self.flush_task_status(block=block, version=version, flow=flow, task=task, job_store=self.job_store_dic[task_obj.uuid])
-                            # elif task_obj.status in [common.status.building, common.status.killed, common.status.killing, common.status.running, common.status.checking, common.status.summarizing, common.status.releasing, common_db.JobStatus.submit_fail]:
-                            #     self.flush_task_status(block=block, version=version, flow=flow, task=task, job_store=self.job_store_dic[task_obj.uuid])
-                        except Exception as error:
-                            print("error:", error)
-                            print("traceback:", traceback.format_exc())
-
-        self.flush_task_store()
         self.send_post_execute_signal()
-        self.save_all_task_job_history_to_csv()
+        self.save_all_task_job_history()
         self.dispatched_dic = {}
         self.dispatched_uuid_list = []
         self.undispatched_uuid_list = []
@@ -708,7 +931,10 @@ class JobManager(QThread):
                         self.all_tasks[block][version][flow][task].post_execute_action(job_type, job_action, job_id)
                         self.all_tasks[block][version][flow][task].post_execute_signal.emit()
 
-    def flush_task_store(self, retry: int = 5, base_delay: float = 0.2):
+    def flush_task_store(self, retry: int = 5, base_delay: float = 0.2) -> bool:
+        if not (self.dispatched_uuid_list or self.undispatched_uuid_list or self.delete_uuid_list):
+            return True
+
         for i in range(retry):
             try:
                 self.session.execute(text("BEGIN IMMEDIATE"))
@@ -731,7 +957,7 @@ class JobManager(QThread):
                         .delete(synchronize_session=False)
 
                 self.session.commit()
-                return
+                return True
             except Exception as e:
                 msg = str(e).lower()
 
@@ -748,6 +974,8 @@ class JobManager(QThread):
                 except Exception:
                     pass
 
+        return False
+
     def flush_task_job_id(self, block: str, version: str, flow: str, task: str, task_obj: 'TaskObject'):
         job_data = self.job_store_dic[task_obj.uuid]
         job_id = job_data.get('job_id')
@@ -785,19 +1013,12 @@ class JobManager(QThread):
         except Exception:
             pass
 
-    def save_all_task_job_history_to_csv(self):
+    def save_all_task_job_history(self):
         try:
             if not self.task_job_history_data:
                 return
 
-            history_df = pd.DataFrame(self.task_job_history_data)
-            history_path = self.ifp_obj.task_window.history_cache_path
-
-            if not os.path.exists(history_path):
-                os.makedirs(os.path.dirname(history_path), exist_ok=True)
-                history_df.to_csv(history_path, index=False)
-            else:
-                history_df.to_csv(history_path, index=False, header=False, mode='a+')
+            self.ifp_obj.task_window.task_history_log.append(self.task_job_history_data)
         except Exception:
             pass
 
@@ -870,6 +1091,27 @@ class JobManager(QThread):
             return False
 
 
+class TaskParentState(dict):
+    """
+    Dependency state of parent tasks, {parent TaskObject: 'True'/'False'/'Cancel'}.
+    Any change wakes up owner task and its descendants in JobManager ready queue.
+    """
+    def __init__(self, task_obj):
+        super().__init__()
+        self.task_obj = task_obj
+
+    def __setitem__(self, key, value):
+        changed = (key not in self) or (dict.__getitem__(self, key) != value)
+        super().__setitem__(key, value)
+
+        if changed:
+            self.task_obj.job_manager.wake_dependent_tasks(self.task_obj)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.task_obj.job_manager.wake_dependent_tasks(self.task_obj)
+
+
 class TaskObject(QObject):
     update_status_signal = pyqtSignal(object, str, str)
     msg_signal = pyqtSignal(dict)
@@ -888,9 +1130,15 @@ class TaskObject(QObject):
         self.version = version
         self.flow = flow
         self.task = task
+        # Task objects are looked up in dicts/sets all the time, block/version/flow/task never change
+        self.hash = hash((self.block, self.version, self.flow, self.task))
         self.job_manager = job_manager
-        self.parent = {}
+        self.parent = TaskParentState(self)
         self.child = []
+        # Missing DEPENDENCY FILE of last check_file_and_license
+        self.missing_file_list = []
+        # RUN_AFTER setting which parent/child/formula_list are wired from
+        self.run_after = None
         self.formula_list = None
         self.current_formula_id = None
         self.current_formula = None
@@ -898,7 +1146,7 @@ class TaskObject(QObject):
         self.view_action = None
         self.killed_action = None
         self.debug = False
-        self.status = None
+        self._status = None
         self.check_status = None
         self.summarize_status = None
         self.kill_status = None
@@ -916,6 +1164,11 @@ class TaskObject(QObject):
         self.skipped = False
         self.ignore_fail = False
         self.dependency_traceback_stage = 0
+        # Resources RUN action holds while running, see JobManager.admit_task
+        self.resource_demand = None
+        # Compiled formula_list and memoized strong dependency result (epoch, [result, cancelled_num])
+        self.formula_program_cache = common_dependency.FormulaProgramCache()
+        self.strong_dependency_cache = None
         self.managed = False
         self.predict = True if hasattr(install_config, 'mem_prediction') and install_config.mem_prediction else False
         self.process_monitor = common.ProcessUsageMonitor(threshold_ratio=0.95)
@@ -929,6 +1182,9 @@ class TaskObject(QObject):
 
         self.in_process_check = True if isinstance(self.task_obj.InProcessCheck, dict) and self.task_obj.InProcessCheck.get('ENABLE') is True else False
         self.stop_event = threading.Event()
+        # Resume action generators parked in wait_for_signal/wait_execute_signal
+        self.wait_signal.connect(self.receive_wait_signal)
+        self.post_execute_signal.connect(self.receive_post_execute_signal)
         self.in_process_check_server = install_config.in_process_check_server if hasattr(install_config, 'in_process_check_server') and install_config.in_process_check_server else '10.232.134.66'
 
         self.action_progress = {common.action.build: ActionProgressObject(common.action.build),
@@ -937,7 +1193,19 @@ class TaskObject(QObject):
                                 common.action.release: ActionProgressObject(common.action.release),
                                 common.action.summarize: ActionProgressObject(common.action.summarize)}
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        if status != self._status:
+            self._status = status
+            self.job_manager.wake_task(self)
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, TaskObject):
             return False
         if self.block == other.block and self.version == other.version and self.flow == other.flow and self.task == other.task:
@@ -945,84 +1213,17 @@ class TaskObject(QObject):
         return False
 
     def __hash__(self):
-        return hash((self.block, self.version, self.flow, self.task))
+        return self.hash
 
     def print_task_progress(self, task, message, prefix=''):
         if self.action:
             self.action_progress[self.action].progress_message.append('%s %s' % (prefix, message))
 
     def calculate_strong_dependency(self, task_obj, formula_list, dependency_traceback_stage):
-        result = False
-        cancelled_num = 0
-        dependency_traceback_stage += 1
-
-        for run_time in formula_list.keys():
-            formula = formula_list[run_time]['formula']
-            new_formula_list = []
-            for i in range(len(formula)):
-                if formula[i] not in ['(', ')', '&', '|', ',']:
-                    if type(formula[i]) is list:
-                        if len(formula[i]) > 1:
-                            new_formula_list.append('(')
-
-                        for j in range(len(formula[i])):
-                            # Parent task is on-schedule
-                            if task_obj.parent[formula[i][j]] in ['False', 'Cancel']:
-                                new_formula_list.append(task_obj.parent[formula[i][j]])
-                            # Parent task do not have any pre-dependency
-                            elif not formula[i][j].formula_list:
-                                new_formula_list.append(task_obj.parent[formula[i][j]])
-                            # Calculate parent task dependency
-                            else:
-                                new_formula_list.append(self.calculate_strong_dependency(formula[i][j], formula[i][j].formula_list, dependency_traceback_stage)[0])
-
-                            if j < len(formula[i]) - 1:
-                                new_formula_list.append('&')
-
-                        if len(formula[i]) > 1:
-                            new_formula_list.append(')')
-                    else:
-                        if task_obj.parent[formula[i]] in ['False', 'Cancel']:
-                            traceback_result = task_obj.parent[formula[i]]
-                        elif not formula[i].formula_list:
-                            traceback_result = task_obj.parent[formula[i]]
-                        else:
-                            traceback_result = self.calculate_strong_dependency(formula[i], formula[i].formula_list, dependency_traceback_stage)[0]
-
-                        new_formula_list.append(traceback_result)
-                else:
-                    new_formula_list.append(formula[i])
-
-            if 'Cancel' in new_formula_list:
-                equation_wo_cancel = ''.join(str(x) for x in new_formula_list).replace('Cancel', 'False')
-                result = eval(equation_wo_cancel)
-
-                if not result:
-                    all_finish_flag = True
-                    for task_obj2 in task_obj.parent.keys():
-                        if task_obj2 in formula:
-                            if task_obj2.status in [common.status.running, common.status.queued]:
-                                all_finish_flag = False
-                                break
-
-                    if all_finish_flag:
-                        cancelled_num += 1
-
-            else:
-                result = eval(''.join(str(x) for x in new_formula_list))
-
-            if result:
-                if not formula_list[run_time]['finish']:
-                    break
-                else:
-                    continue
-
-        if 0 < task_obj.total_run_times == cancelled_num:
-            result = 'Cancel'
-        elif task_obj.total_run_times == 0 and cancelled_num > 0:
-            result = 'Cancel'
-
-        return [result, cancelled_num]
+        """
+        Return [result, cancelled_num] of task_obj, memoized until dependency states change.
+        """
+        return common_dependency.calculate_strong_dependency(task_obj, self.job_manager.dependency_epoch)
 
     def receive_view_action(self, action_name):
         self.view_action = action_name
@@ -1041,8 +1242,7 @@ class TaskObject(QObject):
                 if self.ifp_obj.rerun_check_or_summarize_before_view or self.summarize_status is None:
                     self.rerun_command_before_view = common.action.summarize
 
-        thread = threading.Thread(target=self.view)
-        thread.start()
+        self.job_manager.action_scheduler.start(self, self.view())
 
     def receive_action(self, action_name, run_all_steps=False):
         if action_name == common.action.kill:
@@ -1072,8 +1272,13 @@ class TaskObject(QObject):
             self.update_status_signal.emit(self, self.killed_action, self.status)
 
         self.update_debug_info_signal.emit(self)
+        self.job_manager.enqueue_task(self)
 
-    def launch(self):
+    def launch(self) -> bool:
+        """
+        Start action thread if dependency is satisfied.
+        Return True if task has to wait for resources (max running jobs, process limit, license) and should be retried on next launch tick.
+        """
         # self.action_progress[self.action].progress_message = []
         is_safe, current, max_allowed = self.process_monitor.is_process_count_safe(current=self.ifp_obj.pnum)
 
@@ -1081,20 +1286,18 @@ class TaskObject(QObject):
             pass
         # If pre-task is A|B for C, must avoid A and B emit C to run twice
         elif self.status in [common.status.running] and self.action == common.action.run or self.current_formula:
-            return
-        elif self.config_dic.get('VAR', {}).get('MAX_RUNNING_JOBS') and self.job_manager.current_running_jobs >= int(self.config_dic['VAR']['MAX_RUNNING_JOBS']) > 0:
-            self.print_task_progress(self.task, 'Wait! Max running jobs[%s] reached!' % self.config_dic['VAR']['MAX_RUNNING_JOBS'])
-            return
-        elif not is_safe:
+            return False
+        # LSF jobs do not start any local process, only local jobs are limited by ulimit -u
+        elif not is_safe and not self.is_lsf_action(self.action):
             self.print_task_progress(
                 self.task,
                 f"Wait! Your user is reaching the system thread/process limit (ulimit -u). "
                 f"Current usage: {current}/{max_allowed}. Please wait for existing jobs to finish."
             )
-            return
+            return True
 
         if self.is_checking_license:
-            return
+            return True
 
         if self.action == common.action.run:
             if self.formula_list:
@@ -1105,39 +1308,17 @@ class TaskObject(QObject):
                     if not self.formula_list[i]['enable']:
                         continue
 
-                    equation = transfer_formula_list_to_bool_equation(self, self.formula_list[i]['formula'])
-                    # self.print_task_progress(self.task, 'Condition-%s equation : %s' % (i, equation))
+                    (dnf, operand_list) = self.formula_program_cache.get(self.formula_list, i)
+                    (result, cancelled) = common_dependency.evaluate_formula(dnf, {task_obj: self.parent[task_obj] for task_obj in operand_list})
 
-                    if 'Cancel' in equation:
-                        equation_wo_cancel = ''.join(equation).replace('Cancel', 'False')
-                        result = eval(equation_wo_cancel)
-
-                        if not result:
-                            all_finish_flag = True
-                            for task_obj in self.parent.keys():
-                                if task_obj in self.formula_list[i]['formula']:
-                                    if task_obj.status in [common.status.running, common.status.queued]:
-                                        all_finish_flag = False
-                                        break
-
-                            if all_finish_flag:
-                                cancelled_num += 1
-                        else:
-                            if not self.formula_list[i]['finish']:
-                                self.current_formula_id = i
-                                self.current_formula = self.formula_list[i]['formula']
-                                break
-
-                    else:
-
-                        result = eval(''.join(equation))
-                        if result:
-                            if not self.formula_list[i]['finish']:
-                                self.current_formula_id = i
-                                self.current_formula = self.formula_list[i]['formula']
-                                break
-                            else:
-                                continue
+                    if cancelled and not result:
+                        if common_dependency.is_formula_finished(operand_list):
+                            cancelled_num += 1
+                    elif result:
+                        if not self.formula_list[i]['finish']:
+                            self.current_formula_id = i
+                            self.current_formula = self.formula_list[i]['formula']
+                            break
 
                 # strong dependency
                 # if result is True:
@@ -1180,21 +1361,49 @@ class TaskObject(QObject):
             # self.print_task_progress(self.task, '[RUN_ORDER] : Pre-tasks are all finished!')
             # self.set_run_time_signal.emit(self.block, self.version, self.flow, self.task, 'Runtime', None)
 
-            # if self.action == common.action.run:
-            #     self.job_manager.current_running_jobs += 1
-
             if self.action == common.action.kill:
-                thread = threading.Thread(target=self.kill_action)
+                self.job_manager.action_scheduler.start(self, self.kill_action())
             else:
                 if self.managed:
-                    return
+                    return False
+
+                if self.action == common.action.run and not self.job_manager.admit_task(self):
+                    return True
 
                 self.action_progress[self.action].progress_message = []
                 self.print_task_progress(self.task, '[RUN_ORDER] : Pre-tasks are all finished!')
                 self.stop_event = threading.Event()
-                thread = threading.Thread(target=self.manage_action)
+                self.job_manager.action_scheduler.start(self, self.manage_action())
+
+        return False
+
+    def is_lsf_action(self, action) -> bool:
+        run_action = self.config_dic['BLOCK'][self.block][self.version][self.flow][self.task].get('ACTION', {}).get(str(action).upper(), None)
+
+        if not isinstance(run_action, dict):
+            return False
 
-            thread.start()
+        return bool(re.search(r'^\s*bsub', str(run_action.get('RUN_METHOD', ''))))
+
+    def release_resources(self):
+        """
+        Release resource slots and not checked out license reservations of RUN action.
+        """
+        self.job_manager.resource_controller.release(self)
+        self.job_manager.license_service.release(self)
+
+    def get_resource_demand(self) -> Dict[Tuple[str, str], int]:
+        """
+        Queue slot, flow slot and license tokens of RUN action.
+        """
+        task_dic = self.config_dic['BLOCK'][self.block][self.version][self.flow][self.task]
+        task_var_dic = {'BLOCK': self.block, 'VERSION': self.version, 'FLOW': self.flow, 'TASK': self.task}
+        run_action = self.expand_var(task_dic['ACTION'].get(common.action.run.upper(), None), task_var_dic) or {}
+        run_dependency = self.expand_var(task_dic.get('DEPENDENCY', {}), task_var_dic) or {}
+
+        return common_resource.get_resource_demand(queue=common_resource.get_bsub_queue(str(run_action.get('RUN_METHOD', ''))),
+                                                   flow=self.flow,
+                                                   license_dic=common_resource.get_license_demand(run_dependency.get('LICENSE', [])))
 
     def get_run_method(self, run_action):
         run_method = run_action.get('RUN_METHOD', '')
@@ -1213,7 +1422,12 @@ class TaskObject(QObject):
         return run_method
 
     def check_file_and_license(self):
+        """
+        Return True if all DEPENDENCY FILE/LICENSE are ready, None if license snapshot is refreshed in background
+        (license signal is sent once it is ready), otherwise False.
+        """
         check_result = True
+        self.missing_file_list = []
 
         run_action = self.expand_var(self.config_dic['BLOCK'][self.block][self.version][self.flow][self.task]['ACTION'].get(common.action.run.upper(), None),
                                      {'BLOCK': self.block, 'VERSION': self.version, 'FLOW': self.flow, 'TASK': self.task})
@@ -1235,9 +1449,11 @@ class TaskObject(QObject):
 
                 if file and not os.path.exists(file):
                     self.print_task_progress(self.task, '[RUN_ORDER] : waiting for %s' % file)
-                    check_result = False
-                    time.sleep(5)
-                    return check_result
+                    self.missing_file_list.append(file)
+
+            if self.missing_file_list:
+                check_result = False
+                return check_result
 
         if run_dependency.get('LICENSE', []):
             required_license = run_dependency.get('LICENSE', [])
@@ -1257,53 +1473,39 @@ class TaskObject(QObject):
                         required_feature[feature] = quantity
 
                 if len(list(required_feature.keys())) > 0:
-
+                    # lmstat only needs a host of the same queue, so tasks of one queue share one license snapshot
                     run_method = self.get_run_method(run_action)
 
-                    if re.search('bsub', run_method):
-
-                        # if run_method with -K option
-                        if re.search('-K', run_method):
-                            run_method = run_method.replace('-K', '-I')
-
-                        # if run_method without -I option
-                        if not re.search('-I', run_method):
-                            run_method = run_method + ' -I'
-
                     if re.search(r'^\s*bsub', run_method):
-                        license_dic = common_license.GetLicenseInfo(lmstat_path=install_config.lmstat_path, bsub_command=run_method).get_license_info()
+                        queue = common_resource.get_bsub_queue(run_method)
+                        bsub_command = f'bsub -q {queue} -I' if queue else 'bsub -I'
                     else:
-                        license_dic = common_license.GetLicenseInfo(lmstat_path=install_config.lmstat_path).get_license_info()
-
-                    filtered_license_dic = common_license.FilterLicenseDic().run(license_dic=license_dic, feature_list=list(required_feature.keys()))
+                        bsub_command = None
 
                     for specified_feature in required_feature.keys():
                         self.print_task_progress(self.task, '[DEPENDENCY] : check %s if is sufficient' % specified_feature)
-                        total_issued = 0
-                        total_in_use = 0
-                        for license_server in filtered_license_dic.keys():
-                            for vendor_daemon in filtered_license_dic[license_server]['vendor_daemon'].keys():
-                                issued = filtered_license_dic[license_server]['vendor_daemon'][vendor_daemon]['feature'][specified_feature]['issued']
-                                in_use = filtered_license_dic[license_server]['vendor_daemon'][vendor_daemon]['feature'][specified_feature]['in_use']
-                                total_issued += int(issued)
-                                total_in_use += int(in_use)
-
-                        if int(required_feature[specified_feature]) <= (total_issued - total_in_use):
-                            pass
-                        else:
-                            self.msg_signal.emit({'message': '*Info*: waiting for {} (Required : {}, Total issued : {}, Total in used : {}) for {} {} {} {}'.format(specified_feature,
-                                                                                                                                                                    required_feature[specified_feature],
-                                                                                                                                                                    total_issued,
-                                                                                                                                                                    total_in_use,
-                                                                                                                                                                    self.block,
-                                                                                                                                                                    self.version,
-                                                                                                                                                                    self.flow,
-                                                                                                                                                                    self.task),
-                                                  'color': 'black'})
-                            self.print_task_progress(self.task, '[RUN_ORDER] : waiting for {} (Required : {}, Total issued : {}, Total in used : {})'.format(specified_feature, required_feature[specified_feature], total_issued, total_in_use))
-                            time.sleep(5)
-                            check_result = False
-                            break
+
+                    (granted, shortage_list) = self.job_manager.license_service.try_reserve(self, required_feature, bsub_command=bsub_command, callback=self.receive_license_signal)
+
+                    # lmstat is running, do not hold action worker
+                    if granted is None:
+                        return None
+
+                    for (specified_feature, required, total_issued, total_in_use, total_reserved) in shortage_list[:1]:
+                        self.msg_signal.emit({'message': '*Info*: waiting for {} (Required : {}, Total issued : {}, Total in used : {}, Reserved by IFP : {}) for {} {} {} {}'.format(specified_feature,
+                                                                                                                                                                                    required,
+                                                                                                                                                                                    total_issued,
+                                                                                                                                                                                    total_in_use,
+                                                                                                                                                                                    total_reserved,
+                                                                                                                                                                                    self.block,
+                                                                                                                                                                                    self.version,
+                                                                                                                                                                                    self.flow,
+                                                                                                                                                                                    self.task),
+                                              'color': 'black'})
+                        self.print_task_progress(self.task, '[RUN_ORDER] : waiting for {} (Required : {}, Total issued : {}, Total in used : {}, Reserved by IFP : {})'.format(specified_feature, required, total_issued, total_in_use, total_reserved))
+
+                    if not granted:
+                        check_result = False
             except Exception:
                 pass
             finally:
@@ -1352,34 +1554,23 @@ class TaskObject(QObject):
             command_dir = '%s/%s/' % (os.getcwd(), os.path.basename(self.ifp_cache_dir))
             self.working_path = cwd
 
-        # Record command
-        if not os.path.exists(command_dir):
-            os.system('mkdir -p %s' % command_dir)
-
+        # Record command, file (and command_dir) is only written when its content changed
         self.action_progress[action].current_path = command_dir
         command_file = '%s/%s_%s_%s_%s.sh' % (command_dir, action, self.block, self.version, self.task)
         self.task_run_shell = command_file
-        command_f = open(command_file, 'w')
-        command_f.write('#!/bin/bash\n')
-
-        for (key, value) in self.ifp_obj.config_obj.var_dic.items():
-            if value.find('"') != -1:
-                value = value.replace('"', '\\"')
-            command_f.write('export %s="%s"\n' % (key, value))
-
-        command_f.write(command)
-        command_f.close()
-        os.chmod(command_file, 0o755)
+        command_content = '#!/bin/bash\nsource "%s"\n%s' % (self.job_manager.get_env_file(), command)
+        common.write_file_if_changed(command_file, command_content, mode=0o755, hash_dic=self.job_manager.file_hash_dic)
         self.action_progress[action].current_command = command
 
         return cwd, command, command_file
 
-    def execute_action(self, action) -> bool:
+    def execute_action(self, action):
         """
         return waive wait signal
         """
         """
         Execute action for BUILD/RUN/CHECK/SUMMARIZE/RELEASE
+        Generator, run with "waive = yield from self.execute_action(action)".
         """
         # print(datetime.datetime.now().strftime('%Y/%m/%d %H/%M/%S'), self.block, self.version, self.flow, self.task, action, test_num)
         # Avoid kill action when task is building for Run all steps
@@ -1438,6 +1629,7 @@ class TaskObject(QObject):
                 job_store = {
                     'job_type': job_type,
                     'job_id': '',
+                    'job_index': None,
                     'block': self.block,
                     'version': self.version,
                     'flow': self.flow,
@@ -1448,23 +1640,22 @@ class TaskObject(QObject):
                 }
                 # print("in", self.task, action)
                 submitted_time = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+                # Signals received from now on belong to this job
+                self.job_manager.action_scheduler.clear_signals(self)
                 self.job_manager.job_buffer.add_job(job_store)
                 self.uuid = common_db.generate_uuid_from_components(item_list=[self.block, self.version, self.flow, self.task])
                 # print("exec in")
-                self.wait_execute_signal()
+                yield from self.wait_execute_signal()
                 # print("exec out")
 
                 while self.status == common.status.killing:
-                    time.sleep(3)
+                    yield ActionWait(timeout=3)
 
                 if self.status != common.status.killed:
                     if self.action == common.action.run:
+                        # Finished LSF jobs are saved into job history by JobHarvester of job scheduler
                         try:
-                            if job_type == common_db.JobType.lsf:
-                                save_db_thread = threading.Thread(target=common_db.analysis_and_save_job, args=(self.job_id, self.block, self.version, self.flow, self.task))
-                                save_db_thread.daemon = True
-                                save_db_thread.start()
-                            else:
+                            if job_type != common_db.JobType.lsf:
                                 file_path = os.path.join(self.ifp_obj.ifp_cache_dir, f'job_logs/{self.block}_{self.version}_{self.task}_{self.action}.job.json')
 
                                 if os.path.exists(file_path):
@@ -1591,11 +1782,6 @@ class TaskObject(QObject):
                     if return_code == 0:
                         self.status = '{} {}'.format(action, common.status.passed)
                         self.msg_signal.emit({'message': '[%s/%s/%s/%s] %s done' % (self.block, self.version, self.flow, self.task, action), 'color': 'green'})
-
-                        # Save job data to database
-                        save_db_thread = threading.Thread(target=common_db.analysis_and_save_job, args=(self.job_id, self.block, self.version, self.flow, self.task))
-                        save_db_thread.daemon = True
-                        save_db_thread.start()
                     else:
                         self.status = '{} {}'.format(action, common.status.failed)
                         self.msg_signal.emit({'message': '[%s/%s/%s/%s] %s failed: %s "%s"' % (self.block, self.version, self.flow, self.task, action, run_method, run_action['COMMAND']), 'color': 'red'})
@@ -1680,6 +1866,7 @@ class TaskObject(QObject):
             self.msg_signal.emit({
                 'message': 'In Process Check Server not found.',
                 'color': 'red'})
+            return
 
         task_var_dic = {'BLOCK': self.block, 'VERSION': self.version, 'FLOW': self.flow, 'TASK': self.task}
         path = common.expand_var(self.task_obj.InProcessCheck.get('PATH', os.getcwd()), ifp_var_dic=self.ifp_obj.config_obj.var_dic, **task_var_dic)
@@ -1703,15 +1890,27 @@ class TaskObject(QObject):
             'start_interval': start_interval
         }
 
+        # Called on GUI thread (flush_task), register in background so an unreachable server does not freeze GUI
+        self.job_manager.in_process_check_executor.submit(self.register_in_process_check, url, data, job_id)
+
+    def register_in_process_check(self, url: str, data: Dict[str, Any], job_id: str):
         try:
-            response = requests.post(url, json=data)
-        except Exception:
-            pass
+            response = requests.post(url, json=data, timeout=(3, 10))
+        except Exception as error:
+            self.msg_signal.emit({
+                'message': f'Failed to register in process check of job {job_id} on {self.in_process_check_server}: {str(error)}',
+                'color': 'red'})
+            return
+
+        if not response.ok:
+            try:
+                error = response.json().get('error', response.text)
+            except ValueError:
+                error = response.text
 
-        if not self.in_process_check_server:
             self.msg_signal.emit({
-                'message': str(response),
-                'html': True})
+                'message': f'Failed to register in process check of job {job_id} on {self.in_process_check_server}: {response.status_code} {str(error)}',
+                'color': 'red'})
 
     def update_predict_info(self, run_method: str, cwd: str, command: str) -> Dict[str, str]:
         predict_job_info = {'job_name': '',
@@ -1737,86 +1936,94 @@ class TaskObject(QObject):
         return predict_job_info
 
     def wait_for_signal(self, timeout_ms=None):
+        """
+        Park action generator until job finished (wait_signal) or task is killed.
+        """
         if self.action is None or self.action == common.action.kill:
             return
 
-        loop = QEventLoop()
-        self.wait_signal.connect(loop.quit)
-
-        if timeout_ms:
-            from PyQt5.QtCore import QTimer
-            QTimer.singleShot(timeout_ms, loop.quit)
-
-        from PyQt5.QtCore import QTimer
-        checker = QTimer()
-        checker.setInterval(100)
-        checker.timeout.connect(lambda: (loop.quit() if self.stop_event.is_set() else None))
-        checker.start()
-
-        loop.exec_()
-        checker.stop()
+        yield ActionWait(signal=ActionWait.wait, timeout=timeout_ms / 1000 if timeout_ms else None)
 
     def wait_execute_signal(self, timeout_ms=None):
+        """
+        Park action generator until job is dispatched (post_execute_signal) or task is killed.
+        """
         if self.action is None or self.action == common.action.kill:
             return
 
-        loop = QEventLoop()
-        self.post_execute_signal.connect(loop.quit)
+        yield ActionWait(signal=ActionWait.post_execute, timeout=timeout_ms / 1000 if timeout_ms else None)
 
-        if timeout_ms:
-            from PyQt5.QtCore import QTimer
-            QTimer.singleShot(timeout_ms, loop.quit)
+    def receive_wait_signal(self):
+        self.job_manager.action_scheduler.resume(self, ActionWait.wait)
 
-        from PyQt5.QtCore import QTimer
-        checker = QTimer()
-        checker.setInterval(100)
-        checker.timeout.connect(lambda: (loop.quit() if self.stop_event.is_set() else None))
-        checker.start()
+    def receive_post_execute_signal(self):
+        self.job_manager.action_scheduler.resume(self, ActionWait.post_execute)
 
-        loop.exec_()
-        checker.stop()
+    def receive_license_signal(self):
+        self.job_manager.action_scheduler.resume(self, ActionWait.license)
 
     def manage_action(self):
         """
         Manage action for BUILD/RUN/CHECK/SUMMARIZE/RELEASE
+        Generator driven by TaskActionScheduler, it yields whenever it waits for job or timer.
         """
         while not self.stop_event.is_set():
             self.managed = True
             # print("in license check")
             # Check license for RUN action
             if self.action in [common.action.run] and not self.skipped:
-                if not self.check_file_and_license():
+                check_result = self.check_file_and_license()
+
+                while check_result is None and not self.stop_event.is_set():
+                    yield ActionWait(signal=ActionWait.license, timeout=self.job_manager.license_service.ttl)
+                    check_result = self.check_file_and_license()
+
+                if not check_result:
                     self.current_formula_id = None
                     self.current_formula = None
+                    # Do not hold slots while waiting for file/license
+                    self.release_resources()
+
+                    # File watch service queues task again once all missing files exist
+                    if self.missing_file_list:
+                        self.managed = False
+                        self.job_manager.file_watch_service.watch(self, self.missing_file_list, self.job_manager.wake_file_waiting_task)
+                        return
+
+                    yield ActionWait(timeout=5)
                     self.managed = False
+                    # Retry on next launch tick
+                    self.job_manager.enqueue_task(self)
                     return
             # print("out license check")
 
             # Return if user killed task when checking license
             if not self.action:
+                self.release_resources()
                 self.managed = False
                 return
 
             if self.run_all_steps and not self.skipped:
                 self.action = common.action.build
-                waive = self.execute_action(common.action.build)
+                waive = yield from self.execute_action(common.action.build)
 
                 if not waive and self.action != common.action.kill:
-                    self.wait_for_signal()
+                    yield from self.wait_for_signal()
 
                 self.action = common.action.run
 
             # Execute action
             self.print_task_progress(self.task, '[ACTION] : Start execute %s action' % self.action)
 
+            # Slots are acquired by JobManager.admit_task, re-acquired here if RUN action is repeated for next condition
             if self.action == common.action.run:
-                self.job_manager.current_running_jobs += 1
+                self.job_manager.resource_controller.acquire(self, self.resource_demand or self.get_resource_demand())
 
-            waive = self.execute_action(self.action)
+            waive = yield from self.execute_action(self.action)
 
             if not waive and self.action != common.action.kill:
                 # print("in 1", self.task)
-                self.wait_for_signal()
+                yield from self.wait_for_signal()
                 # print("out 1", self.task)
 
             all_finished_flag = True
@@ -1832,17 +2039,18 @@ class TaskObject(QObject):
                         pass
                     else:
                         self.action = common.action.check
-                        waive = self.execute_action(common.action.check)
+                        waive = yield from self.execute_action(common.action.check)
 
                         if not waive and self.action != common.action.kill:
                             # print("in 2", self.task)
-                            self.wait_for_signal()
+                            yield from self.wait_for_signal()
                             # print("out 2", self.task)
 
                 # Judge if all conditions are finished or not
                 if self.formula_list:
                     if self.current_formula_id:
                         self.formula_list[self.current_formula_id]['finish'] = True
+                        self.job_manager.invalidate_dependency()
 
                     for i in self.formula_list.keys():
                         if self.formula_list[i]['enable'] and not self.formula_list[i]['finish']:
@@ -1857,7 +2065,7 @@ class TaskObject(QObject):
 
                     # Only first condition is passed , set True in child
                     if self.current_run_times == 1:
-                        time.sleep(2)
+                        yield ActionWait(timeout=2)
 
                         for child_task in self.child:
                             child_task.parent[self] = 'True'
@@ -1885,7 +2093,7 @@ class TaskObject(QObject):
                     else:
                         self.parent[task_obj] = 'True'
 
-                self.job_manager.current_running_jobs -= 1
+                self.release_resources()
             elif self.action == common.action.kill:
                 self.action = None
                 self.killed_action = None
@@ -1908,30 +2116,30 @@ class TaskObject(QObject):
                 else:
                     self.action = common.action.check
                     # TODO: execute check
-                    waive = self.execute_action(common.action.check)
+                    waive = yield from self.execute_action(common.action.check)
 
                     if not waive and self.action != common.action.kill:
                         # print("in 3", self.task)
-                        self.wait_for_signal()
+                        yield from self.wait_for_signal()
                         # print("out 3", self.task)
 
                 if self.status in ['{} {}'.format(common.action.run, common.status.passed), '{} {}'.format(common.action.check, common.status.passed)] or \
                         ((self.ifp_obj.ignore_fail or self.ignore_fail) and self.status in ['{} {}'.format(common.action.run, common.status.failed), '{} {}'.format(common.action.check, common.status.failed)]):
 
                     self.action = common.action.summarize
-                    waive = self.execute_action(common.action.summarize)
+                    waive = yield from self.execute_action(common.action.summarize)
 
                     if not waive and self.action != common.action.kill:
                         # print("in 4", self.task)
-                        self.wait_for_signal()
+                        yield from self.wait_for_signal()
                         # print("out 4", self.task)
 
                     self.action = common.action.release
-                    waive = self.execute_action(common.action.release)
+                    waive = yield from self.execute_action(common.action.release)
 
                     if not waive and self.action != common.action.kill:
                         # print("in 5", self.task)
-                        self.wait_for_signal()
+                        yield from self.wait_for_signal()
                         # print("out 5", self.task)
 
                     self.action = None
@@ -1939,11 +2147,13 @@ class TaskObject(QObject):
                 self.run_all_steps = False
 
             self.update_debug_info_signal.emit(self)
+            self.release_resources()
             self.managed = False
 
     def kill_action(self):
         """
         Kill action for BUILD/RUN/CHECK/SUMMARIZE/RELEASE
+        Generator driven by TaskActionScheduler.
         """
         self.status = common.status.killing
         self.msg_signal.emit({'message': '[%s/%s/%s/%s] is %s' % (self.block, self.version, self.flow, self.task, common.status.killing), 'color': 'red'})
@@ -1951,7 +2161,7 @@ class TaskObject(QObject):
 
         timeout = 0
         while self.killed_action and not self.job_id:
-            time.sleep(2)
+            yield ActionWait(timeout=2)
 
             timeout += 2
             if timeout >= 30:
@@ -1959,7 +2169,7 @@ class TaskObject(QObject):
 
         if str(self.job_id).startswith('b'):
             jobid = str(self.job_id)[2:]
-            common.run_command('bkill ' + str(jobid))
+            common.run_command("bkill '" + str(jobid) + "'")
         elif str(self.job_id).startswith('l'):
             jobid = str(self.job_id)[2:]
 
@@ -1969,19 +2179,23 @@ class TaskObject(QObject):
                 pass
 
         self.stop_event.set()
+        self.job_manager.action_scheduler.interrupt(self)
 
         self.status = common.status.killed
         # self.update_status_signal.emit(self, self.killed_action, self.status)
         self.run_all_steps = False
 
     def view(self):
+        """
+        Generator driven by TaskActionScheduler.
+        """
         if not self.ifp_obj.read_mode and self.rerun_command_before_view:
             # self.action = self.rerun_command_before_view
-            waive = self.execute_action(self.rerun_command_before_view)
+            waive = yield from self.execute_action(self.rerun_command_before_view)
             # print("is waive?", waive)
 
             if not waive:
-                self.wait_for_signal()
+                yield from self.wait_for_signal()
 
         # Run viewer command under task check directory.
         action = self.expand_var(self.config_dic['BLOCK'][self.block][self.version][self.flow][self.task]['ACTION'].get(self.view_action.split()[0].upper(), None),
@@ -2002,7 +2216,8 @@ class TaskObject(QObject):
                 if ('REPORT_FILE' in action) and action['REPORT_FILE']:
                     if (os.path.exists(action['REPORT_FILE'])) or (os.path.exists(str(action['PATH']) + '/' + str(action['REPORT_FILE']))):
                         command = str(command) + ' ' + str(action['VIEWER']) + ' ' + str(action['REPORT_FILE'])
-                        common.run_command(command)
+                        # Viewer is interactive, start it detached so it does not hold an action worker until closed
+                        subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
                     else:
                         if not re.match('^/.*$', action['REPORT_FILE']):
                             self.msg_signal.emit({'message': '      *Error*: {} REPORT_FILE "{}/{}" not exists.'.format(self.view_action, action['PATH'], action['REPORT_FILE']), 'color': 'red'})
@@ -2045,13 +2260,151 @@ class TaskObject(QObject):
             print(message)
 
 
+class ActionWait:
+    """
+    Yielded by task action generators (manage_action/kill_action/view).
+    Action is parked until signal of its task is received or timeout (seconds) passed.
+    """
+    wait = 'wait'
+    post_execute = 'post_execute'
+    license = 'license'
+
+    def __init__(self, signal=None, timeout=None):
+        self.signal = signal
+        self.timeout = timeout
+
+
+class TaskAction:
+    def __init__(self, task_obj, generator):
+        self.task_obj = task_obj
+        self.generator = generator
+        # Bumped on every park/resume, so only one of signal/timer resumes one wait
+        self.wait_id = 0
+
+
+class TaskActionScheduler:
+    """
+    Drive task action generators with a fixed worker pool instead of one thread per task.
+    Parked actions do not hold any thread, timers are kept in one heap served by one timer thread.
+    Signal which arrives before action parks is kept pending and consumed by next wait of the same signal.
+    """
+    def __init__(self, max_workers=8):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='task_action')
+        self.lock = threading.Lock()
+        self.timer_condition = threading.Condition(self.lock)
+        # (deadline, sequence, action, wait_id)
+        self.timer_heap = []
+        self.sequence = itertools.count()
+        # task_obj: {signal: [(action, wait_id)]}
+        self.waiting_dic = {}
+        # task_obj: {signal}
+        self.pending_signal_dic = {}
+        self.timer_thread = threading.Thread(target=self.timer_loop, daemon=True)
+        self.timer_thread.start()
+
+    def start(self, task_obj, generator):
+        self.executor.submit(self.step, TaskAction(task_obj, generator))
+
+    def step(self, action):
+        try:
+            wait = next(action.generator)
+        except StopIteration:
+            return
+        except Exception:
+            print(traceback.format_exc())
+            return
+
+        self.park(action, wait)
+
+    def park(self, action, wait):
+        task_obj = action.task_obj
+
+        with self.lock:
+            action.wait_id += 1
+
+            if wait.signal:
+                pending_signal_set = self.pending_signal_dic.get(task_obj, set())
+
+                # Signal already received, or task is killed
+                if wait.signal in pending_signal_set or task_obj.stop_event.is_set():
+                    pending_signal_set.discard(wait.signal)
+                    self.wake(action, action.wait_id)
+                    return
+
+                self.waiting_dic.setdefault(task_obj, {}).setdefault(wait.signal, []).append((action, action.wait_id))
+
+            if wait.timeout is not None:
+                heapq.heappush(self.timer_heap, (time.monotonic() + wait.timeout, next(self.sequence), action, action.wait_id))
+                self.timer_condition.notify()
+            elif not wait.signal:
+                self.wake(action, action.wait_id)
+
+    def wake(self, action, wait_id) -> bool:
+        """
+        Submit next step of action, self.lock must be held.
+        """
+        if action.wait_id != wait_id:
+            return False
+
+        action.wait_id += 1
+        self.executor.submit(self.step, action)
+
+        return True
+
+    def resume(self, task_obj, signal):
+        """
+        Resume actions of task_obj waiting for signal, thread safe.
+        """
+        with self.lock:
+            woken = False
+
+            for (action, wait_id) in self.waiting_dic.get(task_obj, {}).pop(signal, []):
+                woken = self.wake(action, wait_id) or woken
+
+            if not woken:
+                self.pending_signal_dic.setdefault(task_obj, set()).add(signal)
+
+    def interrupt(self, task_obj):
+        """
+        Resume all signal waits of task_obj, used when task is killed.
+        """
+        with self.lock:
+            for action_list in self.waiting_dic.pop(task_obj, {}).values():
+                for (action, wait_id) in action_list:
+                    self.wake(action, wait_id)
+
+    def clear_signals(self, task_obj):
+        with self.lock:
+            self.pending_signal_dic.pop(task_obj, None)
+
+    def timer_loop(self):
+        with self.lock:
+            while True:
+                if not self.timer_heap:
+                    self.timer_condition.wait()
+                    continue
+
+                delay = self.timer_heap[0][0] - time.monotonic()
+
+                if delay > 0:
+                    self.timer_condition.wait(delay)
+                    continue
+
+                (_, _, action, wait_id) = heapq.heappop(self.timer_heap)
+                self.wake(action, wait_id)
+
+
 class JobBuffer:
-    def __init__(self, job_store: str, batch_size: int = 100, flush_interval: int = 1):
+    def __init__(self, job_store: str, batch_size: int = 100, flush_interval: int = 1, coalesce_delay: float = 0.05):
         self.batch_size = batch_size
         self.flush_interval = flush_interval
+        # Short window to merge jobs launched in the same tick into one transaction
+        self.coalesce_delay = coalesce_delay
         self.buffer = []
         self.job_store = job_store
+        self.event_fifo = common_event.get_event_fifo(self.job_store)
         self.lock = threading.RLock()
+        self.wake_event = threading.Event()
         self.timer = threading.Thread(target=self.flush_timer, daemon=True)
         self.timer.start()
 
@@ -2061,20 +2414,27 @@ class JobBuffer:
 
             if len(self.buffer) >= self.batch_size:
                 self.flush()
+            else:
+                self.wake_event.set()
 
     def flush_timer(self):
         while True:
-            time.sleep(self.flush_interval)
+            if self.wake_event.wait(self.flush_interval):
+                time.sleep(self.coalesce_delay)
+
+            self.wake_event.clear()
             self.flush()
 
     @staticmethod
-    def save_with_retry(jobs_to_insert, job_store, retries=10, delay=0.2):
+    def save_with_retry(jobs_to_insert, job_store, retries=10, delay=0.2) -> bool:
         for attempt in range(retries):
             try:
                 common_db.save_job_store_batch(jobs_to_insert, job_store)
-                return
+                return True
             except Exception:
-                pass
+                time.sleep(delay)
+
+        return False
 
     def flush(self):
         with self.lock:
@@ -2084,7 +2444,9 @@ class JobBuffer:
             jobs_to_insert = self.buffer.copy()
             self.buffer.clear()
 
-        self.save_with_retry(jobs_to_insert, self.job_store)
+        if self.save_with_retry(jobs_to_insert, self.job_store):
+            # Wake up dispatcher immediately instead of waiting for its polling
+            common_event.notify(self.event_fifo)
 
 
 class ActionProgressObject:
@@ -0,0 +1,473 @@
+import asyncio
+import datetime
+import os
+import sys
+import time
+import traceback
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+os.environ['PYTHONUNBUFFERED'] = '1'
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']))
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/bin')
+from config import config
+import common
+import common_db
+import common_event
+import common_history
+import common_lsf
+import job_dispatcher
+import job_watcher
+
+log_file = os.environ.get('IFP_LOG_FILE', None)
+
+common.init_logger(log_path=log_file, console_log=False)
+logger = common.get_logger()
+
+
+class JobStoreWriter:
+    """
+    The only writer of job_store in scheduler process.
+    Coroutines queue write functions, writer runs them in batches, one transaction per batch.
+    """
+    def __init__(self, session, batch_delay=0.02, retry=5, base_delay=0.2):
+        self.session = session
+        self.batch_delay = batch_delay
+        self.retry = retry
+        self.base_delay = base_delay
+        self.queue = None
+
+    async def execute(self, func):
+        """
+        Queue func(session) and return its result after the batch is committed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, future))
+        return await future
+
+    async def run(self):
+        self.queue = asyncio.Queue()
+
+        while True:
+            batch = [await self.queue.get()]
+            # Merge writes queued in the same moment into one transaction
+            await asyncio.sleep(self.batch_delay)
+
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            await self.commit_batch(batch)
+
+    async def commit_batch(self, batch):
+        for i in range(self.retry):
+            try:
+                result_list = [func(self.session) for (func, future) in batch]
+                self.session.commit()
+
+                for ((func, future), result) in zip(batch, result_list):
+                    if not future.done():
+                        future.set_result(result)
+
+                return
+            except Exception as e:
+                self.session.rollback()
+
+                if ('database is locked' in str(e).lower() or 'busy' in str(e).lower()) and i < self.retry - 1:
+                    await asyncio.sleep(self.base_delay * (2 ** i))
+                    continue
+
+                logger.error(f'[Scheduler] Failed to write job_store: {str(e)}')
+
+                for (func, future) in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+                return
+
+
+class JobHarvester:
+    """
+    Post-mortem stage of finished LSF RUN jobs.
+    Watcher hands over jobs which turn passed/failed, every cycle all of them are resolved with one "bjobs -UF" (per chunk)
+    and appended into job history store with one write, passed jobs are saved into weekly job table for memory prediction too.
+    Jobs which bjobs does not report yet are retried in later cycles.
+    """
+    def __init__(self, interval=10, retry=3, chunk_size=500, history_store=None):
+        self.interval = interval
+        self.retry = retry
+        self.chunk_size = chunk_size
+        self.history_store = history_store if history_store else common_db.get_job_history_store()
+        self.mem_prediction = bool(hasattr(config, 'mem_prediction') and config.mem_prediction)
+        # job_key: {'block', 'version', 'flow', 'task', 'retry'}
+        self.pending_dic = {}
+        # Date partitions written by this process, compacted once the day is over
+        self.written_date_set = set()
+
+    def add(self, job):
+        if job.job_type == common_db.JobType.lsf and job.action == common_db.JobAction.run and job.job_id:
+            self.pending_dic[job.job_key] = {'block': job.block, 'version': job.version, 'flow': job.flow, 'task': job.task, 'retry': 0}
+
+    def take(self):
+        pending_dic = self.pending_dic
+        self.pending_dic = {}
+
+        return pending_dic
+
+    def harvest(self, pending_dic):
+        """
+        Save pending jobs into job history, return jobs which should be retried.
+        """
+        job_key_list = list(pending_dic.keys())
+        history_row_list = []
+        job_data_list = []
+        retry_dic = {}
+
+        for i in range(0, len(job_key_list), self.chunk_size):
+            chunk_key_list = job_key_list[i:i + self.chunk_size]
+            bjobs_dic = common_lsf.get_lsf_bjobs_uf_info('bjobs -UF ' + ' '.join(["'" + job_key + "'" for job_key in chunk_key_list]))
+
+            for job_key in chunk_key_list:
+                job = pending_dic[job_key]
+                job_origin_data = bjobs_dic.get(job_key)
+
+                if not job_origin_data or not job_origin_data.get('max_mem'):
+                    # Not reported (or final resource usage not collected) yet
+                    if job['retry'] < self.retry:
+                        job['retry'] += 1
+                        retry_dic[job_key] = job
+                        continue
+                    elif not job_origin_data:
+                        continue
+
+                history_row_list.append(common_history.get_job_history_row(job_origin_data, job['block'], job['version'], job['flow'], job['task']))
+
+                if self.mem_prediction and job_origin_data.get('max_mem'):
+                    try:
+                        job_data_list.append(common_db.get_job_history_data(job_origin_data, job['block'], job['version'], job['flow'], job['task']))
+                    except Exception:
+                        continue
+
+        if history_row_list:
+            self.written_date_set.update(self.history_store.append(history_row_list))
+            logger.info(f'[Harvester] Saved {len(history_row_list)} finished jobs into job history.')
+
+        if job_data_list:
+            (year, week_number) = common_db.get_week()
+            common_db.save_jobs(job_data_list, year, week_number)
+
+        self.compact()
+
+        return retry_dic
+
+    def compact(self):
+        """
+        Merge small files of past date partitions written by this process, remove files replaced by earlier compactions.
+        """
+        today = datetime.date.today().strftime('%Y-%m-%d')
+
+        for date in sorted(self.written_date_set):
+            if date < today:
+                self.history_store.compact(date)
+                self.written_date_set.discard(date)
+
+        self.history_store.purge_obsolete()
+
+
+class JobScheduler:
+    """
+    Dispatcher and watcher in one asyncio process with one job_store connection:
+    * dispatch_loop : wake up by JobBuffer notification, submit jobs with a bounded coroutine pool.
+    * watch_loop    : poll LSF status adaptively, reconcile orphan local jobs.
+    * writer        : apply all job_store updates through one session.
+    Local jobs are reaped through pidfd registered into the event loop, status is saved with the same helper as
+    job_dispatcher.LocalJobSupervisor (common_db.save_finished_local_jobs).
+    """
+    def __init__(self, db_path, event_fifo=None, max_workers=10, fallback_interval=10, local_retry_interval=0.2):
+        self.engine = create_engine(db_path, connect_args={'timeout': 30, 'check_same_thread': False})
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.session = self.session_factory()
+        self.event_fifo = event_fifo
+        self.event_channel = None
+        self.max_workers = max_workers
+        self.fallback_interval = fallback_interval
+        self.local_retry_interval = local_retry_interval
+        # Reuse submit and status query logic of standalone dispatcher/watcher
+        self.dispatcher = job_dispatcher.JobDispatcher(self.session_factory, max_workers=max_workers, local_supervisor=False)
+        poll_scheduler = job_watcher.create_poll_scheduler()
+        self.watcher = job_watcher.JobWatcher(self.session_factory, interval=poll_scheduler.min_interval, poll_scheduler=poll_scheduler)
+        self.writer = JobStoreWriter(self.session)
+        self.harvester = JobHarvester(interval=float(config.job_harvest_interval) if hasattr(config, 'job_harvest_interval') and config.job_harvest_interval else 10)
+        self.loop = None
+        self.wake_event = None
+        self.submit_semaphore = None
+        # pid: (uuid, process), local jobs owned by scheduler
+        self.local_process_dic = {}
+        # pid: (uuid, return_code), finished local jobs whose status is not saved yet
+        self.finished_local_dic = {}
+        # Keep references of fire-and-forget coroutines, event loop only holds weak references
+        self.task_set = set()
+
+    def run_forever(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.event_channel:
+                self.event_channel.close()
+
+            self.dispatcher.executor.shutdown(wait=False)
+            self.session.close()
+            logger.info('[Scheduler] Scheduler stopped.')
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wake_event = asyncio.Event()
+        self.submit_semaphore = asyncio.Semaphore(self.max_workers)
+
+        logger.info('[Scheduler] Starting job scheduler... Cleaning old jobs.')
+        self.dispatcher.clean_obsolete_jobs()
+
+        if self.event_fifo:
+            self.event_channel = common_event.open_channel(self.event_fifo)
+
+            if self.event_channel:
+                self.loop.add_reader(self.event_channel.fileno(), self.on_notify)
+                logger.info(f'[Scheduler] Listening job notifications on {self.event_fifo}.')
+            else:
+                logger.warning(f'[Scheduler] Failed to create {self.event_fifo}, fall back to polling.')
+                self.fallback_interval = 1
+
+        loop_list = [self.writer.run(), self.dispatch_loop(), self.watch_loop(), self.local_retry_loop()]
+
+        if self.harvester:
+            loop_list.append(self.harvest_loop())
+
+        await asyncio.gather(*loop_list)
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.task_set.add(task)
+        task.add_done_callback(self.on_task_done)
+        return task
+
+    def on_task_done(self, task):
+        self.task_set.discard(task)
+
+        if not task.cancelled() and task.exception():
+            logger.error(f'[Scheduler] Exception in background task: {str(task.exception())}')
+
+    def on_notify(self):
+        self.event_channel.drain()
+        self.wake_event.set()
+
+    # Dispatch (start) #
+    async def dispatch_loop(self):
+        while True:
+            try:
+                await self.dispatch_once()
+            except Exception as e:
+                logger.error(f'[Scheduler] Exception during dispatch: {str(e)}')
+
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), timeout=self.fallback_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wake_event.clear()
+
+    async def dispatch_once(self):
+        job_data = await self.writer.execute(common_db.claim_awaiting_jobs)
+
+        if not job_data:
+            return
+
+        logger.info(f'[Scheduler] Dispatching {len(job_data)} jobs.')
+
+        if self.dispatcher.predictor:
+            try:
+                await self.loop.run_in_executor(self.dispatcher.executor, self.dispatcher.predictor.predict_batch, [job['command_file'] for job in job_data if job['job_type'] == common_db.JobType.lsf.value])
+            except Exception as e:
+                logger.warning(f'[Scheduler] Exception during memory prediction: {str(e)}')
+
+        if self.dispatcher.job_array:
+            job_array_list, job_data = self.dispatcher.group_job_array(job_data)
+
+            for job_array in job_array_list:
+                self.spawn(self.submit_job_array(job_array))
+
+        for job in job_data:
+            self.spawn(self.submit_job(job))
+
+    async def submit_job(self, job):
+        uuid = job['uuid']
+        values = {common_db.JobStore.status: common_db.JobStatus.dispatched}
+
+        async with self.submit_semaphore:
+            try:
+                if job['job_type'] == common_db.JobType.lsf.value:
+                    lsf_job_id = await self.loop.run_in_executor(self.dispatcher.executor, self.dispatcher.submit_lsf_job, job)
+
+                    if lsf_job_id:
+                        values[common_db.JobStore.job_id] = lsf_job_id
+                        logger.info(f'[Scheduler] LSF job {uuid} submitted successfully. LSF Job ID: {lsf_job_id}')
+                    else:
+                        logger.info(f'[Scheduler] Failed to submit LSF job {uuid}')
+                elif job['job_type'] == common_db.JobType.local.value:
+                    process = self.dispatcher.spawn_local_job(job)
+                    self.add_local_process(uuid, process)
+                    values[common_db.JobStore.job_id] = process.pid
+                    logger.info(f'[Scheduler] Local job {uuid} submitted successfully. PID: {process.pid}')
+            except Exception as e:
+                logger.info(f'[Scheduler] Exception while submitting job {uuid}: {str(e)}')
+                logger.info(f'[Scheduler] Traceback: {traceback.format_exc()}')
+
+        await self.writer.execute(lambda session: session.execute(update(common_db.JobStore).where(common_db.JobStore.uuid == uuid).values(values)).rowcount)
+
+    async def submit_job_array(self, job_array):
+        async with self.submit_semaphore:
+            lsf_job_id = await self.loop.run_in_executor(self.dispatcher.executor, self.dispatcher.submit_lsf_job_array, job_array)
+
+        def save_job_array(session):
+            for (index, (job, element)) in enumerate(job_array, start=1):
+                values = {common_db.JobStore.status: common_db.JobStatus.dispatched}
+
+                if lsf_job_id:
+                    values.update({common_db.JobStore.job_id: lsf_job_id, common_db.JobStore.job_index: index})
+
+                session.execute(update(common_db.JobStore).where(common_db.JobStore.uuid == job['uuid']).values(values))
+
+        await self.writer.execute(save_job_array)
+        logger.info(f'[Scheduler] {len(job_array)} LSF jobs submitted as job array {lsf_job_id}.')
+    # Dispatch (end) #
+
+    # Local job supervision (start) #
+    def add_local_process(self, uuid, process):
+        self.local_process_dic[process.pid] = (uuid, process)
+
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(process.pid)
+                self.loop.add_reader(pidfd, self.reap_local_process, process.pid, pidfd)
+                return
+            except OSError:
+                pass
+
+        # No pidfd, process is polled by watch_loop
+        if process.poll() is not None:
+            self.reap_local_process(process.pid)
+
+    def reap_local_process(self, pid, pidfd=None):
+        if pidfd is not None:
+            self.loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+        if pid not in self.local_process_dic:
+            return
+
+        (uuid, process) = self.local_process_dic.pop(pid)
+        self.finished_local_dic[pid] = (uuid, process.wait())
+        logger.info(f'[Scheduler] Local job {uuid} (PID: {pid}) exited with {process.returncode}.')
+        self.spawn(self.save_local_jobs())
+
+    async def save_local_jobs(self):
+        """
+        Only update jobs which GUI already picked up, dispatched jobs are retried by watch_loop.
+        """
+        if self.finished_local_dic:
+            await self.writer.execute(lambda session: common_db.save_finished_local_jobs(session, self.finished_local_dic))
+
+    async def local_retry_loop(self):
+        """
+        Retry finished local jobs which are still dispatched (GUI has not picked them up yet).
+        """
+        while True:
+            await asyncio.sleep(self.local_retry_interval)
+
+            if self.finished_local_dic:
+                try:
+                    await self.save_local_jobs()
+                except Exception as e:
+                    logger.warning(f'[Scheduler] Failed to save local jobs: {str(e)}')
+    # Local job supervision (end) #
+
+    # Watch (start) #
+    async def watch_loop(self):
+        while True:
+            start = time.monotonic()
+
+            try:
+                await self.watch_once()
+            except Exception as e:
+                logger.warning(f'[Scheduler] Exception during watching: {str(e)}')
+
+            await asyncio.sleep(max(0.0, self.watcher.interval - (time.monotonic() - start)))
+
+    async def watch_once(self):
+        for (pid, (uuid, process)) in list(self.local_process_dic.items()):
+            if process.poll() is not None:
+                self.reap_local_process(pid)
+
+        await self.save_local_jobs()
+
+        jobs = self.session.query(common_db.JobStore).filter(common_db.JobStore.status.in_(job_watcher.ACTIVE_STATUS_LIST)).all()
+        self.session.expunge_all()
+        # Local jobs owned by scheduler are reaped through pidfd, watcher only handles orphans
+        owned_pid_set = set(self.local_process_dic.keys()) | set(self.finished_local_dic.keys())
+        jobs = [job for job in jobs if not (job.job_type == common_db.JobType.local and job.job_id in owned_pid_set)]
+
+        if not jobs:
+            return
+
+        status_dic = await self.loop.run_in_executor(self.dispatcher.executor, self.watcher.get_job_status_updates, jobs)
+
+        if status_dic:
+            await self.writer.execute(lambda session: common_db.update_job_status(session, status_dic, status_list=job_watcher.ACTIVE_STATUS_LIST))
+
+            if self.harvester:
+                for job in jobs:
+                    if status_dic.get(job.uuid) in (common_db.JobStatus.passed.value, common_db.JobStatus.failed.value):
+                        self.harvester.add(job)
+    # Watch (end) #
+
+    # Harvest (start) #
+    async def harvest_loop(self):
+        while True:
+            await asyncio.sleep(self.harvester.interval)
+            pending_dic = self.harvester.take()
+
+            if not pending_dic:
+                continue
+
+            try:
+                retry_dic = await self.loop.run_in_executor(self.dispatcher.executor, self.harvester.harvest, pending_dic)
+            except Exception as e:
+                logger.warning(f'[Scheduler] Exception during harvesting: {str(e)}')
+                continue
+
+            for (job_key, job) in retry_dic.items():
+                self.harvester.pending_dic.setdefault(job_key, job)
+    # Harvest (end) #
+
+
+def main():
+    try:
+        config_file, read, _, _, _ = common.readArgs()
+
+        if read:
+            return
+
+        data_dir = os.path.join(os.path.dirname(config_file), common.gen_cache_file_name(config_file=os.path.basename(config_file))[-1])
+        job_store = os.path.join(data_dir, common_db.JobStoreTable)
+        scheduler = JobScheduler(f'sqlite:///{job_store}', event_fifo=common_event.get_event_fifo(job_store), max_workers=10)
+        scheduler.run_forever()
+
+    except Exception as error:
+        logger.error(traceback.format_exc())
+        logger.error(f'*Error*: {str(error)}.')
+
+
+if __name__ == '__main__':
+    main()
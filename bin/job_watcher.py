@@ -11,9 +11,12 @@ from sqlalchemy import create_engine
 
 os.environ['PYTHONUNBUFFERED'] = '1'
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']))
+from config import config
+
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
 import common
 import common_db
+import common_lsf
 
 
 log_file = os.environ.get('IFP_LOG_FILE', None)
@@ -22,10 +25,91 @@ common.init_logger(log_path=log_file, console_log=False)
 logger = common.get_logger()
 
 
+ACTIVE_STATUS_LIST = [common_db.JobStatus.queued, common_db.JobStatus.running, common_db.JobStatus.undefined]
+
+
+def get_config_value(key, default):
+    value = getattr(config, key, None)
+    return type(default)(value) if value else default
+
+
+def create_poll_scheduler():
+    """
+    Create AdaptivePollScheduler with watcher settings of config.py.
+    """
+    return AdaptivePollScheduler(min_interval=get_config_value('watcher_min_interval', 2),
+                                 max_interval=get_config_value('watcher_max_interval', 120),
+                                 backoff_factor=get_config_value('watcher_backoff_factor', 1.5),
+                                 queries_per_minute=get_config_value('watcher_lsf_queries_per_minute', 60))
+
+
+class AdaptivePollScheduler:
+    """
+    Decide which LSF jobs are due for polling.
+    New jobs and jobs which just changed status are polled every min_interval seconds,
+    unchanged jobs (pending or long running) back off exponentially up to max_interval.
+    bjobs queries are limited by a token bucket of queries_per_minute.
+    """
+    def __init__(self, min_interval=2, max_interval=120, backoff_factor=1.5, queries_per_minute=60):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff_factor = max(backoff_factor, 1.0)
+        self.queries_per_minute = max(queries_per_minute, 1)
+        self.tokens = float(self.queries_per_minute)
+        self.last_refill = time.monotonic()
+        # job_key: {'status': <last status>, 'interval': <current interval>, 'next_poll': <monotonic time>}
+        self.job_dic = {}
+
+    def get_due_jobs(self, job_key_list, chunk_size):
+        """
+        Return due job keys (most overdue first) which fit into current query budget.
+        """
+        now = time.monotonic()
+
+        # Forget finished jobs, new jobs are due immediately
+        self.job_dic = {job_key: self.job_dic.get(job_key, {'status': None, 'interval': self.min_interval, 'next_poll': now}) for job_key in job_key_list}
+        due_job_list = sorted([job_key for (job_key, job_info) in self.job_dic.items() if job_info['next_poll'] <= now], key=lambda job_key: self.job_dic[job_key]['next_poll'])
+
+        if not due_job_list:
+            return []
+
+        self.refill(now)
+        query_num = min(int(self.tokens), (len(due_job_list) + chunk_size - 1) // chunk_size)
+        self.tokens -= query_num
+
+        return due_job_list[:query_num * chunk_size]
+
+    def refill(self, now):
+        self.tokens = min(float(self.queries_per_minute), self.tokens + (now - self.last_refill) * self.queries_per_minute / 60.0)
+        self.last_refill = now
+
+    def update(self, job_key, status):
+        """
+        Reset interval when status changed, otherwise back off.
+        """
+        job_info = self.job_dic.get(job_key)
+
+        if job_info is None:
+            return
+
+        if status != job_info['status']:
+            job_info['interval'] = self.min_interval
+        else:
+            job_info['interval'] = min(job_info['interval'] * self.backoff_factor, self.max_interval)
+
+        job_info['status'] = status
+        job_info['next_poll'] = time.monotonic() + job_info['interval']
+
+
 class JobWatcher:
-    def __init__(self, session_factory, interval=5):
+    def __init__(self, session_factory, interval=5, bjobs='bjobs', bjobs_chunk_size=5000, poll_scheduler=None):
         self.session_factory = session_factory
         self.interval = interval
+        self.bjobs = bjobs
+        self.bjobs_chunk_size = bjobs_chunk_size
+        self.poll_scheduler = poll_scheduler if poll_scheduler else AdaptivePollScheduler(min_interval=interval)
+        self.orphan_grace = 10
+        self.local_dead_since_dic = {}
         self.stop_event = threading.Event()
         self.thread = threading.Thread(target=self.watch_loop, daemon=True)
         self.log_dir = os.path.join(os.path.dirname(log_file), 'job_logs')
@@ -70,20 +154,37 @@ class JobWatcher:
 
     def watch_once(self):
         session = self.session_factory()
-        jobs = session.query(common_db.JobStore).filter(common_db.JobStore.status.in_([common_db.JobStatus.queued, common_db.JobStatus.running, common_db.JobStatus.undefined])).all()
+        jobs = session.query(common_db.JobStore).filter(common_db.JobStore.status.in_(ACTIVE_STATUS_LIST)).all()
+        status_dic = self.get_job_status_updates(jobs)
+
+        if status_dic:
+            common_db.update_job_status(session, status_dic, status_list=ACTIVE_STATUS_LIST)
+
+        session.commit()
+        session.close()
 
+    def get_job_status_updates(self, jobs):
+        """
+        Return {uuid: new status value} for jobs whose status changed.
+        """
+        status_dic = {}
         lsf_jobs = [job for job in jobs if job.job_type == common_db.JobType.lsf]
         local_jobs = [job for job in jobs if job.job_type == common_db.JobType.local]
 
-        lsf_status_map = self.batch_get_lsf_job_status([str(job.job_id) for job in lsf_jobs])
+        due_lsf_job_keys = set(self.poll_scheduler.get_due_jobs([job.job_key for job in lsf_jobs], self.bjobs_chunk_size))
+        lsf_status_map = self.batch_get_lsf_job_status(list(due_lsf_job_keys))
         local_status_map = self.batch_get_local_job_status([int(job.job_id) for job in local_jobs])
 
         for job in jobs:
             try:
                 if job.job_type == common_db.JobType.lsf:
-                    status = lsf_status_map.get(str(job.job_id), common_db.JobStatus.undefined.value)
+                    if job.job_key not in due_lsf_job_keys:
+                        continue
+
+                    status = lsf_status_map.get(job.job_key, common_db.JobStatus.undefined.value)
+                    self.poll_scheduler.update(job.job_key, status)
                 elif job.job_type == common_db.JobType.local:
-                    status = local_status_map.get(str(job.job_id), common_db.JobStatus.undefined.value)
+                    status = local_status_map.get(str(job.job_id))
 
                     if status == common_db.JobStatus.passed.value:
                         log_json = os.path.join(self.log_dir, f'{job.block}_{job.version}_{job.task}_{job.action.value}.job.json')
@@ -100,78 +201,68 @@ class JobWatcher:
                 else:
                     status = None
 
-                if status and status != job.status:
-                    job.status = status
+                if status and (job.status is None or status != job.status.value):
+                    status_dic[job.uuid] = status
 
             except Exception as e:
                 logger.error(f'[Watcher] Error watching job {job.uuid}: {str(e)}')
 
-        session.commit()
-        session.close()
+        return status_dic
 
     def handle_completed_job(self, job):
         pass
 
-    @staticmethod
-    def batch_get_lsf_job_status(job_ids):
+    def batch_get_lsf_job_status(self, job_ids):
+        """
+        Query all LSF jobs with structured bjobs output, return {job_id: JobStatus value}.
+        """
         status_map = {}
 
         if not job_ids:
             return status_map
 
-        job_id_str = ' '.join(job_ids)
-
         try:
-            output = os.popen(f'bjobs {job_id_str}').read()
-
-            for line in output.strip().split('\n'):
-                if line.startswith('JOBID'):
-                    continue  # Skip header
-
-                parts = line.strip().split()
-                if len(parts) < 3:
-                    continue  # Skip invalid lines
-
-                job_id = parts[0]
-                job_status = parts[2]
-
-                if job_status == 'RUN':
-                    status_map[job_id] = common_db.JobStatus.running.value
-                elif job_status == 'DONE':
-                    status_map[job_id] = common_db.JobStatus.passed.value
-                elif job_status == 'EXIT':
-                    status_map[job_id] = common_db.JobStatus.failed.value
-                elif job_status == 'PEND' or job_status == 'QUEUE':
-                    status_map[job_id] = common_db.JobStatus.queued.value
-                else:
-                    continue
-                    # status_map[job_id] = common_db.JobStatus.undefined.value
+            job_dic = common_lsf.get_bjobs_status_info(job_ids, bjobs=self.bjobs, chunk_size=self.bjobs_chunk_size)
+
+            for (job_id, job_info) in job_dic.items():
+                status = common_db.LSF_JOB_STATUS_MAP.get(job_info['status'])
+
+                if status is None:
+                    logger.warning(f'[Watcher] Unknown LSF status "{job_info["status"]}" for job {job_id}.')
+                    status = common_db.JobStatus.undefined
+
+                status_map[job_id] = status.value
 
         except Exception as e:
-            print(e)
-            print(traceback.format_exc())
             logger.info(f'[Watcher] Batch LSF query exception: {str(e)}')
+            logger.debug(f'[Watcher] Traceback: {traceback.format_exc()}')
 
         return status_map
 
-    @staticmethod
-    def batch_get_local_job_status(pids):
-        status_map = {str(pid): common_db.JobStatus.passed.value for pid in pids}  # Default: assume finished
+    def batch_get_local_job_status(self, pids):
+        """
+        Local jobs are reaped by LocalJobSupervisor of dispatcher which saves exit status directly.
+        Watcher only checks the given PIDs, and treats a dead PID as finished after orphan_grace seconds,
+        which only happens for jobs whose dispatcher is gone (for example IFP was restarted).
+        """
+        status_map = {}
+        now = time.monotonic()
+        dead_since_dic = {}
 
-        try:
-            all_processes = {proc.pid: proc for proc in psutil.process_iter(['pid', 'status'])}
+        for pid in pids:
+            try:
+                if psutil.pid_exists(pid) and psutil.Process(pid).status() != psutil.STATUS_ZOMBIE:
+                    status_map[str(pid)] = common_db.JobStatus.running.value
+                    continue
+            except psutil.Error:
+                pass
 
-            for pid in pids:
-                proc = all_processes.get(pid)
-                if proc:
-                    if proc.status() == psutil.STATUS_ZOMBIE:
-                        os.waitpid(pid, 0)
-                    else:
-                        status_map[str(pid)] = common_db.JobStatus.running.value
+            dead_since_dic[pid] = self.local_dead_since_dic.get(pid, now)
 
-        except Exception as e:
-            logger.error(f'[Watcher] Batch local query exception: {str(e)}')
+            if now - dead_since_dic[pid] >= self.orphan_grace:
+                status_map[str(pid)] = common_db.JobStatus.passed.value
 
+        self.local_dead_since_dic = dead_since_dic
         return status_map
 
 
@@ -185,7 +276,8 @@ def main():
         data_dir = os.path.join(os.path.dirname(config_file), common.gen_cache_file_name(config_file=os.path.basename(config_file))[-1])
         db_path = f'sqlite:///{os.path.join(data_dir, common_db.JobStoreTable)}'
         Session = sessionmaker(bind=create_engine(db_path, connect_args={'check_same_thread': False}))
-        watcher = JobWatcher(Session, interval=5)
+        poll_scheduler = create_poll_scheduler()
+        watcher = JobWatcher(Session, interval=poll_scheduler.min_interval, poll_scheduler=poll_scheduler)
         watcher.run_forever()
 
     except Exception as error:
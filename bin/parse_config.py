@@ -506,11 +506,11 @@ class Config:
         self.api_file_mtime = datetime.datetime.strptime('2100-01-01', '%Y-%m-%d')
         # self.var_dic saves all VAR settings from user config file.
         cache_file_path = os.path.join(os.getcwd(), common.gen_cache_file_name(os.path.basename(config_file))[0])
-        self.var_dic = {'IFP_INSTALL_PATH': os.environ['IFP_INSTALL_PATH'],
+        self.var_dic = common.VarDict({'IFP_INSTALL_PATH': os.environ['IFP_INSTALL_PATH'],
                         'CWD': common.CWD,
                         'IFP_CONFIG_FILE': os.path.abspath(config_file),
                         'IFP_STATUS_FILE': cache_file_path
-                        }
+                        })
         # self.block_dic saves all block configuration information.
         self.block_dic = {}
         # self.task_dic saves all task configuration information.
@@ -635,8 +635,7 @@ class Config:
 
                         self.block_dic.update({block: block_obj})
 
-        for attr in self.var_dic.keys():
-            self.var_dic[attr] = common.expand_var(self.var_dic[attr], ifp_var_dic=self.var_dic, show_warning=False)
+        common.get_variable_resolver(self.var_dic).resolve_all(show_warning=False)
 
     def find_available_api_yaml(self, config_file: str) -> str:
         api_yaml = self.user_config_dic['API_YAML'].strip()
@@ -880,6 +879,7 @@ class Config:
         config_dic = {'PROJECT': self.PROJECT,
                       'GROUP': self.GROUP,
                       'VAR': self.var_dic,
+                      'RESOURCE': self.default_config_dic.get('RESOURCE', {}) if isinstance(self.default_config_dic.get('RESOURCE'), dict) else {},
                       'BLOCK': {}}
 
         if self.block_dic:
@@ -37,6 +37,7 @@ import job_manager
 import config
 import common
 import common_db
+import common_history
 import common_pyqt5
 import common_lsf
 import parse_config
@@ -216,7 +217,7 @@ class TaskJobCheckWorker(QThread):
 
     @staticmethod
     def check_job_id(job_id: str) -> Tuple[bool, Dict[str, str]]:
-        if my_match := re.match(r'^b:(\d+)$', job_id):
+        if my_match := re.match(r'^b:(\d+(\[\d+\])?)$', job_id):
             job_id = my_match.group(1)
             job_type = 'LSF'
         elif my_match := re.match(r'^l:(\d+)$', job_id):
@@ -268,10 +269,23 @@ class TaskJobCheckWorker(QThread):
     @staticmethod
     def get_lsf_job_status(job_id: str, api_reload: bool = False) -> str:
         try:
-            status = os.popen(f'bjobs {job_id} | tail -n 1').read().split()[2]
+            status = os.popen(f"bjobs '{job_id}' | tail -n 1").read().split()[2]
         except Exception:
             status = ' '
 
+        return TaskJobCheckWorker.convert_lsf_job_status(status=status, api_reload=api_reload)
+
+    @staticmethod
+    def get_lsf_job_status_batch(job_id_list: List[str], api_reload: bool = False) -> Dict[str, str]:
+        """
+        Get {job_id: status} of all jobs with one bjobs command, jobs not found get ' '.
+        """
+        bjobs_dic = common_lsf.get_bjobs_status_info(job_id_list)
+
+        return {job_id: TaskJobCheckWorker.convert_lsf_job_status(status=bjobs_dic.get(str(job_id), {}).get('status', ' '), api_reload=api_reload) for job_id in job_id_list}
+
+    @staticmethod
+    def convert_lsf_job_status(status: str, api_reload: bool = False) -> str:
         if status == 'RUN':
             return common.status.running if api_reload else ' '
         elif status == 'DONE':
@@ -349,8 +363,9 @@ class UserConfig(QMainWindow):
         self.view_status_dic = {}
         self.task_cache = AutoVivification()
         self.info_cache_path = os.path.join(self.ifp_obj.ifp_cache_dir, 'INFO/{BLOCK}/{VERSION}/{FLOW}/{TASK}/task.json')
+        # summary.csv is written by older IFP, only read for tasks which have no record in task history log
         self.history_cache_path = os.path.join(self.ifp_obj.ifp_cache_dir, 'SUMMARY/summary.csv')
-        self.history_cache_df = pd.DataFrame(columns=['block', 'version', 'flow', 'task', 'job_id', 'timestamp'])
+        self.task_history_log = common_history.TaskHistoryLog(os.path.join(self.ifp_obj.ifp_cache_dir, 'SUMMARY/task_history'))
 
         self.view_status_dic.setdefault('column', {})
 
@@ -794,15 +809,6 @@ class UserConfig(QMainWindow):
         self.draw_table(self.task_setting)
         self.parsing_user_setting()
         self.ifp_monitor.wake_up = True
-        self._catch_task_status()
-
-    def _catch_task_status(self):
-        for block in self.ifp_obj.job_manager.all_tasks:
-            for version in self.ifp_obj.job_manager.all_tasks[block]:
-                for flow in self.ifp_obj.job_manager.all_tasks[block][version]:
-                    for task in self.ifp_obj.job_manager.all_tasks[block][version][flow]:
-                        task_obj = self.ifp_obj.job_manager.all_tasks[block][version][flow][task]
-                        task_obj.set_one_jobid_signal.connect(self._update_task_cache)
 
     def save(self, *args):
         self.parsing_final_setting()
@@ -1325,19 +1331,6 @@ class UserConfig(QMainWindow):
         self.draw_table(self.task_setting)
         self.save()
 
-    def _update_task_cache(self, block: str, version: str, flow: str, task: str, _: str, job_id: str):
-        check, job_dic = TaskJobCheckWorker.check_job_id(job_id=job_id)
-
-        if job_dic.get('job_type') == 'LSF':
-            self.history_cache_df.loc[len(self.history_cache_df)] = [block, version, flow, task, job_dic.get('job_id', ''), int(datetime.datetime.now().timestamp())]
-
-    def save_cache(self):
-        if not os.path.exists(self.history_cache_path):
-            os.makedirs(os.path.dirname(self.history_cache_path), exist_ok=True)
-            self.history_cache_df.to_csv(self.history_cache_path, index=False)
-        else:
-            self.history_cache_df.to_csv(self.history_cache_path, index=False, header=False, mode='a+')
-
 
 class IFPMonitor(QObject):
     message = pyqtSignal(dict)
@@ -5594,23 +5587,46 @@ class WindowForTaskJobInfo(QMainWindow):
         job_id = ''
         find = False
         job_info = {}
+        (block, version, flow, task) = (self.task_obj.block, self.task_obj.version, self.task_obj.flow, self.task_obj.task)
 
         try:
-            if os.path.exists(self.user_obj.history_cache_path):
+            # Task history log is chained per task, only the jobs of this task are read
+            history_list = self.user_obj.task_history_log.get_task_history(block, version, flow, task)
+
+            if history_list:
+                return True, history_list[0]['job_id'], history_list
+
+            # Finished jobs harvested into job history store, task predicates are pushed down into Parquet files.
+            # Recent date partitions first, the window is only widened when it has no job of this task
+            history_store = common_db.get_job_history_store()
+            end_date = datetime.date.today()
+
+            for window_days in [7, 30, 365, None]:
+                filtered_df = history_store.query_df(start_date=(end_date - datetime.timedelta(days=window_days)).strftime('%Y-%m-%d') if window_days else None,
+                                                     end_date=end_date.strftime('%Y-%m-%d') if window_days else None,
+                                                     columns=['block', 'version', 'flow', 'task', 'job_id', 'finish_time'],
+                                                     block=block,
+                                                     version=version,
+                                                     flow=flow,
+                                                     task=task).rename(columns={'finish_time': 'timestamp'})
+
+                if not filtered_df.empty:
+                    break
+
+            if filtered_df.empty and os.path.exists(self.user_obj.history_cache_path):
                 df = self.tail_csv_with_headers(filename=self.user_obj.history_cache_path)
-                filtered_df = df[(df['block'] == self.task_obj.block) &
-                                 (df['version'] == self.task_obj.version) &
-                                 (df['flow'] == self.task_obj.flow) &
-                                 (df['task'] == self.task_obj.task)]
+                filtered_df = df[(df['block'] == block) &
+                                 (df['version'] == version) &
+                                 (df['flow'] == flow) &
+                                 (df['task'] == task)]
 
+            if not filtered_df.empty:
                 job_info = filtered_df.to_dict(orient='records')
+                max_index = filtered_df['timestamp'].idxmax()
+                job_id = filtered_df.loc[max_index, 'job_id']
 
-                if not filtered_df.empty:
-                    max_index = filtered_df['timestamp'].idxmax()
-                    job_id = filtered_df.loc[max_index, 'job_id']
-
-                    if job_id:
-                        find = True
+                if job_id:
+                    find = True
         except Exception:
             return False, '', {}
 
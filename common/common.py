@@ -1,8 +1,9 @@
 import argparse
-import copy
+import collections
 import datetime
 import functools
 import getpass
+import hashlib
 import json
 import logging
 import os
@@ -973,12 +974,204 @@ def profile_function_stats(stats_dict, name=None):
     return decorator
 
 
+class VarDict(dict):
+    """
+    VAR settings dict which counts its changes, so VariableResolver memoized on it knows when to drop its cache.
+    """
+    # Unpickling sets items before instance state is restored
+    revision = 0
+    resolver = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.revision = 0
+        self.resolver = None
+
+    def __getstate__(self):
+        # Copies (deepcopy/pickle) build their own resolver
+        return {'revision': self.revision, 'resolver': None}
+
+    def changed(self):
+        self.revision += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+
+    def pop(self, *args):
+        self.changed()
+        return super().pop(*args)
+
+    def popitem(self):
+        self.changed()
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.changed()
+        return super().setdefault(key, default)
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+
+class VariableResolver:
+    """
+    Expand ${VAR} settings on one var_dic without copying it.
+    Lookup order is CWD/USER, task context (BLOCK/VERSION/FLOW/TASK ...), then var_dic.
+    Expansions are memoized by (setting string, context), cache is dropped when VarDict revision changes.
+    Self/cyclic references are reported instead of looping forever.
+    """
+    def __init__(self, var_dic):
+        self.var_dic = var_dic
+        self.revision = getattr(var_dic, 'revision', None)
+        self.lock = threading.Lock()
+        # (setting_str, context_key): (expanded string, warning)
+        self.cache = {}
+
+    def expand(self, setting_str: str, context: dict):
+        """
+        Return (expanded string, warning), warning is None on success.
+        """
+        common_var = {'CWD': CWD, 'USER': USER}
+
+        try:
+            cache_key = (setting_str, tuple(sorted(context.items())), CWD, USER)
+            hash(cache_key)
+        except TypeError:
+            cache_key = None
+
+        with self.lock:
+            revision = getattr(self.var_dic, 'revision', None)
+
+            if revision != self.revision:
+                self.cache = {}
+                self.revision = revision
+
+            if cache_key is not None and cache_key in self.cache:
+                return self.cache[cache_key]
+
+        result = self.substitute(setting_str, collections.ChainMap(common_var, context, self.var_dic))
+
+        if cache_key is not None:
+            with self.lock:
+                if revision == self.revision:
+                    self.cache[cache_key] = result
+
+        return result
+
+    def substitute(self, setting_str: str, mapping):
+        # Every substitution round expands one more level of references, acyclic settings finish within len(mapping) rounds
+        max_round = len(mapping) + 1
+        round_num = 0
+
+        while setting_str.find('$') >= 0:
+            round_num += 1
+
+            if round_num > max_round:
+                return setting_str, 'cyclic variable reference'
+
+            try:
+                new_setting_str = Template(setting_str).substitute(mapping)
+            except Exception as warning:
+                return setting_str, warning
+
+            if new_setting_str == setting_str:
+                return setting_str, 'cyclic variable reference'
+
+            setting_str = new_setting_str
+
+        return setting_str, None
+
+    @staticmethod
+    def get_references(setting_str) -> List[str]:
+        reference_list = []
+
+        if type(setting_str) is str:
+            for match in Template.pattern.finditer(setting_str):
+                name = match.group('named') or match.group('braced')
+
+                if name:
+                    reference_list.append(name)
+
+        elif type(setting_str) is list:
+            for item in setting_str:
+                reference_list.extend(VariableResolver.get_references(item))
+
+        return reference_list
+
+    def resolve_all(self, show_warning=True):
+        """
+        Expand all settings of var_dic in place, in dependency order.
+        Settings on a reference cycle are kept as they are.
+        """
+        # name: names it references, only names of var_dic (CWD/USER always come from common variables)
+        reference_dic = {}
+
+        for (name, value) in self.var_dic.items():
+            reference_dic[name] = {reference for reference in self.get_references(value) if reference in self.var_dic and reference not in ['CWD', 'USER']}
+
+        indegree_dic = {name: len(reference_set) for (name, reference_set) in reference_dic.items()}
+        referrer_dic = {name: [] for name in reference_dic.keys()}
+
+        for (name, reference_set) in reference_dic.items():
+            for reference in reference_set:
+                referrer_dic[reference].append(name)
+
+        ready_queue = collections.deque([name for (name, indegree) in indegree_dic.items() if indegree == 0])
+        order_list = []
+
+        while ready_queue:
+            name = ready_queue.popleft()
+            order_list.append(name)
+
+            for referrer in referrer_dic[name]:
+                indegree_dic[referrer] -= 1
+
+                if indegree_dic[referrer] == 0:
+                    ready_queue.append(referrer)
+
+        cycle_name_list = [name for name in reference_dic.keys() if indegree_dic[name] > 0]
+
+        if cycle_name_list and show_warning:
+            print_warning('*Warning*: Cyclic variable reference between ' + ', '.join(cycle_name_list) + '.')
+
+        # Write without bumping revision, so memoized expansions survive the whole loop (full expansion does not
+        # depend on whether referenced settings are expanded yet), then bump once
+        for name in order_list:
+            dict.__setitem__(self.var_dic, name, expand_var(self.var_dic[name], ifp_var_dic=self.var_dic, show_warning=show_warning))
+
+        if order_list and isinstance(self.var_dic, VarDict):
+            self.var_dic.changed()
+
+        return cycle_name_list
+
+
+def get_variable_resolver(var_dic) -> VariableResolver:
+    """
+    VariableResolver of var_dic, it is kept on VarDict so its cache lives as long as the settings.
+    """
+    if isinstance(var_dic, VarDict):
+        if var_dic.resolver is None:
+            var_dic.resolver = VariableResolver(var_dic)
+
+        return var_dic.resolver
+
+    return VariableResolver(var_dic if var_dic is not None else {})
+
+
 def expand_var(setting_str, ifp_var_dic=None, show_warning=True, **kwargs):
     """
     Expand variable settings on 'setting_str'.
     """
-    common_var = {'CWD': CWD,
-                  'USER': USER}
     settings = []
     new_settings = []
 
@@ -989,30 +1182,20 @@ def expand_var(setting_str, ifp_var_dic=None, show_warning=True, **kwargs):
     elif type(setting_str) is list:
         settings = setting_str
 
+    resolver = None
+
     for setting_str2 in settings:
         if type(setting_str2) is str:
-            # Merge IFP_INSTALL_PATH/CWD and **kwargs into var_dic.
-            var_dic = copy.deepcopy(ifp_var_dic)
-            var_dic.update(**kwargs)
-            var_dic.update(common_var)
-
             if setting_str2.find('$') >= 0:
-                while setting_str2.find('$') >= 0:
-                    # Replace variables with var_dic on setting_str.
-                    try:
-                        tpl = Template(setting_str2)
-                        setting_str2 = tpl.substitute(var_dic)
-                    except Exception as warning:
-                        traceback.format_exc()
-                        if show_warning:
-                            print_warning('*Warning*: Failed on expanding variable for "' + str(setting_str2) + '" : ' + str(warning))
-                        new_settings.append(setting_str2)
-                        break
-                else:
-                    new_settings.append(setting_str2)
-            else:
-                new_settings.append(setting_str2)
+                if resolver is None:
+                    resolver = get_variable_resolver(ifp_var_dic)
 
+                (setting_str2, warning) = resolver.expand(setting_str2, kwargs)
+
+                if warning is not None and show_warning:
+                    print_warning('*Warning*: Failed on expanding variable for "' + str(setting_str2) + '" : ' + str(warning))
+
+            new_settings.append(setting_str2)
         else:
             new_settings.append(setting_str2)
 
@@ -1113,6 +1296,45 @@ def gen_cache_file_name(config_file: str) -> Tuple[str, str]:
     return status_file, ifp_cache_dir
 
 
+def write_file_if_changed(file_path: str, content: str, mode=None, hash_dic=None) -> bool:
+    """
+    Write content into file_path only if its hash changed, return True if file is written.
+    hash_dic ({file_path: hash}) remembers written files, unknown existing file is read back to compare.
+    File is replaced atomically, so a running job never reads a half written file.
+    """
+    content_hash = hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    if hash_dic is not None and hash_dic.get(file_path) == content_hash and os.path.exists(file_path):
+        return False
+
+    if hash_dic is None or file_path not in hash_dic:
+        try:
+            with open(file_path, 'rb') as FF:
+                if hashlib.md5(FF.read()).hexdigest() == content_hash:
+                    if hash_dic is not None:
+                        hash_dic[file_path] = content_hash
+
+                    return False
+        except OSError:
+            pass
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_file = '%s.%s.%s.tmp' % (file_path, os.getpid(), threading.get_ident())
+
+    with open(tmp_file, 'w') as FF:
+        FF.write(content)
+
+    if mode is not None:
+        os.chmod(tmp_file, mode)
+
+    os.replace(tmp_file, file_path)
+
+    if hash_dic is not None:
+        hash_dic[file_path] = content_hash
+
+    return True
+
+
 class CustomPrintFormatter(logging.Formatter):
     # logging color setting
     grey = "\x1b[38;20m"
@@ -1256,7 +1478,21 @@ class ConfigSetting:
             'system_log_path': {'value': '', 'note': 'system log'},
             'lmstat_path': {'value': '', 'note': 'Specify lmstat path, example "/eda/synopsys/scl/2021.03/linux64/bin/lmstat".'},
             'mem_prediction': {'value': False, 'note': "Enable/Disable Memory Prediction Feature"},
-            'in_process_check_server': {'value': '', 'note': "service host for Task in process check."}
+            'in_process_check_server': {'value': '', 'note': "service host for Task in process check."},
+            'lsf_job_array': {'value': False, 'note': "Submit LSF jobs with identical bsub options as one LSF job array."},
+            'lsf_job_array_max_size': {'value': 1000, 'note': "Max elements in one LSF job array, should not exceed MAX_JOB_ARRAY_SIZE of lsb.params."},
+            'watcher_min_interval': {'value': 2, 'note': "Job watcher polls new or just changed jobs every watcher_min_interval seconds."},
+            'watcher_max_interval': {'value': 120, 'note': "Job watcher backs off polling of unchanged (pending/long running) jobs up to watcher_max_interval seconds."},
+            'watcher_backoff_factor': {'value': 1.5, 'note': "Polling interval of unchanged jobs is multiplied by watcher_backoff_factor after each poll."},
+            'watcher_lsf_queries_per_minute': {'value': 60, 'note': "Max bjobs queries job watcher sends to LSF per minute."},
+            'job_store_journal_mode': {'value': 'WAL', 'note': "SQLite journal mode of job_store, set DELETE if .ifp directory is on a file system without shared memory support."},
+            'job_store_busy_timeout': {'value': 30000, 'note': "Milliseconds job_store writers wait for SQLite lock before failing."},
+            'task_action_workers': {'value': 8, 'note': "Worker threads which drive task actions of IFP, waiting actions do not hold any thread."},
+            'license_snapshot_ttl': {'value': 30, 'note': "Seconds one lmstat result is shared by all tasks which wait for license."},
+            'license_reservation_timeout': {'value': 300, 'note': "Seconds a license granted by IFP is counted as used before it shows up in lmstat."},
+            'file_watch_poll_interval': {'value': 1, 'note': "Seconds between checks of DEPENDENCY FILE on network file systems, local files are watched with inotify."},
+            'job_harvest_interval': {'value': 10, 'note': "Seconds between two collections of finished LSF jobs into job history, all of them are resolved with one bjobs -UF."},
+            'job_history_path': {'value': '', 'note': "Directory of job history store (Parquet files partitioned by finish date), default is <CWD>/.ifp/job_history."}
         }
         self.user_setting_dic = {
             'send_result_command': {'value': '', 'note': 'send result command'},
@@ -2,14 +2,17 @@ import datetime
 import enum
 import os
 import re
+import sqlite3
 import sys
-import time
+import threading
 import uuid
 from hashlib import sha1
 from typing import Tuple, Dict, Union, List, Any
 
 from dateutil import parser
-from sqlalchemy import create_engine, Column, Integer, String, Enum
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Enum, Index
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, declarative_base
 
@@ -23,9 +26,91 @@ import config
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + 'common/')
 import common_lsf
 import common
+import common_history
 
 Base = declarative_base()
 
+# Engines, session factories and created schemas of this process, keyed by database url
+engine_lock = threading.RLock()
+engine_dic = {}
+session_factory_dic = {}
+initialized_db_set = set()
+
+
+def get_engine(db_url: str) -> Engine:
+    """
+    One pooled engine per database url in this process.
+    """
+    with engine_lock:
+        if db_url not in engine_dic:
+            engine_dic[db_url] = create_engine(db_url, connect_args={'timeout': 30, 'check_same_thread': False})
+
+        return engine_dic[db_url]
+
+
+def get_session_factory(db_url: str):
+    with engine_lock:
+        if db_url not in session_factory_dic:
+            session_factory_dic[db_url] = sessionmaker(bind=get_engine(db_url))
+
+        return session_factory_dic[db_url]
+
+
+def is_initialized(engine: Engine, key) -> bool:
+    """
+    Schema is created once per process, unless sqlite database file was removed since then.
+    engine_lock must be held.
+    """
+    if key not in initialized_db_set:
+        return False
+
+    database = engine.url.database
+
+    if engine.url.get_backend_name() == 'sqlite' and database and database != ':memory:' and not os.path.exists(database):
+        # Pooled connections still point to the removed file
+        engine.dispose()
+        initialized_db_set.discard(key)
+        return False
+
+    return True
+
+
+def ensure_table(db_url: str, model):
+    """
+    Create table of model once per process.
+    """
+    engine = get_engine(db_url)
+
+    with engine_lock:
+        if not is_initialized(engine, (db_url, model.__tablename__)):
+            model.__table__.create(engine, checkfirst=True)
+            initialized_db_set.add((db_url, model.__tablename__))
+
+    return engine
+
+
+def upsert_rows(connection, model, row_list: List[Dict[str, Any]]):
+    """
+    INSERT ... ON CONFLICT (<primary key>) DO UPDATE with executemany.
+    Rows are grouped by their column set, one statement for each group.
+    """
+    key_list = [column.name for column in model.__table__.primary_key.columns]
+    group_dic = {}
+
+    for row in row_list:
+        group_dic.setdefault(tuple(sorted(row.keys())), []).append(row)
+
+    for (column_tuple, group_row_list) in group_dic.items():
+        statement = sqlite_insert(model.__table__)
+        update_dic = {column: statement.excluded[column] for column in column_tuple if column not in key_list}
+
+        if update_dic:
+            statement = statement.on_conflict_do_update(index_elements=key_list, set_=update_dic)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=key_list)
+
+        connection.execute(statement, group_row_list)
+
 
 class SqlDB:
     """
@@ -39,9 +124,9 @@ class SqlDB:
         self.get_all(): get all data.
     """
     def __init__(self, db_url):
-        self.engine = create_engine(db_url, connect_args={'check_same_thread': False})
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        initialize_database(db_url)
+        self.engine = get_engine(db_url)
+        self.Session = get_session_factory(db_url)
 
     def create_table(self):
         Base.metadata.create_all(self.engine)
@@ -172,7 +257,26 @@ class JobAction(enum.Enum):
     kill = common.action.kill
 
 
+# All LSF job states, suspended jobs are still alive so keep them as queued/running
+LSF_JOB_STATUS_MAP = {
+    'PEND': JobStatus.queued,
+    'PSUSP': JobStatus.queued,
+    'WAIT': JobStatus.queued,
+    'PROV': JobStatus.queued,
+    'RUN': JobStatus.running,
+    'USUSP': JobStatus.running,
+    'SSUSP': JobStatus.running,
+    'DONE': JobStatus.passed,
+    'EXIT': JobStatus.failed,
+    'ZOMBI': JobStatus.failed,
+    'UNKWN': JobStatus.undefined,
+}
+
 JobStoreTable: str = 'job_store'
+# Keep IN lists below SQLITE_MAX_VARIABLE_NUMBER of old sqlite (999)
+SQLITE_CHUNK_SIZE: int = 500
+SQLITE_BUSY_TIMEOUT: int = int(config.job_store_busy_timeout) if hasattr(config, 'job_store_busy_timeout') and config.job_store_busy_timeout else 30000
+SQLITE_JOURNAL_MODE: str = str(config.job_store_journal_mode) if hasattr(config, 'job_store_journal_mode') and config.job_store_journal_mode else 'WAL'
 job_type_enum = Enum(JobType, name='job_type_enum', values_callable=lambda enum_cls: [e.value for e in enum_cls])
 job_action_enum = Enum(JobAction, name='job_action_enum', values_callable=lambda enum_cls: [e.value for e in enum_cls])
 job_status_enum = Enum(JobStatus, name='job_status_enum', values_callable=lambda enum_cls: [e.value for e in enum_cls])
@@ -180,6 +284,12 @@ job_status_enum = Enum(JobStatus, name='job_status_enum', values_callable=lambda
 
 class JobStore(Base):
     __tablename__ = 'job_store'
+    # Dispatcher/watcher select jobs by status, never scan the whole table
+    __table_args__ = (
+        Index('ix_job_store_status', 'status'),
+        Index('ix_job_store_job_type_status', 'job_type', 'status'),
+        Index('ix_job_store_rev', 'rev'),
+    )
     uuid = Column(String, primary_key=True)
     job_type = Column(job_type_enum)
     job_id = Column(Integer)
@@ -190,12 +300,21 @@ class JobStore(Base):
     command_file = Column(String)
     action = Column(job_action_enum)
     status = Column(job_status_enum)
+    # Element index when job is submitted as one element of LSF job array
+    job_index = Column(Integer)
+    # Change sequence, set by job_store triggers on every insert/update
+    rev = Column(Integer)
+
+    @property
+    def job_key(self):
+        return format_job_key(self.job_id, self.job_index)
 
     def to_dict(self):
         return {
             "uuid": self.uuid,
             "job_type": self.job_type.value if self.job_type else None,
             "job_id": self.job_id,
+            "job_index": self.job_index,
             "block": self.block,
             "version": self.version,
             "flow": self.flow,
@@ -206,42 +325,140 @@ class JobStore(Base):
         }
 
 
-def save_job_store_batch(data_list: List[Dict[str, Any]], db_path: str):
-    db_path = f'sqlite:///{db_path}'
-    initialize_database(db_path)
+class JobStoreRev(Base):
+    """
+    Single row table, rev is bumped by triggers whenever a job_store row changes.
+    """
+    __tablename__ = 'job_store_rev'
+    id = Column(Integer, primary_key=True)
+    rev = Column(Integer, nullable=False, default=0)
 
-    engine = create_engine(db_path, connect_args={'check_same_thread': False})
-    Session = sessionmaker(bind=engine)
-    session = Session()
 
-    by_uuid = {}
+# Columns whose change should be seen by JobManager.flush_task
+JOB_STORE_REV_COLUMN_LIST = ['job_type', 'job_id', 'job_index', 'command_file', 'action', 'status']
+JOB_STORE_REV_TRIGGER_DIC = {
+    'job_store_rev_insert': 'AFTER INSERT ON job_store',
+    'job_store_rev_update': f'AFTER UPDATE OF {", ".join(JOB_STORE_REV_COLUMN_LIST)} ON job_store',
+}
 
-    for data in data_list:
-        data['uuid'] = generate_uuid_from_components(item_list=[data['block'], data['version'], data['flow'], data['task']])
-        by_uuid[data["uuid"]] = data
 
-    data_list = list(by_uuid.values())
-    uuid_list = [data['uuid'] for data in data_list]
-    existing_records = session.query(JobStore).filter(JobStore.uuid.in_(uuid_list)).all()
-    existing_map = {record.uuid: record for record in existing_records}
+def format_job_key(job_id, job_index=None) -> str:
+    """
+    LSF job array element is addressed as "<job_id>[<job_index>]".
+    """
+    if not job_id:
+        return job_id
 
-    new_records = []
+    if job_index:
+        return f'{job_id}[{job_index}]'
 
-    for data in data_list:
-        if data['uuid'] in existing_map:
-            existing_record = existing_map[data['uuid']]
+    return str(job_id)
 
-            for key, value in data.items():
-                setattr(existing_record, key, value)
-        else:
-            new_record = JobStore(**data)
-            new_records.append(new_record)
 
-    if new_records:
-        session.bulk_save_objects(new_records)
+def claim_awaiting_jobs(session) -> List[Dict[str, Any]]:
+    """
+    Switch all awaiting_dispatch jobs to dispatching, return them as dict list.
+    Caller commits the session.
+    """
+    jobs = session.query(JobStore).filter(JobStore.status == JobStatus.awaiting_dispatch).all()
+    job_data = [job.to_dict() for job in jobs]
+    uuid_list = [job['uuid'] for job in job_data]
+
+    for i in range(0, len(uuid_list), SQLITE_CHUNK_SIZE):
+        session.query(JobStore) \
+            .filter(JobStore.uuid.in_(uuid_list[i:i + SQLITE_CHUNK_SIZE]), JobStore.status == JobStatus.awaiting_dispatch) \
+            .update({JobStore.status: JobStatus.dispatching}, synchronize_session=False)
+
+    return job_data
+
+
+def get_job_store_rev(session) -> int:
+    """
+    Current change sequence of job_store, 0 if sequence is not initialized.
+    """
+    rev = session.execute(text('SELECT rev FROM job_store_rev WHERE id = 1')).scalar()
+    return rev if rev else 0
+
+
+def load_changed_jobs(session, since_rev: int = None) -> Tuple[List[JobStore], int]:
+    """
+    Return (jobs changed after since_rev, new rev). since_rev None loads all jobs.
+    """
+    rev = get_job_store_rev(session)
+    query = session.query(JobStore)
+
+    if since_rev is not None:
+        if rev == since_rev:
+            return [], rev
+
+        query = query.filter(JobStore.rev > since_rev)
 
-    session.commit()
-    session.close()
+    jobs = query.all()
+
+    # Rows committed after reading rev may be returned too, never step back
+    for job in jobs:
+        if job.rev and job.rev > rev:
+            rev = job.rev
+
+    return jobs, rev
+
+
+def update_job_status(session, status_dic: Dict[str, Any], status_list: List[JobStatus] = None) -> int:
+    """
+    Apply {uuid: status} with one UPDATE per target status (and uuid chunk).
+    If status_list is given, only jobs currently in status_list are updated.
+    Caller commits the session, return updated row number.
+    """
+    uuid_dic = {}
+
+    for (uuid_str, status) in status_dic.items():
+        uuid_dic.setdefault(JobStatus(status), []).append(uuid_str)
+
+    updated = 0
+
+    for (status, uuid_list) in uuid_dic.items():
+        for i in range(0, len(uuid_list), SQLITE_CHUNK_SIZE):
+            query = session.query(JobStore).filter(JobStore.uuid.in_(uuid_list[i:i + SQLITE_CHUNK_SIZE]))
+
+            if status_list:
+                query = query.filter(JobStore.status.in_(status_list))
+
+            updated += query.update({JobStore.status: status}, synchronize_session=False)
+
+    return updated
+
+
+def save_finished_local_jobs(session, finished_dic: Dict[int, Tuple[str, int]]) -> int:
+    """
+    Save final status of exited local jobs {pid: (uuid, return_code)}.
+    Only jobs which GUI already picked up (queued/running/undefined) are updated, dispatched jobs stay in finished_dic
+    so GUI still receives job id first, jobs killed or rerun are dropped. Caller commits the session, return updated row number.
+    """
+    updated = 0
+
+    for (pid, (uuid_str, return_code)) in list(finished_dic.items()):
+        status = JobStatus.passed if return_code == 0 else JobStatus.failed
+        job_filter = [JobStore.uuid == uuid_str, JobStore.job_id == pid]
+        row_num = session.query(JobStore).filter(*job_filter, JobStore.status.in_([JobStatus.queued, JobStatus.running, JobStatus.undefined])).update({JobStore.status: status}, synchronize_session=False)
+        updated += row_num
+
+        if row_num or session.query(JobStore).filter(*job_filter, JobStore.status == JobStatus.dispatched).count() == 0:
+            del finished_dic[pid]
+
+    return updated
+
+
+def save_job_store_batch(data_list: List[Dict[str, Any]], db_path: str):
+    db_path = f'sqlite:///{db_path}'
+    initialize_database(db_path)
+    by_uuid = {}
+
+    for data in data_list:
+        data['uuid'] = generate_uuid_from_components(item_list=[data['block'], data['version'], data['flow'], data['task']])
+        by_uuid[data["uuid"]] = data
+
+    with get_engine(db_path).begin() as connection:
+        upsert_rows(connection, JobStore, list(by_uuid.values()))
 
 
 def create_weekly_job_table(year: int, week_number: int):
@@ -260,28 +477,16 @@ def create_weekly_job_table(year: int, week_number: int):
     return new_class
 
 
-def analysis_and_save_job(job_id: str, block: str, version: str, flow: str, task: str):
-    time.sleep(10)
-    job_id = str(job_id)
-
-    if my_match := re.match(r'^b:(\d+)$', job_id):
-        lsf_job_id = int(my_match.group(1))
-
-        try:
-            job_data, year, week_number = analysis_db(job_id=lsf_job_id, block=block, version=version, flow=flow, task=task)
-            save_job(job_data=job_data, year=year, week_number=week_number)
-        except Exception:
-            return
-
-
-def analysis_db(job_id: int, block: str, version: str, flow: str, task: str) -> Tuple[Dict[str, Union[str, int]], int, int]:
-    job_origin_data = common_lsf.get_lsf_bjobs_uf_info('bjobs {} -UF'.format(str(job_id))).get(str(job_id), {})
-    job_data = {}
-
+def get_job_history_data(job_origin_data: Dict[str, str], block: str, version: str, flow: str, task: str) -> Dict[str, Union[str, int]]:
+    """
+    Convert one finished job of "bjobs -UF" (common_lsf.get_lsf_bjobs_uf_info) into a job history row.
+    """
     if not job_origin_data or job_origin_data['status'] != 'DONE':
         raise RuntimeError
 
-    job_data['job_id'] = int(job_origin_data['job_id'])
+    job_id = job_origin_data['job_id']
+    job_data = {}
+    job_data['job_id'] = int(re.sub(r'\[\d+\]$', '', str(job_id)))
     job_data['job_name'] = job_origin_data['job_name'] if job_origin_data['job_name'] else 'default'
     job_data['user'] = job_origin_data['user']
     job_data['command'] = job_origin_data['command']
@@ -301,20 +506,24 @@ def analysis_db(job_id: int, block: str, version: str, flow: str, task: str) ->
     sha1obj.update(id_str.encode('utf-8'))
     job_data['id'] = sha1obj.hexdigest()
 
+    return job_data
+
+
+def get_week() -> Tuple[int, int]:
     current_time = datetime.datetime.now()
-    year = current_time.year
-    week_number = current_time.isocalendar()[1]
 
-    return job_data, year, week_number
+    return current_time.year, current_time.isocalendar()[1]
 
 
-def save_job(job_data: Dict[str, Union[str, int]], year: int, week_number: int):
-    """
-    Save job data to job database
-    """
-    if not hasattr(config, 'mem_prediction') or not config.mem_prediction:
-        return
+def analysis_db(job_id: int, block: str, version: str, flow: str, task: str) -> Tuple[Dict[str, Union[str, int]], int, int]:
+    job_origin_data = common_lsf.get_lsf_bjobs_uf_info('bjobs {} -UF'.format(str(job_id))).get(str(job_id), {})
+    job_data = get_job_history_data(job_origin_data, block, version, flow, task)
+    (year, week_number) = get_week()
 
+    return job_data, year, week_number
+
+
+def get_ifp_db_path() -> str:
     if hasattr(config, 'db_path') and os.path.exists(config.db_path):
         db_path = config.db_path
     else:
@@ -322,18 +531,39 @@ def save_job(job_data: Dict[str, Union[str, int]], year: int, week_number: int):
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         db_path = f'sqlite:///{db_path}'
 
-    engine = create_engine(db_path, connect_args={'check_same_thread': False})
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    return db_path
 
-    weekly_job_table = create_weekly_job_table(year, week_number)
-    Base.metadata.create_all(engine)
 
-    new_job = weekly_job_table(**job_data)
+def get_job_history_path() -> str:
+    if hasattr(config, 'job_history_path') and config.job_history_path:
+        return config.job_history_path
+    else:
+        return os.path.join(os.getcwd(), '.ifp/job_history')
+
+
+def get_job_history_store() -> common_history.JobHistoryStore:
+    return common_history.JobHistoryStore(get_job_history_path())
+
+
+def save_job(job_data: Dict[str, Union[str, int]], year: int, week_number: int):
+    """
+    Save job data to job database
+    """
+    save_jobs([job_data], year, week_number)
+
+
+def save_jobs(job_data_list: List[Dict[str, Union[str, int]]], year: int, week_number: int):
+    """
+    Save job data list to weekly job table with one transaction.
+    """
+    if not hasattr(config, 'mem_prediction') or not config.mem_prediction or not job_data_list:
+        return
+
+    db_path = get_ifp_db_path()
+    weekly_job_table = create_weekly_job_table(year, week_number)
 
-    session.add(new_job)
-    session.commit()
-    session.close()
+    with ensure_table(db_path, weekly_job_table).begin() as connection:
+        upsert_rows(connection, weekly_job_table, job_data_list)
 
 
 def generate_uuid_from_components(item_list: List[str]) -> str:
@@ -342,60 +572,113 @@ def generate_uuid_from_components(item_list: List[str]) -> str:
 
 
 def initialize_database(db_path: str):
-    engine = create_engine(db_path, connect_args={'check_same_thread': False})
-    Base.metadata.create_all(engine, checkfirst=True)
+    """
+    Create/upgrade schema and triggers, only the first call of each database in this process does the work.
+    """
+    engine = get_engine(db_path)
 
+    with engine_lock:
+        if is_initialized(engine, db_path):
+            return
 
-def save_ifp_record(data: dict):
-    if hasattr(config, 'db_path') and os.path.exists(config.db_path):
-        db_path = config.db_path
-    else:
-        db_path = os.path.join(os.getcwd(), '.ifp/ifp_db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        db_path = f'sqlite:///{db_path}'
+        Base.metadata.create_all(engine, checkfirst=True)
+        upgrade_database(engine)
+        create_job_store_triggers(engine)
+        initialized_db_set.add(db_path)
 
-    initialize_database(db_path)
 
-    engine = create_engine(db_path, connect_args={'check_same_thread': False})
-    Session = sessionmaker(bind=engine)
-    session = Session()
+def upgrade_database(engine):
+    """
+    create_all does not alter existing tables, add columns and indexes introduced by newer IFP.
+    """
+    inspector = inspect(engine)
 
-    data['uuid'] = generate_uuid_from_components(item_list=[data['block'], data['version'], data['file_path']])
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
 
-    existing_record = session.query(IFPRecord).filter_by(uuid=data['uuid']).first()
+        existing_column_list = [column['name'] for column in inspector.get_columns(table.name)]
 
-    if existing_record:
-        for key, value in data.items():
-            setattr(existing_record, key, value)
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name not in existing_column_list:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
 
-        session.commit()
-    else:
-        new_record = IFPRecord(**data)
-        session.add(new_record)
-        session.commit()
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
 
-    session.close()
 
+def create_job_store_triggers(engine):
+    """
+    Maintain job_store.rev with a global sequence, so readers can pull only changed rows.
+    The sequence never goes back even if rows are deleted.
+    """
+    with engine.begin() as connection:
+        connection.execute(text('INSERT OR IGNORE INTO job_store_rev (id, rev) VALUES (1, 0)'))
 
-def setup_task_job():
+        for (trigger_name, trigger_event) in JOB_STORE_REV_TRIGGER_DIC.items():
+            connection.execute(text(f'''
+                CREATE TRIGGER IF NOT EXISTS {trigger_name} {trigger_event}
+                BEGIN
+                    UPDATE job_store_rev SET rev = rev + 1 WHERE id = 1;
+                    UPDATE job_store SET rev = (SELECT rev FROM job_store_rev WHERE id = 1) WHERE uuid = NEW.uuid;
+                END
+            '''))
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    job_store is shared by GUI, dispatcher and watcher processes.
+    WAL lets readers run while one process writes, busy_timeout makes writers wait instead of failing.
+    WAL is only enabled on job_store, ifp_db may live on NFS shared by several hosts.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+
+    try:
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+        database_list = cursor.execute('PRAGMA database_list').fetchall()
+
+        if database_list and database_list[0][2] and os.path.basename(database_list[0][2]) == JobStoreTable:
+            if cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}').fetchone()[0].upper() == 'WAL':
+                cursor.execute('PRAGMA synchronous = NORMAL')
+    except sqlite3.Error:
+        pass
+    finally:
+        cursor.close()
+
+
+def save_ifp_record(data: dict):
+    db_path = get_ifp_db_path()
+    initialize_database(db_path)
+    data['uuid'] = generate_uuid_from_components(item_list=[data['block'], data['version'], data['file_path']])
+
+    with get_engine(db_path).begin() as connection:
+        upsert_rows(connection, IFPRecord, [data])
+
+
+def get_task_job_db_path() -> str:
     db_path = os.path.join(os.getcwd(), '.ifp/job_store')
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     db_path = f'sqlite:///{db_path}'
     initialize_database(db_path)
-    engine = create_engine(db_path, connect_args={'check_same_thread': False})
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    return session
+    return db_path
+
+
+def setup_task_job():
+    return get_session_factory(get_task_job_db_path())()
 
 
 def save_task_job(data: dict):
     try:
-        session = setup_task_job()
+        db_path = get_task_job_db_path()
         data['uuid'] = generate_uuid_from_components(item_list=[data['job_id'], data['block'], data['version'], data['flow'], data['task']])
 
-        new_record = TaskJobs(**data)
-        session.add(new_record)
-        session.commit()
-        session.close()
+        with get_engine(db_path).begin() as connection:
+            upsert_rows(connection, TaskJobs, [data])
     except Exception:
         pass
\ No newline at end of file
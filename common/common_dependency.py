@@ -0,0 +1,279 @@
+import collections
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+import common
+
+TRUE = 'True'
+FALSE = 'False'
+CANCEL = 'Cancel'
+
+
+def compile_formula(formula: list) -> Tuple[Tuple[Any, ...], ...]:
+    """
+    Compile RUN_AFTER formula token list into disjunctive normal form.
+    Tokens are operands (parent tasks), '&', '|', '(', ')', and operand lists (AND group).
+    Return tuple of AND terms, every term is a tuple of operands.
+    '&' binds tighter than '|', same as the python expression IFP used to eval.
+    """
+    token_list = []
+
+    for item in formula:
+        if type(item) is list:
+            token_list.append('(')
+
+            for (i, operand) in enumerate(item):
+                if i > 0:
+                    token_list.append('&')
+
+                token_list.append(operand)
+
+            token_list.append(')')
+        else:
+            token_list.append(item)
+
+    (dnf, position) = _parse_or(token_list, 0)
+
+    if position != len(token_list):
+        raise ValueError(f'Unexpected token "{token_list[position]}" in formula.')
+
+    return dnf
+
+
+def _is_operator(token, operator: str) -> bool:
+    return isinstance(token, str) and token == operator
+
+
+def _parse_or(token_list: list, position: int):
+    (dnf, position) = _parse_and(token_list, position)
+
+    while position < len(token_list) and _is_operator(token_list[position], '|'):
+        (right_dnf, position) = _parse_and(token_list, position + 1)
+        dnf = dnf + right_dnf
+
+    return dnf, position
+
+
+def _parse_and(token_list: list, position: int):
+    (dnf, position) = _parse_operand(token_list, position)
+
+    while position < len(token_list) and _is_operator(token_list[position], '&'):
+        (right_dnf, position) = _parse_operand(token_list, position + 1)
+        dnf = tuple(left_term + right_term for left_term in dnf for right_term in right_dnf)
+
+    return dnf, position
+
+
+def _parse_operand(token_list: list, position: int):
+    if position >= len(token_list):
+        raise ValueError('Unexpected end of formula.')
+
+    token = token_list[position]
+
+    if _is_operator(token, '('):
+        (dnf, position) = _parse_or(token_list, position + 1)
+
+        if position >= len(token_list) or not _is_operator(token_list[position], ')'):
+            raise ValueError('Missing ")" in formula.')
+
+        return dnf, position + 1
+
+    if isinstance(token, str) and token in ['(', ')', '&', '|', ',']:
+        raise ValueError(f'Unexpected operator "{token}" in formula.')
+
+    return ((token,),), position + 1
+
+
+def get_operands(dnf: Tuple[Tuple[Any, ...], ...]) -> List[Any]:
+    """
+    Unique operands of compiled formula, in formula order.
+    """
+    operand_dic = {}
+
+    for term in dnf:
+        for operand in term:
+            operand_dic[operand] = None
+
+    return list(operand_dic.keys())
+
+
+def is_true(state) -> bool:
+    return state is True or state == TRUE
+
+
+def evaluate_formula(dnf: Tuple[Tuple[Any, ...], ...], state_dic: Dict[Any, Any]) -> Tuple[bool, bool]:
+    """
+    state_dic is {operand: 'True'/'False'/'Cancel'} (bool is accepted too).
+    Return (result, cancelled), 'Cancel' is treated as False in result, cancelled means any operand is 'Cancel'.
+    """
+    cancelled = any([state == CANCEL for state in state_dic.values()])
+    result = any([all([is_true(state_dic[operand]) for operand in term]) for term in dnf])
+
+    return result, cancelled
+
+
+def is_formula_finished(operand_list: List[Any]) -> bool:
+    """
+    Cancelled formula is counted only after all its parent tasks stopped running.
+    """
+    for task_obj in operand_list:
+        if task_obj.status in [common.status.running, common.status.queued]:
+            return False
+
+    return True
+
+
+class FormulaProgramCache:
+    """
+    Compiled formula_list of one task, recompiled only when formula object is replaced.
+    """
+    def __init__(self):
+        self.program_dic = {}
+
+    def get(self, formula_list: dict, run_time) -> Tuple[Tuple[Tuple[Any, ...], ...], List[Any]]:
+        """
+        Return (dnf, operand_list) of formula_list[run_time].
+        """
+        formula = formula_list[run_time]['formula']
+        program = self.program_dic.get(run_time)
+
+        if program is None or program[0] is not formula:
+            dnf = compile_formula(formula)
+            program = (formula, dnf, get_operands(dnf))
+            self.program_dic[run_time] = program
+
+        return program[1], program[2]
+
+
+def calculate_strong_dependency(task_obj, epoch: int) -> List[Any]:
+    """
+    Return [result, cancelled_num] of task_obj, result is True/False/'Cancel'.
+    A parent which is already True is traced back through its own dependency.
+    Results are memoized on task (task_obj.strong_dependency_cache) until epoch changes,
+    caller bumps epoch whenever any dependency state, task status or formula finish flag changes.
+    """
+    cache = task_obj.strong_dependency_cache
+
+    if cache is not None and cache[0] == epoch:
+        return list(cache[1])
+
+    formula_list = task_obj.formula_list
+    result = False
+    cancelled_num = 0
+
+    for run_time in formula_list.keys():
+        (dnf, operand_list) = task_obj.formula_program_cache.get(formula_list, run_time)
+        state_dic = {}
+
+        for parent_obj in operand_list:
+            state = task_obj.parent[parent_obj]
+
+            # Parent task is on-schedule or do not have any pre-dependency
+            if state in [FALSE, CANCEL] or not parent_obj.formula_list:
+                state_dic[parent_obj] = state
+            # Calculate parent task dependency
+            else:
+                state_dic[parent_obj] = calculate_strong_dependency(parent_obj, epoch)[0]
+
+        (result, cancelled) = evaluate_formula(dnf, state_dic)
+
+        if cancelled and not result and is_formula_finished(operand_list):
+            cancelled_num += 1
+
+        if result:
+            if not formula_list[run_time]['finish']:
+                break
+            else:
+                continue
+
+    if 0 < task_obj.total_run_times == cancelled_num:
+        result = CANCEL
+    elif task_obj.total_run_times == 0 and cancelled_num > 0:
+        result = CANCEL
+
+    task_obj.strong_dependency_cache = (epoch, [result, cancelled_num])
+
+    return [result, cancelled_num]
+
+
+class DependencyGraph:
+    """
+    Name index, parent/child adjacency and topological order of tasks of one block/version.
+    Edges of one task are replaced by set_parents, so single task can be rewired without rebuilding the graph.
+    """
+    def __init__(self):
+        # name: node
+        self.node_dic = {}
+        # node: {parent node: None}
+        self.parent_dic = {}
+        # node: {child node: None}
+        self.child_dic = {}
+        self.topological_order = None
+
+    def add_node(self, name: str, node):
+        if name in self.node_dic:
+            return
+
+        self.node_dic[name] = node
+        self.parent_dic.setdefault(node, {})
+        self.child_dic.setdefault(node, {})
+        self.topological_order = None
+
+    def get_node(self, name: str):
+        return self.node_dic.get(name)
+
+    def get_parents(self, node) -> List[Any]:
+        return list(self.parent_dic.get(node, {}).keys())
+
+    def set_parents(self, node, parent_list: List[Any]):
+        for parent_node in self.parent_dic.get(node, {}).keys():
+            self.child_dic[parent_node].pop(node, None)
+
+        self.parent_dic[node] = {}
+
+        for parent_node in parent_list:
+            if parent_node in self.child_dic:
+                self.parent_dic[node][parent_node] = None
+                self.child_dic[parent_node][node] = None
+
+        self.topological_order = None
+
+    def get_topological_order(self) -> List[Any]:
+        """
+        Parents before children, nodes in cycles are appended at the end in insertion order.
+        """
+        if self.topological_order is not None:
+            return self.topological_order
+
+        indegree_dic = {node: len(parent_dic) for (node, parent_dic) in self.parent_dic.items()}
+        ready_queue = collections.deque([node for (node, indegree) in indegree_dic.items() if indegree == 0])
+        order_list = []
+
+        while ready_queue:
+            node = ready_queue.popleft()
+            order_list.append(node)
+
+            for child_node in self.child_dic[node].keys():
+                indegree_dic[child_node] -= 1
+
+                if indegree_dic[child_node] == 0:
+                    ready_queue.append(child_node)
+
+        if len(order_list) < len(indegree_dic):
+            ordered_node_set = set(order_list)
+            order_list.extend([node for node in self.parent_dic.keys() if node not in ordered_node_set])
+
+        self.topological_order = order_list
+
+        return order_list
+
+    def get_cycle_nodes(self) -> List[Any]:
+        """
+        Nodes which can never be scheduled because they depend on themselves through RUN_AFTER.
+        """
+        order_list = self.get_topological_order()
+        position_dic = {node: i for (i, node) in enumerate(order_list)}
+
+        return [node for node in order_list if any([position_dic[parent_node] >= position_dic[node] for parent_node in self.parent_dic[node].keys()])]
@@ -0,0 +1,101 @@
+import errno
+import os
+import select
+
+DISPATCHER_FIFO = 'dispatcher.fifo'
+
+
+def get_event_fifo(job_store: str, name: str = DISPATCHER_FIFO) -> str:
+    """
+    Event FIFO lives beside the job_store database in the .ifp cache dir.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(job_store)), name)
+
+
+def notify(fifo_path: str) -> bool:
+    """
+    Wake up the process listening on fifo_path.
+    Never blocks, if nobody is listening the notification is simply dropped.
+    """
+    try:
+        fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        # ENOENT: listener not started yet, ENXIO: listener has no read end open.
+        return False
+
+    try:
+        os.write(fd, b'1')
+    except OSError as error:
+        # EAGAIN: pipe is full, listener will wake up anyway.
+        if error.errno != errno.EAGAIN:
+            return False
+    finally:
+        os.close(fd)
+
+    return True
+
+
+class EventChannel:
+    """
+    Listener side of a named pipe used to wake up a polling loop.
+
+    Attributes:
+        self.wait(timeout): block until notified or timeout, return True if notified.
+        self.fileno(): read fd, can be registered into select/selectors/asyncio.
+        self.drain(): consume all pending notifications.
+        self.close(): close pipe and remove fifo file.
+    """
+    def __init__(self, fifo_path: str):
+        self.fifo_path = fifo_path
+
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
+
+        os.mkfifo(self.fifo_path, 0o600)
+        self.read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        # Keep one write end open, otherwise read end reports EOF once a writer closes.
+        self.write_fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def wait(self, timeout: float) -> bool:
+        try:
+            readable, _, _ = select.select([self.read_fd], [], [], timeout)
+        except InterruptedError:
+            return False
+
+        if readable:
+            self.drain()
+            return True
+
+        return False
+
+    def drain(self):
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+        try:
+            os.remove(self.fifo_path)
+        except OSError:
+            pass
+
+
+def open_channel(fifo_path: str):
+    """
+    Return EventChannel, or None if fifo is not supported on current file system.
+    """
+    try:
+        return EventChannel(fifo_path)
+    except OSError:
+        return None
@@ -0,0 +1,345 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+# inotify_init1 flags and event masks, see <sys/inotify.h>
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+# inotify does not see changes made by other hosts on these file systems
+NETWORK_FS_TYPE_LIST = ['nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'lustre', 'gpfs', 'panfs', 'ceph', 'fuse.sshfs', 'fuse.glusterfs', 'afs']
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of Linux inotify.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.inotify_rm_watch = libc.inotify_rm_watch
+        self.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed on {path}')
+
+        return wd
+
+    def rm_watch(self, wd: int):
+        self.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Return [(wd, mask, name)] of all queued events.
+        """
+        event_list = []
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return event_list
+
+        offset = 0
+
+        while offset + EVENT_HEADER.size <= len(data):
+            (wd, mask, _, length) = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            event_list.append((wd, mask, name))
+
+        return event_list
+
+
+def get_mount_list():
+    """
+    Return [(mount_point, fs_type)], longest mount point first.
+    """
+    mount_list = []
+
+    try:
+        with open('/proc/mounts') as MF:
+            for line in MF:
+                item_list = line.split()
+
+                if len(item_list) >= 3:
+                    mount_list.append((item_list[1].replace('\\040', ' '), item_list[2]))
+    except Exception:
+        pass
+
+    return sorted(mount_list, key=lambda item: len(item[0]), reverse=True)
+
+
+class FileWatchService:
+    """
+    Wake owners (tasks) when all their required files exist.
+    Nearest existing parent directory of every missing path is watched with inotify, and deeper directories are watched as they appear.
+    Paths on network file systems (or everything if inotify is not available) are polled every poll_interval seconds,
+    all paths are re-checked every recheck_interval seconds in case an inotify event was missed.
+    """
+    def __init__(self, poll_interval=1.0, recheck_interval=30.0):
+        self.poll_interval = poll_interval
+        self.recheck_interval = recheck_interval
+        self.lock = threading.RLock()
+        # owner: {'path_set': <missing paths>, 'callback': callback(owner)}
+        self.owner_dic = {}
+        # path: {owner}
+        self.path_owner_dic = {}
+        # watched directory: {path}, path: watched directory
+        self.dir_path_dic = {}
+        self.path_dir_dic = {}
+        # watched directory: wd, wd: watched directory
+        self.dir_wd_dic = {}
+        self.wd_dir_dic = {}
+        # Paths which are polled
+        self.polled_path_set = set()
+        self.mount_list = get_mount_list()
+        self.thread = None
+
+        try:
+            self.inotify = Inotify()
+        except Exception:
+            self.inotify = None
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(target=self.watch_loop, daemon=True)
+            self.thread.start()
+
+    def is_network_path(self, path: str) -> bool:
+        for (mount_point, fs_type) in self.mount_list:
+            if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+                return fs_type in NETWORK_FS_TYPE_LIST
+
+        return False
+
+    def watch(self, owner, path_list, callback):
+        """
+        Call callback(owner) once all paths in path_list exist, replaces earlier watch of owner.
+        Callback is called from caller thread if all paths already exist, otherwise from watch thread.
+        """
+        self.unwatch(owner)
+        path_set = {os.path.abspath(path) for path in path_list if path}
+
+        with self.lock:
+            path_set = {path for path in path_set if not os.path.exists(path)}
+
+            if path_set:
+                self.owner_dic[owner] = {'path_set': path_set, 'callback': callback}
+
+                for path in path_set:
+                    if path not in self.path_owner_dic:
+                        self.path_owner_dic[path] = set()
+                        self.register_path(path)
+
+                    self.path_owner_dic[path].add(owner)
+
+        if not path_set:
+            callback(owner)
+            return
+
+        # Files created before their directory watch was added
+        for (ready_callback, ready_owner) in self.check_paths(list(path_set)):
+            ready_callback(ready_owner)
+
+        self.start()
+
+    def unwatch(self, owner):
+        with self.lock:
+            owner_info = self.owner_dic.pop(owner, None)
+
+            if not owner_info:
+                return
+
+            for path in owner_info['path_set']:
+                owner_set = self.path_owner_dic.get(path, set())
+                owner_set.discard(owner)
+
+                if not owner_set:
+                    self.unregister_path(path)
+
+    def get_watch_dir(self, path: str) -> str:
+        watch_dir = os.path.dirname(path)
+
+        while not os.path.isdir(watch_dir) and watch_dir != os.path.dirname(watch_dir):
+            watch_dir = os.path.dirname(watch_dir)
+
+        return watch_dir
+
+    def register_path(self, path: str):
+        """
+        Watch nearest existing parent directory of path, self.lock must be held.
+        """
+        self.path_owner_dic.setdefault(path, set())
+
+        if self.inotify is None or self.is_network_path(path):
+            self.polled_path_set.add(path)
+            return
+
+        watch_dir = self.get_watch_dir(path)
+
+        if watch_dir not in self.dir_wd_dic:
+            try:
+                wd = self.inotify.add_watch(watch_dir)
+            except OSError:
+                self.polled_path_set.add(path)
+                return
+
+            self.dir_wd_dic[watch_dir] = wd
+            self.wd_dir_dic[wd] = watch_dir
+
+        self.dir_path_dic.setdefault(watch_dir, set()).add(path)
+        self.path_dir_dic[path] = watch_dir
+
+    def unregister_path(self, path: str):
+        """
+        self.lock must be held.
+        """
+        self.path_owner_dic.pop(path, None)
+        self.polled_path_set.discard(path)
+        watch_dir = self.path_dir_dic.pop(path, None)
+
+        if watch_dir is not None:
+            path_set = self.dir_path_dic.get(watch_dir, set())
+            path_set.discard(path)
+
+            if not path_set:
+                self.remove_dir_watch(watch_dir)
+
+    def remove_dir_watch(self, watch_dir: str):
+        """
+        self.lock must be held.
+        """
+        self.dir_path_dic.pop(watch_dir, None)
+        wd = self.dir_wd_dic.pop(watch_dir, None)
+
+        if wd is not None:
+            self.wd_dir_dic.pop(wd, None)
+
+            try:
+                self.inotify.rm_watch(wd)
+            except Exception:
+                pass
+
+    def check_paths(self, path_list):
+        """
+        Re-check paths, satisfied paths are dropped, paths whose nearest parent changed are watched again.
+        Return callbacks of owners whose paths all exist.
+        """
+        callback_list = []
+
+        with self.lock:
+            for path in path_list:
+                if path not in self.path_owner_dic:
+                    continue
+
+                if os.path.exists(path):
+                    owner_set = self.path_owner_dic[path]
+                    self.unregister_path(path)
+
+                    for owner in owner_set:
+                        owner_info = self.owner_dic.get(owner)
+
+                        if not owner_info:
+                            continue
+
+                        owner_info['path_set'].discard(path)
+
+                        if not owner_info['path_set']:
+                            del self.owner_dic[owner]
+                            callback_list.append((owner_info['callback'], owner))
+                elif path not in self.polled_path_set and (self.path_dir_dic.get(path) not in self.dir_wd_dic or self.get_watch_dir(path) != self.path_dir_dic.get(path)):
+                    # Parent directory was created/removed, watch nearest existing parent again
+                    owner_set = self.path_owner_dic[path]
+                    self.unregister_path(path)
+                    self.register_path(path)
+                    self.path_owner_dic[path] = owner_set
+
+        return callback_list
+
+    def handle_events(self):
+        path_list = []
+
+        with self.lock:
+            for (wd, mask, name) in self.inotify.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    path_list.extend(self.path_owner_dic.keys())
+                    continue
+
+                watch_dir = self.wd_dir_dic.get(wd)
+
+                if watch_dir is None:
+                    continue
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    path_list.extend(self.dir_path_dic.get(watch_dir, set()))
+                    # Watch is gone, paths are registered on another directory by check_paths
+                    self.dir_wd_dic.pop(watch_dir, None)
+                    self.wd_dir_dic.pop(wd, None)
+                    continue
+
+                child_path = os.path.join(watch_dir, name)
+
+                for path in self.dir_path_dic.get(watch_dir, set()):
+                    if path == child_path or path.startswith(child_path + '/'):
+                        path_list.append(path)
+
+        return path_list
+
+    def watch_loop(self):
+        last_recheck = time.monotonic()
+
+        while True:
+            with self.lock:
+                if not self.owner_dic:
+                    self.thread = None
+                    return
+
+            path_list = []
+
+            if self.inotify is not None:
+                (readable_list, _, _) = select.select([self.inotify.fd], [], [], self.poll_interval)
+
+                if readable_list:
+                    path_list.extend(self.handle_events())
+            else:
+                time.sleep(self.poll_interval)
+
+            with self.lock:
+                path_list.extend(self.polled_path_set)
+
+                if time.monotonic() - last_recheck >= self.recheck_interval:
+                    last_recheck = time.monotonic()
+                    path_list.extend(self.path_owner_dic.keys())
+
+            for (callback, owner) in self.check_paths(list(dict.fromkeys(path_list))):
+                try:
+                    callback(owner)
+                except Exception:
+                    pass
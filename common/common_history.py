@@ -0,0 +1,505 @@
+"""
+Job history store (JobHistoryStore) and task history log (TaskHistoryLog).
+tools/lsfMonitor/memPrediction/common/common_history.py is a vendored copy for memPrediction (which runs without IFP),
+this file is the source, after any change copy it over the vendored one so both stay identical.
+"""
+import datetime
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dateutil import parser
+
+# Partition column, finish date of the job with format YYYY-MM-DD
+PARTITION_COLUMN = 'date'
+
+JOB_HISTORY_SCHEMA = pa.schema([
+    ('job_id', pa.string()),
+    ('job_name', pa.string()),
+    ('user', pa.string()),
+    ('project', pa.string()),
+    ('queue', pa.string()),
+    ('cwd', pa.string()),
+    ('command', pa.string()),
+    ('job_description', pa.string()),
+    ('status', pa.string()),
+    ('exit_code', pa.int32()),
+    ('rusage_mem', pa.float64()),
+    ('max_mem', pa.float64()),
+    ('avg_mem', pa.float64()),
+    ('cpu_time', pa.float64()),
+    ('processors_requested', pa.int32()),
+    ('span_hosts', pa.int32()),
+    ('interactive_mode', pa.string()),
+    ('started_time', pa.string()),
+    ('finished_time', pa.string()),
+    ('start_time', pa.timestamp('s')),
+    ('finish_time', pa.timestamp('s')),
+    ('runtime', pa.int64()),
+    ('block', pa.string()),
+    ('version', pa.string()),
+    ('flow', pa.string()),
+    ('task', pa.string()),
+])
+
+# Task history log record: key_id, offset of previous record of the same task (-1 for the first one), timestamp, job_id
+TASK_HISTORY_JOB_ID_SIZE = 40
+TASK_HISTORY_RECORD = struct.Struct(f'<Iqq{TASK_HISTORY_JOB_ID_SIZE}s')
+TASK_HISTORY_HEAD = struct.Struct('<q')
+
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+
+# Columns of query result, partition column can be selected and filtered too
+DATASET_SCHEMA = JOB_HISTORY_SCHEMA.append(pa.field(PARTITION_COLUMN, pa.string()))
+
+
+def to_number(value: Any, number_type=float) -> Optional[Any]:
+    try:
+        if value is None or str(value).strip() == '':
+            return None
+
+        return number_type(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_datetime(value: Any) -> Optional[datetime.datetime]:
+    """
+    bjobs time (like "Mon Oct 26 17:43:07") has no year, current year is used.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+
+    if value is None or str(value).strip() == '':
+        return None
+
+    try:
+        time_value = parser.parse(str(value))
+
+        # A finished job can not end in the future, it finished last year
+        if time_value > datetime.datetime.now() + datetime.timedelta(days=1):
+            time_value = time_value.replace(year=time_value.year - 1)
+
+        return time_value
+    except (ValueError, OverflowError):
+        return None
+
+
+def get_job_history_row(job_origin_data: Dict[str, Any], block: str = '', version: str = '', flow: str = '', task: str = '') -> Dict[str, Any]:
+    """
+    Convert one finished job of "bjobs -UF" into a typed job history row.
+    """
+    start_time = to_datetime(job_origin_data.get('started_time'))
+    finish_time = to_datetime(job_origin_data.get('finished_time'))
+    status = str(job_origin_data.get('status', '')).strip()
+    exit_code = to_number(job_origin_data.get('exit_code'), int)
+
+    if exit_code is None and status == 'DONE':
+        exit_code = 0
+
+    row = {'job_id': str(job_origin_data.get('job_id', '')),
+           'job_name': job_origin_data.get('job_name') or '',
+           'user': job_origin_data.get('user') or '',
+           'project': job_origin_data.get('project') or '',
+           'queue': job_origin_data.get('queue') or '',
+           'cwd': job_origin_data.get('cwd') or '',
+           'command': job_origin_data.get('command') or '',
+           'job_description': job_origin_data.get('job_description') or '',
+           'status': status,
+           'exit_code': exit_code,
+           'rusage_mem': to_number(job_origin_data.get('rusage_mem')),
+           'max_mem': to_number(job_origin_data.get('max_mem')),
+           'avg_mem': to_number(job_origin_data.get('avg_mem')),
+           'cpu_time': to_number(job_origin_data.get('cpu_time')),
+           'processors_requested': to_number(job_origin_data.get('processors_requested'), int),
+           'span_hosts': to_number(job_origin_data.get('span_hosts'), int),
+           'interactive_mode': str(job_origin_data.get('interactive_mode') or ''),
+           'started_time': str(job_origin_data.get('started_time') or ''),
+           'finished_time': str(job_origin_data.get('finished_time') or ''),
+           'start_time': start_time,
+           'finish_time': finish_time,
+           'runtime': int((finish_time - start_time).total_seconds()) if start_time and finish_time else None,
+           'block': block,
+           'version': version,
+           'flow': flow,
+           'task': task}
+
+    return row
+
+
+class JobHistoryStore:
+    """
+    Append-only job history, one Parquet file per append under date partition:
+        <path>/date=YYYY-MM-DD/part-<timestamp>-<pid>-<seq>.parquet
+    Query prunes partitions by date before opening any file, other predicates (block/version/flow/task, user, queue ...)
+    are pushed down into Parquet row group statistics.
+    Compaction merges files of one partition into compact-<...>.parquet, files it replaces are listed in hidden
+    .compact-<...>.parquet.obsolete (written first), so readers skip them as soon as compact file appears,
+    and they are removed by a later purge_obsolete() once readers which listed them before are done.
+    """
+    def __init__(self, path: str, obsolete_grace: int = 300):
+        self.path = path
+        self.obsolete_grace = obsolete_grace
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def get_partition_dir(self, date: str) -> str:
+        return os.path.join(self.path, f'{PARTITION_COLUMN}={date}')
+
+    def get_date_list(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[str]:
+        """
+        Dates (YYYY-MM-DD) of existing partitions between start_date and end_date (both included).
+        """
+        date_list = []
+
+        if not os.path.isdir(self.path):
+            return date_list
+
+        for dir_name in os.listdir(self.path):
+            if my_match := re.match(r'^' + PARTITION_COLUMN + r'=(\d{4}-\d{2}-\d{2})$', dir_name):
+                date = my_match.group(1)
+
+                if (start_date and date < start_date) or (end_date and date > end_date):
+                    continue
+
+                date_list.append(date)
+
+        return sorted(date_list)
+
+    def append(self, row_list: List[Dict[str, Any]]) -> List[str]:
+        """
+        Write rows into partitions of their finish date, rows without finish time go to today.
+        Return dates of the partitions written.
+        """
+        if not row_list:
+            return []
+
+        date_row_dic = {}
+        today = datetime.date.today().strftime('%Y-%m-%d')
+
+        for row in row_list:
+            finish_time = row.get('finish_time')
+            date = finish_time.strftime('%Y-%m-%d') if finish_time else today
+            date_row_dic.setdefault(date, []).append(row)
+
+        for (date, date_row_list) in date_row_dic.items():
+            table = pa.Table.from_pylist(date_row_list, schema=JOB_HISTORY_SCHEMA)
+            self.write_table(date, table, prefix='part')
+
+        return sorted(date_row_dic.keys())
+
+    def write_table(self, date: str, table: pa.Table, prefix: str = 'part', replaced_file_list: Optional[List[str]] = None) -> str:
+        """
+        replaced_file_list (file names of the same partition) is recorded as obsolete before the new file appears.
+        """
+        partition_dir = self.get_partition_dir(date)
+        os.makedirs(partition_dir, exist_ok=True)
+
+        with self.lock:
+            self.seq += 1
+            file_name = f'{prefix}-{datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")}-{os.getpid()}-{self.seq}.parquet'
+
+        # Write hidden file then rename, readers never see half-written files
+        file_path = os.path.join(partition_dir, file_name)
+        tmp_file_path = os.path.join(partition_dir, f'.{file_name}.tmp')
+        pq.write_table(table, tmp_file_path)
+
+        if replaced_file_list:
+            obsolete_file_path = os.path.join(partition_dir, f'.{file_name}.obsolete')
+
+            with open(f'{obsolete_file_path}.tmp', 'w') as OF:
+                OF.write(''.join([f'{replaced_file_name}\n' for replaced_file_name in replaced_file_list]))
+
+            os.replace(f'{obsolete_file_path}.tmp', obsolete_file_path)
+
+        os.replace(tmp_file_path, file_path)
+
+        return file_path
+
+    def get_obsolete_dic(self, partition_dir: str, name_list: List[str]) -> Dict[str, List[str]]:
+        """
+        {compact file name: [replaced file name, ...]} of compact files which exist in name_list.
+        """
+        obsolete_dic = {}
+
+        for name in name_list:
+            if name.startswith('.') and name.endswith('.parquet.obsolete') and name[1:-len('.obsolete')] in name_list:
+                try:
+                    with open(os.path.join(partition_dir, name), 'r') as OF:
+                        obsolete_dic[name[1:-len('.obsolete')]] = OF.read().splitlines()
+                except FileNotFoundError:
+                    continue
+
+        return obsolete_dic
+
+    def get_file_list(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[str]:
+        file_list = []
+
+        for date in self.get_date_list(start_date, end_date):
+            partition_dir = self.get_partition_dir(date)
+            name_list = os.listdir(partition_dir)
+            obsolete_set = set()
+
+            for replaced_file_list in self.get_obsolete_dic(partition_dir, name_list).values():
+                obsolete_set.update(replaced_file_list)
+
+            for file_name in sorted(name_list):
+                if file_name.endswith('.parquet') and not file_name.startswith('.') and file_name not in obsolete_set:
+                    file_list.append(os.path.join(partition_dir, file_name))
+
+        return file_list
+
+    @staticmethod
+    def gen_filter(filter_dic: Dict[str, Any]):
+        """
+        {column: value} means column == value, {column: [value, ...]} means column in values, None values are ignored.
+        """
+        expression = None
+
+        for (column, value) in filter_dic.items():
+            if value is None:
+                continue
+
+            if isinstance(value, (list, tuple, set)):
+                item_expression = ds.field(column).isin(list(value))
+            else:
+                item_expression = (ds.field(column) == value)
+
+            expression = item_expression if expression is None else (expression & item_expression)
+
+        return expression
+
+    def query(self, start_date: Optional[str] = None, end_date: Optional[str] = None, columns: Optional[List[str]] = None, **filter_dic) -> pa.Table:
+        """
+        Get job history between start_date and end_date (YYYY-MM-DD, both included) as pyarrow table.
+        filter_dic is pushed down, like query('2024-01-01', '2024-01-31', block='b', task=['syn', 'sta']).
+        """
+        file_list = self.get_file_list(start_date, end_date)
+
+        if not file_list:
+            schema = DATASET_SCHEMA if not columns else pa.schema([DATASET_SCHEMA.field(column) for column in columns if column in DATASET_SCHEMA.names])
+            return schema.empty_table()
+
+        dataset = ds.dataset(file_list, schema=DATASET_SCHEMA, format='parquet', partitioning=PARTITIONING, partition_base_dir=self.path)
+
+        return dataset.to_table(columns=columns, filter=self.gen_filter(filter_dic))
+
+    def query_df(self, start_date: Optional[str] = None, end_date: Optional[str] = None, columns: Optional[List[str]] = None, **filter_dic) -> pd.DataFrame:
+        return self.query(start_date, end_date, columns, **filter_dic).to_pandas()
+
+    def compact(self, date: str) -> bool:
+        """
+        Merge all files of one (finished) date partition into one file, so queries open less files.
+        Replaced files are only marked obsolete here, purge_obsolete() removes them later.
+        """
+        file_list = self.get_file_list(date, date)
+
+        if len(file_list) <= 1:
+            return False
+
+        table = ds.dataset(file_list, schema=JOB_HISTORY_SCHEMA, format='parquet').to_table()
+        self.write_table(date, table, prefix='compact', replaced_file_list=[os.path.basename(file_path) for file_path in file_list])
+
+        return True
+
+    def purge_obsolete(self) -> int:
+        """
+        Remove files replaced by compaction more than obsolete_grace seconds ago, return removed file number.
+        """
+        removed = 0
+        now = time.time()
+
+        for date in self.get_date_list():
+            partition_dir = self.get_partition_dir(date)
+            name_list = os.listdir(partition_dir)
+
+            for (compact_file_name, replaced_file_list) in self.get_obsolete_dic(partition_dir, name_list).items():
+                obsolete_file_path = os.path.join(partition_dir, f'.{compact_file_name}.obsolete')
+
+                try:
+                    if now - os.path.getmtime(obsolete_file_path) < self.obsolete_grace:
+                        continue
+                except FileNotFoundError:
+                    continue
+
+                for replaced_file_name in replaced_file_list:
+                    try:
+                        os.remove(os.path.join(partition_dir, replaced_file_name))
+                        removed += 1
+                    except FileNotFoundError:
+                        continue
+
+                try:
+                    os.remove(obsolete_file_path)
+                except FileNotFoundError:
+                    continue
+
+            # Left by compaction which was interrupted before compact file appeared
+            for name in name_list:
+                if name.startswith('.') and (name.endswith('.tmp') or (name.endswith('.parquet.obsolete') and name[1:-len('.obsolete')] not in name_list)):
+                    try:
+                        if now - os.path.getmtime(os.path.join(partition_dir, name)) >= self.obsolete_grace:
+                            os.remove(os.path.join(partition_dir, name))
+                    except FileNotFoundError:
+                        continue
+
+        return removed
+
+
+class TaskHistoryLog:
+    """
+    Append-only job history of tasks (job ids of RUN action), three files share one path prefix:
+        <path>.dat  : fixed-size records (TASK_HISTORY_RECORD), records of one task are chained by previous offset
+        <path>.key  : one json line [block, version, flow, task] per task, key_id is the line number
+        <path>.head : offset of the latest record of every key_id, TASK_HISTORY_HEAD at key_id * TASK_HISTORY_HEAD.size
+    Latest k jobs of one task are read with k seeks, writers never rewrite records.
+    """
+    def __init__(self, path: str):
+        self.data_path = f'{path}.dat'
+        self.key_path = f'{path}.key'
+        self.head_path = f'{path}.head'
+        self.lock = threading.Lock()
+        # (block, version, flow, task): key_id
+        self.key_dic = {}
+        self.key_file_size = 0
+
+    def load_keys(self):
+        """
+        Read keys appended (by any process) since last load.
+        """
+        if not os.path.exists(self.key_path):
+            return
+
+        with open(self.key_path, 'rb') as KF:
+            KF.seek(self.key_file_size)
+            content = KF.read()
+
+        # Ignore unfinished last line
+        content = content[:content.rfind(b'\n') + 1]
+        self.key_file_size += len(content)
+
+        for line in content.splitlines():
+            self.key_dic[tuple(json.loads(line))] = len(self.key_dic)
+
+    def get_key_id(self, key: tuple, create: bool = False) -> int:
+        """
+        With create, caller must hold the lock of data file (append), so no other process writes key file meanwhile.
+        """
+        if key not in self.key_dic:
+            self.load_keys()
+
+        if key not in self.key_dic and create:
+            line = (json.dumps(list(key)) + '\n').encode('utf-8')
+
+            with open(self.key_path, 'ab') as KF:
+                # Cut unfinished last line of an interrupted writer, all finished lines are loaded already
+                if KF.seek(0, os.SEEK_END) > self.key_file_size:
+                    KF.truncate(self.key_file_size)
+
+                KF.write(line)
+
+            self.key_dic[key] = len(self.key_dic)
+            self.key_file_size += len(line)
+
+        return self.key_dic.get(key, -1)
+
+    def read_head(self, key_id: int, HF=None) -> int:
+        if key_id < 0:
+            return -1
+
+        if HF is None:
+            if not os.path.exists(self.head_path):
+                return -1
+
+            with open(self.head_path, 'rb') as HF:
+                return self.read_head(key_id, HF)
+
+        HF.seek(key_id * TASK_HISTORY_HEAD.size)
+        content = HF.read(TASK_HISTORY_HEAD.size)
+
+        if len(content) != TASK_HISTORY_HEAD.size:
+            return -1
+
+        return TASK_HISTORY_HEAD.unpack(content)[0]
+
+    def append(self, row_list: List[Dict[str, Any]]) -> int:
+        """
+        Append rows like {'block', 'version', 'flow', 'task', 'job_id', 'timestamp'} with one write.
+        """
+        if not row_list:
+            return 0
+
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+
+        with self.lock, open(self.data_path, 'ab') as DF:
+            # Serialize writers of different processes, key file and head file are updated under the same lock
+            fcntl.flock(DF, fcntl.LOCK_EX)
+
+            try:
+                offset = DF.seek(0, os.SEEK_END)
+
+                # Drop half-written record of an interrupted writer
+                if offset % TASK_HISTORY_RECORD.size:
+                    offset -= offset % TASK_HISTORY_RECORD.size
+                    DF.truncate(offset)
+
+                head_dic = {}
+                content = bytearray()
+
+                with open(self.head_path, 'r+b' if os.path.exists(self.head_path) else 'w+b') as HF:
+                    for row in row_list:
+                        key_id = self.get_key_id((row['block'], row['version'], row['flow'], row['task']), create=True)
+                        prev_offset = head_dic[key_id] if key_id in head_dic else self.read_head(key_id, HF)
+                        content += TASK_HISTORY_RECORD.pack(key_id, prev_offset, int(row.get('timestamp', 0)), str(row['job_id']).encode('utf-8')[:TASK_HISTORY_JOB_ID_SIZE])
+                        head_dic[key_id] = offset
+                        offset += TASK_HISTORY_RECORD.size
+
+                    DF.write(content)
+                    DF.flush()
+
+                    # Records are written before heads point to them
+                    for (key_id, head_offset) in head_dic.items():
+                        HF.seek(key_id * TASK_HISTORY_HEAD.size)
+                        HF.write(TASK_HISTORY_HEAD.pack(head_offset))
+            finally:
+                fcntl.flock(DF, fcntl.LOCK_UN)
+
+        return len(row_list)
+
+    def get_task_history(self, block: str, version: str, flow: str, task: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Latest (at most limit) jobs of one task, newest first.
+        """
+        key_id = self.get_key_id((block, version, flow, task))
+        offset = self.read_head(key_id)
+        history_list = []
+
+        if offset < 0 or not os.path.exists(self.data_path):
+            return history_list
+
+        with open(self.data_path, 'rb') as DF:
+            while offset >= 0 and len(history_list) < limit:
+                DF.seek(offset)
+                content = DF.read(TASK_HISTORY_RECORD.size)
+
+                if len(content) != TASK_HISTORY_RECORD.size:
+                    break
+
+                (record_key_id, prev_offset, timestamp, job_id) = TASK_HISTORY_RECORD.unpack(content)
+
+                if record_key_id != key_id or prev_offset >= offset:
+                    break
+
+                history_list.append({'block': block, 'version': version, 'flow': flow, 'task': task, 'job_id': job_id.rstrip(b'\x00').decode('utf-8'), 'timestamp': timestamp})
+                offset = prev_offset
+
+        return history_list
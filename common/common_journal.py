@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+# uuid of the record which keeps stat of exported yaml status file
+EXPORT_KEY = ''
+
+
+class StatusJournal:
+    """
+    Task status of main table keyed by task uuid, saved as json lines [uuid, row] in <status_file>.journal.
+    save() appends only the rows which changed since last load/save, once records outnumber twice the rows (and
+    min_compact_records), the file is compacted into one line per current row. load() replays the file, later lines win,
+    an unfinished last line is truncated.
+    A record with empty uuid keeps [mtime_ns, size] of the yaml status file last exported by IFP, so is_current() can tell
+    whether the yaml file was replaced or edited since then.
+    """
+    def __init__(self, status_file: str, min_compact_records: int = 1000):
+        self.journal_file = f'{status_file}.journal'
+        self.min_compact_records = min_compact_records
+        self.lock = threading.Lock()
+        # uuid: row, rows already saved into journal file
+        self.row_dic = {}
+        self.record_num = 0
+        # [mtime_ns, size] of yaml status file last exported
+        self.export_stat = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_file)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        row_dic = {}
+        record_num = 0
+        export_stat = None
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r+b') as JF:
+                size = 0
+
+                for line in JF:
+                    # Unfinished record of an interrupted save, cut it so next save does not append after it
+                    if not line.endswith(b'\n'):
+                        JF.truncate(size)
+                        break
+
+                    size += len(line)
+
+                    try:
+                        (uuid, row) = json.loads(line)
+                    except ValueError:
+                        continue
+
+                    record_num += 1
+
+                    if uuid == EXPORT_KEY:
+                        export_stat = row
+                    else:
+                        row_dic[uuid] = row
+
+        with self.lock:
+            self.row_dic = dict(row_dic)
+            self.record_num = record_num
+            self.export_stat = export_stat
+
+        return row_dic
+
+    @staticmethod
+    def get_file_stat(file_path: str) -> List[int]:
+        stat = os.stat(file_path)
+
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def is_current(self, status_file: str) -> bool:
+        """
+        Whether journal (already loaded) is at least as new as yaml status_file, so it should be loaded instead of the yaml file.
+        """
+        if not self.exists():
+            return False
+
+        if not os.path.exists(status_file):
+            return True
+
+        if self.export_stat is not None:
+            return self.get_file_stat(status_file) == self.export_stat
+
+        return os.stat(self.journal_file).st_mtime_ns >= os.stat(status_file).st_mtime_ns
+
+    def record_export(self, status_file: str):
+        """
+        Remember yaml status_file which was just exported from current rows.
+        """
+        export_stat = self.get_file_stat(status_file)
+
+        with self.lock:
+            with open(self.journal_file, 'a', encoding='utf-8') as JF:
+                JF.write(json.dumps([EXPORT_KEY, export_stat]) + '\n')
+
+            self.export_stat = export_stat
+            self.record_num += 1
+
+    def reset(self, row_dic: Dict[str, Dict[str, Any]]):
+        """
+        Replace journal content with row_dic, used when rows are loaded from a newer yaml status file.
+        """
+        with self.lock:
+            self.export_stat = None
+            self.compact(row_dic)
+
+    def save(self, row_dic: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Save current rows, return changed row number.
+        """
+        with self.lock:
+            change_dic = {uuid: row for (uuid, row) in row_dic.items() if self.row_dic.get(uuid) != row}
+
+            if not change_dic:
+                return 0
+
+            if self.record_num + len(change_dic) > max(self.min_compact_records, 2 * len(row_dic)):
+                self.compact(row_dic)
+            else:
+                with open(self.journal_file, 'a', encoding='utf-8') as JF:
+                    JF.write(''.join([json.dumps([uuid, row]) + '\n' for (uuid, row) in change_dic.items()]))
+
+                self.row_dic.update(change_dic)
+                self.record_num += len(change_dic)
+
+            return len(change_dic)
+
+    def compact(self, row_dic: Dict[str, Dict[str, Any]]):
+        """
+        Rewrite journal file with current rows only, self.lock must be held.
+        """
+        tmp_file = f'{self.journal_file}.{os.getpid()}.tmp'
+
+        with open(tmp_file, 'w', encoding='utf-8') as JF:
+            if self.export_stat is not None:
+                JF.write(json.dumps([EXPORT_KEY, self.export_stat]) + '\n')
+
+            JF.write(''.join([json.dumps([uuid, row]) + '\n' for (uuid, row) in row_dic.items()]))
+
+        os.replace(tmp_file, self.journal_file)
+        self.row_dic = dict(row_dic)
+        self.record_num = len(row_dic) + (1 if self.export_stat is not None else 0)
@@ -1,6 +1,7 @@
 import os
 import re
 import sys
+import threading
 import time
 import datetime
 from concurrent.futures import ProcessPoolExecutor, as_completed
@@ -496,6 +497,224 @@ class FilterLicenseDic():
         return filtered_license_dic
 
 
+class LicenseSnapshotService():
+    """
+    Process wide license availability cache.
+    One lmstat run (per lmstat command) is parsed and shared by all tasks until it is older than ttl seconds.
+    Licenses IFP granted to tasks but not checked out yet are tracked as reservations of the feature, so they are not granted twice,
+    no matter which lmstat command (queue) the tasks see the license servers through.
+    Reservation is discharged when in_use of its feature grows on a license server, when owner releases it, or after reservation_timeout seconds.
+    """
+    def __init__(self, lmstat_path='lmstat', ttl=30, reservation_timeout=300):
+        self.lmstat_path = lmstat_path
+        self.ttl = ttl
+        self.reservation_timeout = reservation_timeout
+        self.lock = threading.Lock()
+        # bsub_command: [callback, ...] of running lmstat, only one refresh at a time for one command
+        self.refresh_dic = {}
+        # bsub_command: {'time': <monotonic time>, 'license_dic': license_dic, 'usage_dic': {(license_server, feature): [issued, in_use]}, 'feature_usage_dic': {feature: [issued, in_use]}}
+        self.snapshot_dic = {}
+        # (license_server, feature): in_use of latest snapshot which reports it
+        self.in_use_dic = {}
+        # feature: [[owner, quantity, <monotonic time>], ...] in grant order
+        self.reservation_dic = {}
+
+    @staticmethod
+    def get_usage_dic(license_dic):
+        """
+        Return {(license_server, feature): [issued, in_use]} summed on vendor daemons of the license server.
+        """
+        usage_dic = {}
+
+        for license_server in license_dic.keys():
+            for vendor_daemon in license_dic[license_server].get('vendor_daemon', {}).keys():
+                for (feature, feature_dic) in license_dic[license_server]['vendor_daemon'][vendor_daemon].get('feature', {}).items():
+                    usage = usage_dic.setdefault((license_server, feature), [0, 0])
+
+                    try:
+                        usage[0] += int(feature_dic.get('issued', 0))
+                        usage[1] += int(feature_dic.get('in_use', 0))
+                    except (TypeError, ValueError):
+                        continue
+
+        return usage_dic
+
+    @staticmethod
+    def get_feature_usage_dic(usage_dic):
+        """
+        Return {feature: [issued, in_use]} summed on all license servers.
+        """
+        feature_usage_dic = {}
+
+        for ((license_server, feature), (issued, in_use)) in usage_dic.items():
+            usage = feature_usage_dic.setdefault(feature, [0, 0])
+            usage[0] += issued
+            usage[1] += in_use
+
+        return feature_usage_dic
+
+    def request_snapshot(self, bsub_command=None, callback=None):
+        """
+        Return snapshot if it is fresh, otherwise start lmstat in a background thread (one per command) and return None,
+        callback is called once the new snapshot is ready.
+        """
+        with self.lock:
+            snapshot = self.snapshot_dic.get(bsub_command)
+
+            if snapshot and time.monotonic() - snapshot['time'] < self.ttl:
+                return snapshot
+
+            if bsub_command in self.refresh_dic:
+                self.refresh_dic[bsub_command].append(callback)
+                return None
+
+            self.refresh_dic[bsub_command] = [callback]
+
+        threading.Thread(target=self.refresh, args=(bsub_command,), daemon=True).start()
+
+        return None
+
+    def refresh(self, bsub_command=None):
+        """
+        Run lmstat and publish the new snapshot, callbacks of the refresh always fire (an empty snapshot is published on failure,
+        so waiting tasks retry after ttl instead of hanging).
+        """
+        try:
+            try:
+                if bsub_command is None:
+                    license_dic = GetLicenseInfo(lmstat_path=self.lmstat_path).get_license_info()
+                else:
+                    license_dic = GetLicenseInfo(lmstat_path=self.lmstat_path, bsub_command=bsub_command).get_license_info()
+
+                usage_dic = self.get_usage_dic(license_dic)
+            except Exception as error:
+                common.print_warning('*Warning*: Failed to get license information with "' + str(bsub_command) + '": ' + str(error))
+                license_dic = {}
+                usage_dic = {}
+
+            new_snapshot = {'time': time.monotonic(), 'license_dic': license_dic, 'usage_dic': usage_dic, 'feature_usage_dic': self.get_feature_usage_dic(usage_dic)}
+
+            with self.lock:
+                self.snapshot_dic[bsub_command] = new_snapshot
+                self.discharge_reservations(new_snapshot)
+        finally:
+            with self.lock:
+                callback_list = self.refresh_dic.pop(bsub_command, [])
+
+            for callback in callback_list:
+                if callback:
+                    try:
+                        callback()
+                    except Exception as error:
+                        common.print_warning('*Warning*: License snapshot callback failed: ' + str(error))
+
+    def get_snapshot(self, bsub_command=None):
+        """
+        Blocking version of request_snapshot.
+        """
+        ready_event = threading.Event()
+        snapshot = self.request_snapshot(bsub_command, callback=ready_event.set)
+
+        if snapshot is None:
+            ready_event.wait()
+
+            with self.lock:
+                snapshot = self.snapshot_dic.get(bsub_command, {'time': time.monotonic(), 'license_dic': {}, 'usage_dic': {}, 'feature_usage_dic': {}})
+
+        return snapshot
+
+    def get_license_dic(self, bsub_command=None):
+        return self.get_snapshot(bsub_command)['license_dic']
+
+    def discharge_reservations(self, new_snapshot):
+        """
+        Licenses checked out since a license server was last seen consume oldest reservations of the same feature, self.lock must be held.
+        """
+        now = time.monotonic()
+        checked_out_dic = {}
+
+        for ((license_server, feature), (issued, in_use)) in new_snapshot['usage_dic'].items():
+            last_in_use = self.in_use_dic.get((license_server, feature))
+            self.in_use_dic[(license_server, feature)] = in_use
+
+            if (last_in_use is not None) and (in_use > last_in_use):
+                checked_out_dic[feature] = checked_out_dic.get(feature, 0) + in_use - last_in_use
+
+        for feature in list(self.reservation_dic.keys()):
+            reservation_list = [reservation for reservation in self.reservation_dic[feature] if now - reservation[2] < self.reservation_timeout]
+            checked_out = checked_out_dic.get(feature, 0)
+
+            for reservation in reservation_list:
+                if checked_out <= 0:
+                    break
+
+                discharged = min(checked_out, reservation[1])
+                reservation[1] -= discharged
+                checked_out -= discharged
+
+            reservation_list = [reservation for reservation in reservation_list if reservation[1] > 0]
+
+            if reservation_list:
+                self.reservation_dic[feature] = reservation_list
+            else:
+                del self.reservation_dic[feature]
+
+    def get_reserved(self, feature):
+        """
+        self.lock must be held.
+        """
+        now = time.monotonic()
+
+        return sum([reservation[1] for reservation in self.reservation_dic.get(feature, []) if now - reservation[2] < self.reservation_timeout])
+
+    def try_reserve(self, owner, required_feature_dic, bsub_command=None, callback=None):
+        """
+        Reserve all required licenses ({feature: quantity}) for owner, or nothing.
+        Return (granted, [(feature, required, issued, in_use, reserved), ...]), the list has all insufficient features.
+        With callback, lmstat does not block the caller: granted is None while snapshot is refreshed, callback is called once it is ready.
+        """
+        if callback:
+            snapshot = self.request_snapshot(bsub_command, callback=callback)
+
+            if snapshot is None:
+                return None, []
+        else:
+            snapshot = self.get_snapshot(bsub_command)
+
+        shortage_list = []
+
+        with self.lock:
+            for (feature, quantity) in required_feature_dic.items():
+                (issued, in_use) = snapshot['feature_usage_dic'].get(feature, [0, 0])
+                reserved = self.get_reserved(feature)
+
+                if int(quantity) > issued - in_use - reserved:
+                    shortage_list.append((feature, int(quantity), issued, in_use, reserved))
+
+            if shortage_list:
+                return False, shortage_list
+
+            now = time.monotonic()
+
+            for (feature, quantity) in required_feature_dic.items():
+                self.reservation_dic.setdefault(feature, []).append([owner, int(quantity), now])
+
+        return True, []
+
+    def release(self, owner):
+        """
+        Drop reservations of owner which are not checked out yet.
+        """
+        with self.lock:
+            for feature in list(self.reservation_dic.keys()):
+                reservation_list = [reservation for reservation in self.reservation_dic[feature] if reservation[0] is not owner]
+
+                if reservation_list:
+                    self.reservation_dic[feature] = reservation_list
+                else:
+                    del self.reservation_dic[feature]
+
+
 def switch_start_time(start_time, compare_second='', format=''):
     """
     Switch start_time format from "%a %m/%d %H:%M" to specified format (or start_second by default).
@@ -1,6 +1,8 @@
 import os
 import re
 import sys
+import shlex
+import subprocess
 import collections
 
 sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
@@ -203,6 +205,108 @@ def get_tool_name():
     return ''
 
 
+BSUB_INTERACTIVE_OPTIONS = ['-I', '-Ip', '-Is', '-IS', '-ISp', '-ISs', '-IX', '-K']
+BSUB_OUTPUT_OPTIONS = ['-J', '-o', '-oo', '-e', '-eo']
+
+
+def split_bsub_command(bsub_command):
+    """
+    Split "bsub <options> <command>" into (option_list, command).
+    Return (None, None) if bsub_command cannot be parsed.
+    """
+    try:
+        item_list = shlex.split(bsub_command)
+    except ValueError:
+        return None, None
+
+    if len(item_list) < 2 or item_list[0] != 'bsub':
+        return None, None
+
+    return item_list[1:-1], item_list[-1]
+
+
+def get_job_array_options(option_list):
+    """
+    Get bsub options which can be shared by all elements of one job array.
+    Return None for interactive jobs, they cannot be submitted as job array.
+    Job name and output options are removed, job array defines its own.
+    """
+    array_option_list = []
+    skip_next = False
+
+    for option in option_list:
+        if skip_next:
+            skip_next = False
+            continue
+
+        if option in BSUB_INTERACTIVE_OPTIONS:
+            return None
+        elif option in BSUB_OUTPUT_OPTIONS:
+            skip_next = True
+            continue
+
+        array_option_list.append(option)
+
+    return array_option_list
+
+
+BJOBS_STATUS_FIELDS = ['jobid', 'jobindex', 'stat', 'exit_code']
+BJOBS_DELIMITER = '|'
+
+
+def get_bjobs_status_info(job_id_list, bjobs='bjobs', chunk_size=5000, timeout=120):
+    """
+    Get {job_id: {'status': <STAT>, 'exit_code': <EXIT_CODE>}} with structured bjobs output.
+    ====
+    bjobs -o "jobid jobindex stat exit_code delimiter='|'" -noheader 101 102 '103[1]'
+    101|0|RUN|-
+    103|1|EXIT|2
+    ====
+    Job array element is returned as "<job_id>[<job_index>]".
+    Large id lists are split into chunks to keep each command below argv limit.
+    """
+    my_dic = {}
+    output_format = '{} delimiter=\'{}\''.format(' '.join(BJOBS_STATUS_FIELDS), BJOBS_DELIMITER)
+
+    for i in range(0, len(job_id_list), chunk_size):
+        command = [bjobs, '-o', output_format, '-noheader'] + [str(job_id) for job_id in job_id_list[i:i + chunk_size]]
+
+        try:
+            stdout = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=timeout).stdout
+        except (OSError, subprocess.TimeoutExpired) as error:
+            print('*Warning*: Failed on getting job status with bjobs: ' + str(error))
+            continue
+
+        my_dic.update(parse_bjobs_status_info(stdout))
+
+    return my_dic
+
+
+def parse_bjobs_status_info(stdout):
+    """
+    Parse output of get_bjobs_status_info, skip "Job <id> is not found" and malformed lines.
+    """
+    my_dic = {}
+
+    for line in stdout.splitlines():
+        item_list = line.split(BJOBS_DELIMITER)
+
+        if len(item_list) != len(BJOBS_STATUS_FIELDS):
+            continue
+
+        (job_id, job_index, status, exit_code) = [item.strip() for item in item_list]
+
+        if not job_id.isdigit():
+            continue
+
+        if job_index and job_index not in ['0', '-']:
+            job_id = '{}[{}]'.format(job_id, job_index)
+
+        my_dic[job_id] = {'status': status, 'exit_code': exit_code}
+
+    return my_dic
+
+
 def get_bjobs_uf_info(command='bjobs -u all -UF'):
     """
     Get job information with "bjobs -UF".
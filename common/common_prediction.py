@@ -1,10 +1,15 @@
+import collections
+import hashlib
 import os
 import re
 import shlex
-import subprocess
-from typing import Dict
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 
+import requests
 import yaml
+from requests.adapters import HTTPAdapter
 
 
 def read_conf() -> dict:
@@ -19,9 +24,130 @@ def read_conf() -> dict:
     return conf_dic if conf_dic is not None else {}
 
 
+def get_cache_key(job_info: Dict[str, str]) -> Tuple[str, str, str, str]:
+    """
+    Jobs with same user, queue, job name and command get the same prediction.
+    """
+    command_hash = hashlib.md5(str(job_info.get('command', '')).encode('utf-8')).hexdigest()
+
+    return str(job_info.get('user', '')), str(job_info.get('queue', '')), str(job_info.get('job_name', '')), command_hash
+
+
+class PredictionClient:
+    """
+    HTTP client of memory prediction model_service.
+    One pooled session is kept for all requests, jobs of one dispatch cycle are predicted with one request on <model_service>/batch
+    (falls back to one request per job on the same session if the service has no batch endpoint),
+    and predictions are kept in an LRU cache keyed by get_cache_key.
+    After a failed request service is not asked again for retry_interval seconds, so job submission never waits on a broken service.
+    """
+    def __init__(self, service: str, factor_list: List[str], batch_service: str = None, timeout: float = 3, cache_size: int = 4096, pool_size: int = 10, retry_interval: float = 30):
+        self.service = service
+        self.batch_service = batch_service if batch_service else f'{service.rstrip("/")}/batch'
+        self.factor_list = factor_list
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock()
+        # cache key: predicted memory
+        self.cache = collections.OrderedDict()
+        self.batch_supported = True
+        self.retry_time = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_cache(self, key) -> Optional[int]:
+        with self.lock:
+            if key not in self.cache:
+                return None
+
+            self.cache.move_to_end(key)
+
+            return self.cache[key]
+
+    def set_cache(self, key, memory: int):
+        with self.lock:
+            self.cache[key] = memory
+            self.cache.move_to_end(key)
+
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def get_factors(self, job_info: Dict[str, str]) -> Dict[str, str]:
+        return {factor: str(job_info.get(factor, '')) for factor in self.factor_list}
+
+    def predict_memory(self, job_info_list: List[Dict[str, str]]) -> List[Optional[int]]:
+        """
+        Return predicted max memory of every job, None if it could not be predicted.
+        """
+        memory_list = [None] * len(job_info_list)
+        # cache key: [index of job_info_list]
+        miss_dic = {}
+
+        for (i, job_info) in enumerate(job_info_list):
+            key = get_cache_key(job_info)
+            memory = self.get_cache(key)
+
+            if memory is not None:
+                memory_list[i] = memory
+            else:
+                miss_dic.setdefault(key, []).append(i)
+
+        if not miss_dic or time.monotonic() < self.retry_time:
+            return memory_list
+
+        miss_key_list = list(miss_dic.keys())
+        factor_list = [self.get_factors(job_info_list[miss_dic[key][0]]) for key in miss_key_list]
+
+        try:
+            for (key, memory) in zip(miss_key_list, self.request(factor_list)):
+                if memory is None:
+                    continue
+
+                self.set_cache(key, memory)
+
+                for i in miss_dic[key]:
+                    memory_list[i] = memory
+        except Exception:
+            self.retry_time = time.monotonic() + self.retry_interval
+            raise
+
+        return memory_list
+
+    def request(self, factor_list: List[Dict[str, str]]) -> List[Optional[int]]:
+        if self.batch_supported:
+            response = self.session.post(self.batch_service, json={'jobs': factor_list}, timeout=self.timeout)
+
+            if response.status_code in [404, 405]:
+                self.batch_supported = False
+            else:
+                response.raise_for_status()
+
+                return [int(float(memory)) if memory is not None else None for memory in response.json()]
+
+        memory_list = []
+
+        for factors in factor_list:
+            response = self.session.post(self.service, data=factors, timeout=self.timeout)
+            response.raise_for_status()
+            memory_list.append(int(float(response.json())))
+
+        return memory_list
+
+
 class PredictionModel:
     def __init__(self):
         self.config_dic = read_conf()
+        self.client = None
+
+        if self.config_dic.get('model_service') and self.config_dic.get('factors'):
+            self.client = PredictionClient(service=self.config_dic['model_service'],
+                                           factor_list=self.config_dic['factors'],
+                                           batch_service=self.config_dic.get('batch_service'),
+                                           timeout=self.config_dic.get('timeout', 3),
+                                           cache_size=self.config_dic.get('cache_size', 4096))
 
     def predict_job(self, job_info: Dict[str, str], command: str) -> str:
         new_command = command
@@ -57,22 +183,50 @@ class PredictionModel:
 
         return False
 
-    def predict_job_memory(self, job_info: Dict[str, str]) -> int:
+    def predict_jobs(self, job_list: List[Tuple[Dict[str, str], str]]) -> List[str]:
         """
-        Predicting max memory usage of job based on job information.
+        Predict (job_info, command) jobs of one dispatch cycle with one request, return new commands.
+        Commands which are not checked or predicted are returned as they are.
         """
-        service = self.config_dic.get('model_service')
-        factor_list = self.config_dic.get('factors')
+        new_command_list = [command for (job_info, command) in job_list]
+        index_list = []
+
+        for (i, (job_info, command)) in enumerate(job_list):
+            if self.check_job_res_req(res_req=job_info.get('res_req', '')):
+                index_list.append(i)
 
-        if service is None or factor_list is None:
+        if not index_list:
+            return new_command_list
+
+        memory_list = self.predict_job_memory([job_list[i][0] for i in index_list])
+
+        for (i, memory) in zip(index_list, memory_list):
+            if memory is None:
+                continue
+
+            try:
+                new_command_list[i] = self._gen_new_command(command=job_list[i][1], res_req=str(memory))
+            except Exception:
+                pass
+
+        return new_command_list
+
+    def predict_job_memory(self, job_info: Union[Dict[str, str], List[Dict[str, str]]]) -> Union[int, List[Optional[int]]]:
+        """
+        Predicting max memory usage of job (or jobs) based on job information.
+        """
+        if self.client is None:
             raise RuntimeError
 
-        factor_data = (' '.join([f'--data-urlencode {factor}="{{{factor}}}"' for factor in factor_list])).format_map(job_info)
-        command = f'curl -m 3 {service} -s -X POST {factor_data}'
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        mem_predict = process.stdout.readlines()[-1]
+        if isinstance(job_info, list):
+            return self.client.predict_memory(job_info)
+
+        memory = self.client.predict_memory([job_info])[0]
+
+        if memory is None:
+            raise RuntimeError
 
-        return int(mem_predict)
+        return memory
 
     def _gen_res_req(self, res_req: str, memory: int) -> str:
         if res_req.find('rusage') != -1:
@@ -100,8 +254,9 @@ class PredictionModel:
                 break
 
         res_req_token = f'rusage[mem={res_req}]'
-        res_req_tokens = ['-R', f'"{res_req_token}"']
+        res_req_tokens = ['-R', res_req_token]
 
+        # Quote again, job command after bsub options may contain spaces and shell characters
         run_info_list = run_info_list[:insert_index] + res_req_tokens + run_info_list[insert_index:]
-        new_command = ' '.join(run_info_list)
+        new_command = shlex.join(run_info_list)
         return new_command
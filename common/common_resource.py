@@ -0,0 +1,253 @@
+import collections
+import heapq
+import math
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+QUEUE = 'QUEUE'
+LICENSE = 'LICENSE'
+FLOW = 'FLOW'
+TOTAL = ('TOTAL', '')
+
+
+def get_bsub_queue(run_method: str) -> str:
+    """
+    Return queue of "bsub -q <queue>" run method, '' for local run method.
+    """
+    if not run_method or not re.search(r'^\s*bsub', run_method):
+        return ''
+
+    match = re.search(r'(?:^|\s)-q\s+(\S+)', run_method)
+
+    return match.group(1) if match else ''
+
+
+def get_license_demand(license_list) -> Dict[str, int]:
+    """
+    Parse DEPENDENCY:LICENSE list (["<feature>:<quantity>", ...]) into {feature: quantity}.
+    """
+    license_dic = {}
+
+    for item in license_list or []:
+        if len(str(item).split(':')) != 2:
+            continue
+
+        (feature, quantity) = [value.strip() for value in str(item).split(':')]
+
+        try:
+            quantity = int(quantity)
+        except ValueError:
+            continue
+
+        if feature and quantity > 0:
+            license_dic[feature] = license_dic.get(feature, 0) + quantity
+
+    return license_dic
+
+
+def get_resource_demand(queue: str, flow: str, license_dic: Dict[str, int]) -> Dict[Tuple[str, str], int]:
+    """
+    Resource keys one RUN action holds while it is running.
+    """
+    demand = {TOTAL: 1, (FLOW, flow): 1}
+
+    if queue:
+        demand[(QUEUE, queue)] = 1
+
+    for (feature, quantity) in license_dic.items():
+        demand[(LICENSE, feature)] = quantity
+
+    return demand
+
+
+def get_share_key(demand: Dict[Tuple[str, str], int]) -> Tuple[str, str]:
+    """
+    Fair share group of demand, LSF tasks share their queue, local tasks share their flow.
+    """
+    for key in demand.keys():
+        if key[0] == QUEUE:
+            return key
+
+    for key in demand.keys():
+        if key[0] == FLOW:
+            return key
+
+    return TOTAL
+
+
+def format_resource_key(key: Tuple[str, str]) -> str:
+    if key == TOTAL:
+        return 'Max running jobs'
+
+    return f'{key[0].capitalize()} {key[1]}'
+
+
+class ResourceAdmissionController:
+    """
+    Slot/token admission of RUN actions.
+    Limits are MAX_RUNNING_JOBS (TOTAL) and RESOURCE section of default yaml:
+        RESOURCE:
+          QUEUE:
+            <queue>: <max running jobs in queue>
+          LICENSE:
+            <feature>: <license tokens IFP jobs may hold>
+          FLOW:
+            <flow>: <max running tasks of flow>
+    Resources without limit are unlimited but usage is still counted for fair share.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # resource key: limit
+        self.limit_dic = {}
+        # resource key: current usage
+        self.usage_dic = collections.defaultdict(int)
+        # owner: demand it holds
+        self.holder_dic = {}
+        # owner: monotonic time it was blocked first
+        self.waiting_since_dic = {}
+
+    def configure(self, resource_dic: dict, max_running_jobs=None):
+        limit_dic = {}
+
+        if isinstance(resource_dic, dict):
+            for kind in [QUEUE, LICENSE, FLOW]:
+                setting_dic = resource_dic.get(kind)
+
+                if not isinstance(setting_dic, dict):
+                    continue
+
+                for (name, limit) in setting_dic.items():
+                    try:
+                        limit_dic[(kind, str(name))] = int(limit)
+                    except (TypeError, ValueError):
+                        continue
+
+        with self.lock:
+            self.limit_dic = limit_dic
+
+        self.set_limit(TOTAL, max_running_jobs)
+
+    def set_limit(self, key: Tuple[str, str], limit):
+        """
+        Empty or non-positive limit means unlimited.
+        """
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+
+        with self.lock:
+            if limit > 0:
+                self.limit_dic[key] = limit
+            else:
+                self.limit_dic.pop(key, None)
+
+    def get_blocking_key(self, demand: Dict[Tuple[str, str], int]) -> Optional[Tuple[str, str]]:
+        for (key, quantity) in demand.items():
+            limit = self.limit_dic.get(key)
+
+            if limit is not None and self.usage_dic[key] + quantity > limit:
+                return key
+
+        return None
+
+    def try_acquire(self, owner, demand: Dict[Tuple[str, str], int], blocked_key_set: Optional[set] = None) -> Optional[Tuple[str, str]]:
+        """
+        Acquire all resources of demand or nothing.
+        Return None if acquired (or owner already holds resources), otherwise the blocking resource key.
+        Resources in blocked_key_set were refused to earlier (older) owners in the same round, they are not handed to later owners,
+        so big license demand is not starved by small ones. Refused resource is added to blocked_key_set.
+        """
+        with self.lock:
+            if owner in self.holder_dic:
+                return None
+
+            blocking_key = None
+
+            if blocked_key_set:
+                blocking_key = next((key for key in demand.keys() if key in blocked_key_set and key in self.limit_dic), None)
+
+            if blocking_key is None:
+                blocking_key = self.get_blocking_key(demand)
+
+            if blocking_key is not None:
+                self.waiting_since_dic.setdefault(owner, time.monotonic())
+
+                if blocked_key_set is not None:
+                    blocked_key_set.add(blocking_key)
+
+                return blocking_key
+
+            self.hold(owner, demand)
+
+            return None
+
+    def acquire(self, owner, demand: Dict[Tuple[str, str], int]):
+        """
+        Acquire resources even if limit is exceeded, for actions which are already started.
+        """
+        with self.lock:
+            if owner not in self.holder_dic:
+                self.hold(owner, demand)
+
+    def hold(self, owner, demand: Dict[Tuple[str, str], int]):
+        for (key, quantity) in demand.items():
+            self.usage_dic[key] += quantity
+
+        self.holder_dic[owner] = dict(demand)
+        self.waiting_since_dic.pop(owner, None)
+
+    def release(self, owner):
+        with self.lock:
+            demand = self.holder_dic.pop(owner, None)
+
+            if not demand:
+                return
+
+            for (key, quantity) in demand.items():
+                self.usage_dic[key] -= quantity
+
+                if self.usage_dic[key] <= 0:
+                    del self.usage_dic[key]
+
+    def forget(self, owner):
+        """
+        Owner does not wait for resources any more.
+        """
+        with self.lock:
+            self.waiting_since_dic.pop(owner, None)
+
+    def get_usage(self, key: Tuple[str, str]) -> int:
+        with self.lock:
+            return self.usage_dic.get(key, 0)
+
+    def get_fair_share_order(self, item_list: List[tuple]) -> List[tuple]:
+        """
+        item_list is [(owner, demand)] in arrival order, demand None means no admission is needed (kept first).
+        Owners are grouped by share key (queue/flow), the group with least running + already picked owners is served next,
+        inside one group owners which wait longer are served first.
+        """
+        with self.lock:
+            waiting_since_dic = dict(self.waiting_since_dic)
+            usage_dic = dict(self.usage_dic)
+
+        free_item_list = [item for item in item_list if not item[1]]
+        group_dic = {}
+
+        for item in sorted([item for item in item_list if item[1]], key=lambda item: waiting_since_dic.get(item[0], math.inf)):
+            group_dic.setdefault(get_share_key(item[1]), collections.deque()).append(item)
+
+        group_heap = [(usage_dic.get(key, 0), i, key) for (i, key) in enumerate(group_dic.keys())]
+        heapq.heapify(group_heap)
+        order_list = free_item_list
+
+        while group_heap:
+            (usage, i, key) = heapq.heappop(group_heap)
+            order_list.append(group_dic[key].popleft())
+
+            if group_dic[key]:
+                heapq.heappush(group_heap, (usage + 1, i, key))
+
+        return order_list
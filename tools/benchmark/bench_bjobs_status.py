@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark structured bjobs status query of job watcher with fake_bjobs.py.
+
+Usage: python3 bench_bjobs_status.py -n 100000 -c 5000
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+import common_lsf
+
+FAKE_BJOBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_bjobs.py')
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--job_num', type=int, default=100000, help='Specify job number, default is 100000.')
+    parser.add_argument('-c', '--chunk_size', type=int, default=5000, help='Specify job number of each bjobs command, default is 5000.')
+    parser.add_argument('-a', '--array_ratio', type=float, default=0.5, help='Specify ratio of job array elements, default is 0.5.')
+    return parser.parse_args()
+
+
+def main():
+    args = read_args()
+    array_num = int(args.job_num * args.array_ratio)
+    job_id_list = [str(100000 + i) for i in range(args.job_num - array_num)]
+    job_id_list.extend(['{}[{}]'.format(900000 + i // 1000, i % 1000 + 1) for i in range(array_num)])
+
+    start = time.perf_counter()
+    job_dic = common_lsf.get_bjobs_status_info(job_id_list, bjobs=FAKE_BJOBS, chunk_size=args.chunk_size)
+    query_time = time.perf_counter() - start
+
+    stdout = '\n'.join(['{}|0|RUN|-'.format(100000 + i) for i in range(args.job_num)])
+    start = time.perf_counter()
+    common_lsf.parse_bjobs_status_info(stdout)
+    parse_time = time.perf_counter() - start
+
+    print('Jobs              : {} ({} job array elements)'.format(args.job_num, array_num))
+    print('bjobs commands    : {}'.format((args.job_num + args.chunk_size - 1) // args.chunk_size))
+    print('Query + parse     : {:.3f} s'.format(query_time))
+    print('Parse only        : {:.3f} s'.format(parse_time))
+    print('Found jobs        : {}'.format(len(job_dic)))
+
+    for (status, count) in sorted(collections.Counter([job_info['status'] for job_info in job_dic.values()]).items()):
+        print('    {:<6}: {}'.format(status, count))
+
+
+if __name__ == '__main__':
+    main()
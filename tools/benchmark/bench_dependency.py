@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark strong dependency evaluation of tasks on a diamond-heavy RUN_AFTER DAG.
+"legacy" builds 'True'/'False'/'Cancel' equations and eval() them, recursing through every ancestor without memoization,
+"compiled" evaluates compiled DNF formulas with memoized ancestor results (common_dependency).
+
+Usage: python3 bench_dependency.py -n 2000 -w 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+import common
+import common_dependency
+
+
+class FakeTask:
+    def __init__(self, name):
+        self.task = name
+        self.parent = {}
+        self.formula_list = {}
+        self.status = common.status.passed
+        self.total_run_times = 1
+        self.formula_program_cache = common_dependency.FormulaProgramCache()
+        self.strong_dependency_cache = None
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--task_num', type=int, default=2000, help='Specify task number, default is 2000.')
+    parser.add_argument('-w', '--width', type=int, default=20, help='Specify task number of each DAG layer, default is 20.')
+    parser.add_argument('-f', '--fan_in', type=int, default=3, help='Specify parent number of each task, default is 3.')
+    parser.add_argument('-t', '--legacy_timeout', type=float, default=2, help='Stop legacy evaluation once one DAG depth takes longer than this, default is 2 seconds.')
+    return parser.parse_args()
+
+
+def gen_dag(task_num, width, fan_in):
+    """
+    Every task depends on fan_in tasks of previous layer, as "A&B|C" or "A&B&C", parent state is mostly True.
+    """
+    random.seed(0)
+    layer_list = []
+
+    for i in range(0, task_num, width):
+        layer = [FakeTask(f'task_{j}') for j in range(i, min(i + width, task_num))]
+
+        if layer_list:
+            for task_obj in layer:
+                parent_list = random.sample(layer_list[-1], min(fan_in, len(layer_list[-1])))
+                formula = []
+
+                for (j, parent_obj) in enumerate(parent_list):
+                    if j > 0:
+                        formula.append(random.choice(['&', '&', '|']))
+
+                    formula.append(parent_obj)
+                    task_obj.parent[parent_obj] = random.choice(['True'] * 8 + ['False', 'Cancel'])
+
+                task_obj.formula_list = {1: {'task_formula': formula, 'formula': formula, 'enable': True, 'finish': False}}
+
+        layer_list.append(layer)
+
+    return layer_list
+
+
+def legacy_calculate_strong_dependency(task_obj, formula_list):
+    result = False
+    cancelled_num = 0
+
+    for run_time in formula_list.keys():
+        formula = formula_list[run_time]['formula']
+        new_formula_list = []
+
+        for item in formula:
+            if item not in ['(', ')', '&', '|', ',']:
+                if task_obj.parent[item] in ['False', 'Cancel'] or not item.formula_list:
+                    new_formula_list.append(task_obj.parent[item])
+                else:
+                    new_formula_list.append(legacy_calculate_strong_dependency(item, item.formula_list)[0])
+            else:
+                new_formula_list.append(item)
+
+        if 'Cancel' in new_formula_list:
+            result = eval(''.join(str(x) for x in new_formula_list).replace('Cancel', 'False'))
+
+            if not result:
+                if all([parent_obj.status not in [common.status.running, common.status.queued] for parent_obj in task_obj.parent.keys() if parent_obj in formula]):
+                    cancelled_num += 1
+        else:
+            result = eval(''.join(str(x) for x in new_formula_list))
+
+        if result:
+            if not formula_list[run_time]['finish']:
+                break
+
+    if 0 < task_obj.total_run_times == cancelled_num:
+        result = 'Cancel'
+    elif task_obj.total_run_times == 0 and cancelled_num > 0:
+        result = 'Cancel'
+
+    return [result, cancelled_num]
+
+
+def main():
+    args = read_args()
+    layer_list = gen_dag(args.task_num, args.width, args.fan_in)
+    task_list = [task_obj for layer in layer_list for task_obj in layer]
+
+    # Legacy cost grows exponentially with DAG depth, measure growing depth until it is too slow
+    print('Tasks: {}, width: {}, depth: {}, fan-in: {}'.format(len(task_list), args.width, len(layer_list), args.fan_in))
+    print('{:<10}{:>16}{:>16}{:>10}'.format('depth', 'legacy (ms)', 'compiled (ms)', 'match'))
+
+    for depth in range(2, len(layer_list) + 1, 2):
+        tail_layer = layer_list[depth - 1]
+
+        start = time.perf_counter()
+        legacy_result_list = [legacy_calculate_strong_dependency(task_obj, task_obj.formula_list) for task_obj in tail_layer]
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled_result_list = [common_dependency.calculate_strong_dependency(task_obj, depth) for task_obj in tail_layer]
+        compiled_time = time.perf_counter() - start
+
+        print('{:<10}{:>16.2f}{:>16.2f}{:>10}'.format(depth, legacy_time * 1000, compiled_time * 1000, str(legacy_result_list == compiled_result_list)))
+
+        if legacy_time > args.legacy_timeout:
+            break
+
+    # One launch tick evaluates all tasks, all share memoized ancestors of current epoch
+    start = time.perf_counter()
+
+    for task_obj in task_list:
+        if task_obj.formula_list:
+            common_dependency.calculate_strong_dependency(task_obj, -1)
+
+    print('Compiled, all {} tasks, cold epoch : {:.2f} ms'.format(len(task_list), (time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+
+    for task_obj in task_list:
+        if task_obj.formula_list:
+            common_dependency.calculate_strong_dependency(task_obj, -1)
+
+    print('Compiled, all {} tasks, warm epoch : {:.2f} ms'.format(len(task_list), (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark JobBuffer.add_job -> common_db.save_job_store_batch before and after the engine registry and upsert writes.
+"before" creates engine, runs create_all/upgrade/triggers and updates existing jobs with SELECT-then-setattr on every flush.
+Every job is added twice, the second round updates the rows written by the first round (rerun).
+
+Usage: python3 bench_job_buffer.py -n 10000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']))
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/bin')
+import common_db
+import job_manager
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--job_num', type=int, default=10000, help='Specify add_job call number of each round, default is 10000.')
+    parser.add_argument('-b', '--batch_size', type=int, default=100, help='Specify JobBuffer batch size, default is 100.')
+    return parser.parse_args()
+
+
+def legacy_save_job_store_batch(data_list, db_path):
+    db_path = f'sqlite:///{db_path}'
+    engine = create_engine(db_path, connect_args={'check_same_thread': False})
+    common_db.Base.metadata.create_all(engine, checkfirst=True)
+    common_db.upgrade_database(engine)
+    common_db.create_job_store_triggers(engine)
+
+    engine = create_engine(db_path, connect_args={'check_same_thread': False})
+    session = sessionmaker(bind=engine)()
+    by_uuid = {}
+
+    for data in data_list:
+        data['uuid'] = common_db.generate_uuid_from_components(item_list=[data['block'], data['version'], data['flow'], data['task']])
+        by_uuid[data['uuid']] = data
+
+    data_list = list(by_uuid.values())
+    existing_map = {record.uuid: record for record in session.query(common_db.JobStore).filter(common_db.JobStore.uuid.in_([data['uuid'] for data in data_list])).all()}
+    new_records = []
+
+    for data in data_list:
+        if data['uuid'] in existing_map:
+            for (key, value) in data.items():
+                setattr(existing_map[data['uuid']], key, value)
+        else:
+            new_records.append(common_db.JobStore(**data))
+
+    if new_records:
+        session.bulk_save_objects(new_records)
+
+    session.commit()
+    session.close()
+
+
+def gen_job(i, status):
+    return {'job_type': common_db.JobType.lsf, 'job_id': '', 'job_index': None, 'block': 'block', 'version': 'version', 'flow': f'flow_{i % 10}', 'task': f'task_{i}',
+            'command_file': f'/tmp/task_{i}.sh', 'action': common_db.JobAction.run, 'status': status}
+
+
+def bench(job_store, args):
+    # Flush timer only wakes once per hour, every flush comes from add_job or the final flush
+    job_buffer = job_manager.JobBuffer(job_store=job_store, batch_size=args.batch_size, flush_interval=3600)
+    result_dic = {}
+
+    for (round_name, status) in [('insert', common_db.JobStatus.awaiting_dispatch), ('update', common_db.JobStatus.queued)]:
+        start = time.perf_counter()
+
+        for i in range(args.job_num):
+            job_buffer.add_job(gen_job(i, status))
+
+        job_buffer.flush()
+        result_dic[round_name] = time.perf_counter() - start
+
+    engine = create_engine(f'sqlite:///{job_store}')
+
+    with engine.connect() as connection:
+        result_dic['rows'] = connection.execute(select(func.count()).select_from(common_db.JobStore.__table__)).scalar()
+
+    engine.dispose()
+
+    return result_dic
+
+
+def main():
+    args = read_args()
+    work_dir = tempfile.mkdtemp(prefix='bench_job_buffer_')
+    save_job_store_batch = common_db.save_job_store_batch
+
+    try:
+        os.makedirs(os.path.join(work_dir, 'before'))
+        os.makedirs(os.path.join(work_dir, 'after'))
+
+        common_db.save_job_store_batch = legacy_save_job_store_batch
+        before = bench(os.path.join(work_dir, 'before', common_db.JobStoreTable), args)
+        common_db.save_job_store_batch = save_job_store_batch
+        after = bench(os.path.join(work_dir, 'after', common_db.JobStoreTable), args)
+
+        print('add_job calls: {} per round, batch size {}'.format(args.job_num, args.batch_size))
+        print('{:<24}{:>14}{:>14}'.format('', 'before', 'after'))
+
+        for (key, title) in [('insert', 'insert round (s)'), ('update', 'update round (s)')]:
+            print('{:<24}{:>14.3f}{:>14.3f}'.format(title, before[key], after[key]))
+
+        for (key, title) in [('insert', 'insert (calls/s)'), ('update', 'update (calls/s)')]:
+            print('{:<24}{:>14.0f}{:>14.0f}'.format(title, args.job_num / before[key], args.job_num / after[key]))
+
+        print('{:<24}{:>14}{:>14}'.format('rows', before['rows'], after['rows']))
+    finally:
+        common_db.save_job_store_batch = save_job_store_batch
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
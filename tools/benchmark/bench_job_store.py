@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark job_store queries of dispatcher/watcher before and after status indexes, WAL and set-based updates.
+"before" drops the status indexes, keeps rollback journal and updates/deletes ORM objects one by one.
+
+Usage: python3 bench_job_store.py -n 50000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']))
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+import common_db
+
+ACTIVE_STATUS_LIST = [common_db.JobStatus.queued, common_db.JobStatus.running, common_db.JobStatus.undefined]
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--job_num', type=int, default=50000, help='Specify job number, default is 50000.')
+    parser.add_argument('-a', '--active_num', type=int, default=1000, help='Specify queued/running job number, default is 1000.')
+    parser.add_argument('-d', '--dispatch_num', type=int, default=200, help='Specify awaiting_dispatch job number, default is 200.')
+    parser.add_argument('-r', '--repeat', type=int, default=50, help='Specify query repeat times, default is 50.')
+    return parser.parse_args()
+
+
+def gen_job_store(db_file, args):
+    common_db.initialize_database(f'sqlite:///{db_file}')
+    engine = create_engine(f'sqlite:///{db_file}')
+    status_list = [common_db.JobStatus.awaiting_dispatch] * args.dispatch_num + [random.choice(ACTIVE_STATUS_LIST) for _ in range(args.active_num)]
+    status_list += [random.choice([common_db.JobStatus.passed, common_db.JobStatus.failed]) for _ in range(args.job_num - len(status_list))]
+    random.shuffle(status_list)
+    row_list = []
+
+    for (i, status) in enumerate(status_list):
+        row_list.append({'uuid': f'uuid_{i}', 'job_type': random.choice(list(common_db.JobType)), 'job_id': 100000 + i,
+                         'block': 'block', 'version': 'version', 'flow': 'flow', 'task': f'task_{i}',
+                         'command_file': f'/tmp/task_{i}.sh', 'action': common_db.JobAction.run, 'status': status})
+
+    with engine.begin() as connection:
+        connection.execute(common_db.JobStore.__table__.insert(), row_list)
+
+    engine.dispose()
+
+
+def timeit(func, repeat=1):
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        func()
+
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(db_file, legacy, args):
+    engine = create_engine(f'sqlite:///{db_file}', connect_args={'check_same_thread': False})
+
+    if legacy:
+        with engine.begin() as connection:
+            for index in common_db.JobStore.__table__.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+    session = sessionmaker(bind=engine)()
+    result_dic = {'journal_mode': session.execute(text('PRAGMA journal_mode')).scalar()}
+
+    def dispatch_query():
+        session.query(common_db.JobStore).filter(common_db.JobStore.status == common_db.JobStatus.awaiting_dispatch).all()
+        session.expunge_all()
+
+    def watch_query():
+        session.query(common_db.JobStore).filter(common_db.JobStore.status.in_(ACTIVE_STATUS_LIST)).all()
+        session.expunge_all()
+
+    def claim():
+        if legacy:
+            for job in session.query(common_db.JobStore).filter(common_db.JobStore.status == common_db.JobStatus.awaiting_dispatch).all():
+                job.status = common_db.JobStatus.dispatching
+        else:
+            common_db.claim_awaiting_jobs(session)
+
+        session.commit()
+
+    def watch_update():
+        jobs = session.query(common_db.JobStore).filter(common_db.JobStore.status.in_(ACTIVE_STATUS_LIST)).all()
+        status_dic = {job.uuid: common_db.JobStatus.passed.value for job in jobs}
+
+        if legacy:
+            for job in jobs:
+                job.status = status_dic[job.uuid]
+        else:
+            common_db.update_job_status(session, status_dic, status_list=ACTIVE_STATUS_LIST)
+
+        session.commit()
+
+    def clean():
+        if legacy:
+            for job in session.query(common_db.JobStore).filter(common_db.JobStore.status != common_db.JobStatus.running).all():
+                session.delete(job)
+        else:
+            session.query(common_db.JobStore).filter(common_db.JobStore.status != common_db.JobStatus.running).delete(synchronize_session=False)
+
+        session.commit()
+
+    result_dic['dispatch_query'] = timeit(dispatch_query, args.repeat)
+    result_dic['watch_query'] = timeit(watch_query, args.repeat)
+    result_dic['claim'] = timeit(claim)
+    result_dic['watch_update'] = timeit(watch_update)
+    result_dic['clean'] = timeit(clean)
+    session.close()
+    engine.dispose()
+
+    return result_dic
+
+
+def main():
+    args = read_args()
+    random.seed(0)
+    work_dir = tempfile.mkdtemp(prefix='bench_job_store_')
+
+    try:
+        template = os.path.join(work_dir, 'template')
+        gen_job_store(template, args)
+
+        # WAL is only enabled on files named job_store
+        before_file = os.path.join(work_dir, 'job_store.before')
+        after_file = os.path.join(work_dir, common_db.JobStoreTable)
+        shutil.copy(template, before_file)
+        shutil.copy(template, after_file)
+
+        before = bench(before_file, True, args)
+        after = bench(after_file, False, args)
+
+        print('Jobs: {} ({} active, {} awaiting dispatch)'.format(args.job_num, args.active_num, args.dispatch_num))
+        print('{:<24}{:>14}{:>14}'.format('', 'before', 'after'))
+        print('{:<24}{:>14}{:>14}'.format('journal_mode', before['journal_mode'], after['journal_mode']))
+
+        for (key, title) in [('dispatch_query', 'dispatch query (ms)'), ('watch_query', 'watch query (ms)'), ('claim', 'dispatch claim (ms)'),
+                             ('watch_update', 'watch update (ms)'), ('clean', 'clean obsolete (ms)')]:
+            print('{:<24}{:>14.2f}{:>14.2f}'.format(title, before[key], after[key]))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
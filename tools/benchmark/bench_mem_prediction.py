@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark memPrediction throughput of single-row requests (/memPrediction) and one batch request (/memPrediction/batch).
+Jobs are generated from users/queues/projects known by the trained model, so it needs an installed memPrediction
+(MEM_PREDICTION_INSTALL_PATH, default is tools/lsfMonitor/memPrediction) and a trained model config.
+
+Usage: python3 bench_mem_prediction.py -c <model_db>/latest/config/config -n 1000
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import yaml
+
+os.environ.setdefault('TQDM_DISABLE', '1')
+os.environ.setdefault('MEM_PREDICTION_INSTALL_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lsfMonitor/memPrediction'))
+sys.path.append(str(os.environ['MEM_PREDICTION_INSTALL_PATH']))
+from bin import predict
+
+COMMAND_LIST = ['pt_shell -f run_sta.tcl', 'innovus -init run_place.tcl', 'vcs -full64 -f filelist.f', 'dc_shell -f syn.tcl', 'calibre -drc rule.svrf']
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', required=True, help='Specify trained model config, like <model_db>/latest/config/config.')
+    parser.add_argument('-n', '--job_num', type=int, default=1000, help='Specify job number, default is 1000.')
+    return parser.parse_args()
+
+
+def gen_job_list(predict_model, job_num):
+    def get_classes(column, default):
+        if hasattr(predict_model, 'enc_cats') and column in predict_model.enc_cats:
+            return list(predict_model.enc_cats[column].classes_)
+
+        return default
+
+    user_list = get_classes('user', ['user'])
+    queue_list = get_classes('queue', ['normal'])
+    project_list = get_classes('project', ['default'])
+    job_list = []
+
+    for i in range(job_num):
+        command = random.choice(COMMAND_LIST)
+        job_list.append({'started_time': time.strftime('%a %b %d %H:%M:%S', time.localtime(time.time() - random.randint(0, 86400 * 30))),
+                         'job_name': f'{command.split()[0]}_{i}',
+                         'user': random.choice(user_list),
+                         'project': random.choice(project_list),
+                         'queue': random.choice(queue_list),
+                         'cwd': f'/proj/block_{i % 20}/run',
+                         'command': command})
+
+    return job_list
+
+
+def main():
+    args = read_args()
+    logging.disable(logging.INFO)
+
+    with open(args.config, 'r') as cf:
+        config_dic = yaml.load(cf, Loader=yaml.FullLoader)
+
+    start = time.perf_counter()
+    predict_model = predict.PredictModel(config_dic)
+    print(f'Load models (once per service): {time.perf_counter() - start:.3f} s')
+
+    random.seed(0)
+    job_list = gen_job_list(predict_model, args.job_num)
+
+    start = time.perf_counter()
+    single_memory_list = [float(predict_model.get_predict_memory(job)[0]) for job in job_list]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_memory_list = [float(memory) for memory in predict_model.get_predict_memory_batch(job_list)]
+    batch_time = time.perf_counter() - start
+
+    # Unknown user/queue/project are replaced by random classes, so only compare when the model knows all of them
+    diff_num = len([i for i in range(len(job_list)) if abs(single_memory_list[i] - batch_memory_list[i]) > 1e-6])
+
+    print(f'Single row: {args.job_num} jobs in {single_time:.3f} s, {args.job_num / single_time:.1f} jobs/s')
+    print(f'Batch     : {args.job_num} jobs in {batch_time:.3f} s, {args.job_num / batch_time:.1f} jobs/s')
+    print(f'Speedup   : {single_time / batch_time:.1f}x, {diff_num} predictions differ')
+
+
+if __name__ == '__main__':
+    main()
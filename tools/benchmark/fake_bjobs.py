@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for LSF "bjobs", used to benchmark IFP job status parsing without a cluster.
+
+Support two output modes:
+    fake_bjobs.py -o "jobid jobindex stat exit_code delimiter='|'" -noheader 101 '102[3]' ...
+    fake_bjobs.py 101 102 ...    (default wide table of bjobs)
+
+Job state is derived from job id, so results are reproducible.
+Job id which is multiple of 97 is reported as "not found".
+"""
+import re
+import sys
+
+STATUS_LIST = ['PEND', 'RUN', 'DONE', 'EXIT', 'PSUSP', 'USUSP', 'SSUSP', 'ZOMBI', 'UNKWN', 'WAIT', 'PROV']
+
+
+def get_job_status(job_id):
+    status = STATUS_LIST[job_id % len(STATUS_LIST)]
+    exit_code = str(job_id % 3 + 1) if status == 'EXIT' else '-'
+    return status, exit_code
+
+
+def main():
+    args = sys.argv[1:]
+    output_format = None
+    header = True
+    job_list = []
+    i = 0
+
+    while i < len(args):
+        if args[i] == '-o':
+            output_format = args[i + 1]
+            i += 2
+            continue
+        elif args[i] == '-noheader':
+            header = False
+        elif my_match := re.match(r'^(\d+)(\[(\d+)\])?$', args[i]):
+            job_list.append((int(my_match.group(1)), my_match.group(3)))
+
+        i += 1
+
+    delimiter = ' '
+
+    if output_format and (my_match := re.search(r"delimiter='(.)'", output_format)):
+        delimiter = my_match.group(1)
+
+    output_line_list = []
+    error_line_list = []
+
+    if header and not output_format:
+        output_line_list.append('JOBID   USER    STAT  QUEUE      FROM_HOST   EXEC_HOST   JOB_NAME   SUBMIT_TIME')
+
+    for (job_id, job_index) in job_list:
+        if job_id % 97 == 0:
+            error_line_list.append('Job <{}> is not found'.format(job_id))
+            continue
+
+        (status, exit_code) = get_job_status(job_id if not job_index else job_id + int(job_index))
+
+        if output_format:
+            output_line_list.append(delimiter.join([str(job_id), job_index if job_index else '0', status, exit_code]))
+        else:
+            job_name = 'ifp_job[{}]'.format(job_index) if job_index else 'ifp_job'
+            output_line_list.append('{:<7} ifp     {:<5} normal     login01     node01      {:<10} Oct 18 10:00'.format(job_id, status, job_name))
+
+    if output_line_list:
+        sys.stdout.write('\n'.join(output_line_list) + '\n')
+
+    if error_line_list:
+        sys.stderr.write('\n'.join(error_line_list) + '\n')
+
+
+if __name__ == '__main__':
+    main()
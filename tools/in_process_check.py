@@ -1,77 +1,236 @@
+import argparse
 import datetime
-
-from flask import Flask, request, jsonify
-import threading
-import time
+import json
 import os
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, request, jsonify
+
+os.environ.setdefault('IFP_INSTALL_PATH', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(str(os.environ['IFP_INSTALL_PATH']) + '/common')
+import common_lsf
 
 app = Flask(__name__)
 
-tasks = {}
+scheduler = None
 
 
-def check_job_status(job_id):
-    """
-    Check LSF Job Status
-    """
-    try:
-        result = subprocess.run(['bjobs', str(job_id)], capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            return f"Error: Job {job_id} not found or inaccessible."
-    except Exception as e:
-        return f"Error: {e}"
+def log(message):
+    print(f"{datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')}{message}")
 
 
-def parse_job_status(output):
+def parse_job_status(status):
     """
-    Parsing Job status
+    Parsing Job status (STAT of bjobs)
     """
-    if "DONE" in output:
+    if status == 'DONE':
         return "DONE"
-    elif "EXIT" in output:
+    elif status == 'EXIT':
         return "EXIT"
-    elif "RUN" in output or "PEND" in output:
+    elif status:
         return "RUNNING"
     else:
         return "UNKNOWN"
 
 
-def monitor_task(task_id, path, command, notification, interval, start_interval: int = 120):
+class TimerWheel:
+    """
+    Hashed timer wheel, one slot per tick.
+    Timers longer than one wheel turn stay in their slot for more rounds.
+    """
+    def __init__(self, tick=1.0, slot_num=512):
+        self.tick = tick
+        self.slot_num = slot_num
+        self.slot_list = [dict() for _ in range(slot_num)]
+        self.cursor = 0
+        # task_id: slot index
+        self.task_slot_dic = {}
+
+    def add(self, task_id, delay):
+        self.remove(task_id)
+        tick_num = max(1, int(round(max(delay, 0) / self.tick)))
+        slot = (self.cursor + tick_num) % self.slot_num
+        self.slot_list[slot][task_id] = (tick_num - 1) // self.slot_num
+        self.task_slot_dic[task_id] = slot
+
+    def remove(self, task_id):
+        slot = self.task_slot_dic.pop(task_id, None)
+
+        if slot is not None:
+            self.slot_list[slot].pop(task_id, None)
+
+    def advance(self):
+        """
+        Move to next slot, return task ids which are due.
+        """
+        self.cursor = (self.cursor + 1) % self.slot_num
+        slot_dic = self.slot_list[self.cursor]
+        due_list = []
+
+        for (task_id, rounds) in list(slot_dic.items()):
+            if rounds > 0:
+                slot_dic[task_id] = rounds - 1
+            else:
+                del slot_dic[task_id]
+                self.task_slot_dic.pop(task_id, None)
+                due_list.append(task_id)
+
+        return due_list
+
+
+class InProcessCheckScheduler:
     """
-    Monitoring Task
+    Run in process check COMMAND of registered LSF jobs every INTERVAL seconds until the job finishes or the check fails.
+    One timer wheel drives all jobs, status of all due jobs is got with one bjobs query per tick,
+    check commands run on a bounded worker pool and registrations are saved into state_file.
     """
-    time.sleep(start_interval)
+    def __init__(self, state_file, max_workers=8, tick=1.0):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        # task_id: {'path', 'command', 'notification', 'interval', 'start_interval', 'next_time'}
+        self.tasks = {}
+        # Tasks whose check command is running
+        self.running_task_set = set()
+        # next_time changes are saved once per tick, registrations are saved at once
+        self.dirty = False
+        self.wheel = TimerWheel(tick=tick)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.thread = threading.Thread(target=self.schedule_loop, daemon=True)
+        self.load_state()
 
-    while task_id in tasks:
-        # Check Job Status
-        status_output = check_job_status(task_id)
-        job_status = parse_job_status(status_output)
-        print(f"{datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')}[{task_id}] Job {task_id} status: {job_status}")
+    def start(self):
+        self.thread.start()
 
-        # Delete Task from tasks if status == DONE|EXIT
-        if job_status in {"DONE", "EXIT"}:
-            print(f"{datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')}[{task_id}] Job {task_id} is {job_status}. Removing task.")
-            del tasks[task_id]
-            break
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return
 
         try:
-            result = subprocess.run(f'cd {path} && {command}', shell=True)
-            return_code = result.returncode
+            with open(self.state_file, 'r') as SF:
+                task_dic = json.load(SF)
+        except Exception as error:
+            log(f' Failed to load {self.state_file}: {error}')
+            return
+
+        now = time.time()
+
+        for (task_id, task) in task_dic.items():
+            self.tasks[task_id] = task
+            self.wheel.add(task_id, task.get('next_time', now) - now)
 
-            if return_code:
-                if notification:
-                    os.popen(notification)
+        log(f' Loaded {len(self.tasks)} tasks from {self.state_file}.')
+
+    def save_state(self):
+        """
+        self.lock must be held.
+        """
+        tmp_file = f'{self.state_file}.{os.getpid()}.tmp'
+
+        try:
+            with open(tmp_file, 'w') as SF:
+                json.dump(self.tasks, SF)
 
-                del tasks[task_id]
-                break
+            os.replace(tmp_file, self.state_file)
+            self.dirty = False
+        except Exception as error:
+            log(f' Failed to save {self.state_file}: {error}')
 
+    def add_task(self, task_id, path, command, notification, interval, start_interval) -> bool:
+        with self.lock:
+            if task_id in self.tasks:
+                return False
+
+            self.tasks[task_id] = {'path': path, 'command': command, 'notification': notification,
+                                   'interval': interval, 'start_interval': start_interval,
+                                   'next_time': time.time() + float(start_interval)}
+            self.wheel.add(task_id, float(start_interval))
+            self.save_state()
+
+        return True
+
+    def remove_task(self, task_id):
+        """
+        self.lock must be held, state file is saved by next tick.
+        """
+        self.tasks.pop(task_id, None)
+        self.wheel.remove(task_id)
+        self.dirty = True
+
+    def list_tasks(self):
+        with self.lock:
+            return list(self.tasks.keys())
+
+    def schedule_loop(self):
+        next_tick = time.monotonic()
+
+        while True:
+            next_tick += self.wheel.tick
+            time.sleep(max(0, next_tick - time.monotonic()))
+
+            try:
+                self.tick()
+            except Exception as error:
+                log(f' Error while scheduling: {error}')
+
+    def tick(self):
+        with self.lock:
+            due_list = [task_id for task_id in self.wheel.advance() if task_id in self.tasks and task_id not in self.running_task_set]
+
+            if self.dirty:
+                self.save_state()
+
+        if not due_list:
+            return
+
+        # One LSF query for all due jobs
+        job_status_dic = common_lsf.get_bjobs_status_info(due_list)
+
+        with self.lock:
+            for task_id in due_list:
+                if task_id not in self.tasks:
+                    continue
+
+                job_status = parse_job_status(job_status_dic.get(str(task_id), {}).get('status'))
+                log(f'[{task_id}] Job {task_id} status: {job_status}')
+
+                # Delete Task from tasks if status == DONE|EXIT
+                if job_status in {"DONE", "EXIT"}:
+                    log(f'[{task_id}] Job {task_id} is {job_status}. Removing task.')
+                    self.remove_task(task_id)
+                    continue
+
+                self.running_task_set.add(task_id)
+                self.executor.submit(self.run_check, task_id, dict(self.tasks[task_id]))
+
+    def run_check(self, task_id, task):
+        failed = False
+
+        try:
+            result = subprocess.run(f'cd {task["path"]} && {task["command"]}', shell=True)
+            failed = bool(result.returncode)
+
+            if failed and task['notification']:
+                subprocess.Popen(task['notification'], shell=True)
         except Exception as e:
-            print(f"Error while checking: {e}")
+            log(f' Error while checking: {e}')
 
-        time.sleep(int(interval))
+        with self.lock:
+            self.running_task_set.discard(task_id)
+
+            if task_id not in self.tasks:
+                return
+
+            if failed:
+                self.remove_task(task_id)
+            else:
+                interval = max(float(task['interval'] or 0), self.wheel.tick)
+                self.tasks[task_id]['next_time'] = time.time() + interval
+                self.wheel.add(task_id, interval)
+                self.dirty = True
 
 
 @app.route('/add_task', methods=['POST'])
@@ -81,21 +240,11 @@ def add_task():
     if not data or not all(key in data for key in ['id', 'path', 'command', 'interval', 'notification', 'start_interval']):
         return jsonify({'error': 'Invalid data. Expected {"id": <job_id>, "path": <path>, "command": <command>, "interval": <interval>, "notification": <notification>}'}), 400
 
-    task_id = data['id']
-    path = data['path']
-    command = data['command']
-    interval = data['interval']
-    start_interval = data['start_interval']
-    notification = data['notification']
+    task_id = str(data['id'])
 
-    if task_id in tasks:
+    if not scheduler.add_task(task_id, data['path'], data['command'], data['notification'], data['interval'], data['start_interval']):
         return jsonify({'error': f'Task {task_id} already exists.'}), 400
 
-    tasks[task_id] = {'command': command, 'job_id': task_id, 'notification': notification, 'interval': interval, 'start_interval': start_interval}
-
-    thread = threading.Thread(target=monitor_task, args=(task_id, path, command, notification, interval, start_interval), daemon=True)
-    thread.start()
-
     return jsonify({'message': f'Task {task_id} added successfully.'}), 200
 
 
@@ -104,8 +253,21 @@ def list_tasks():
     """
     List All Task
     """
-    return jsonify({'tasks': list(tasks.keys())}), 200
+    return jsonify({'tasks': scheduler.list_tasks()}), 200
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0', help='Specify listen host, default is 0.0.0.0.')
+    parser.add_argument('--port', type=int, default=12345, help='Specify listen port, default is 12345.')
+    parser.add_argument('--state_file', default=os.path.join(os.getcwd(), 'in_process_check.json'), help='Specify file to save registered tasks, default is ./in_process_check.json.')
+    parser.add_argument('--workers', type=int, default=8, help='Specify max number of running check commands, default is 8.')
+    parser.add_argument('--tick', type=float, default=1.0, help='Specify scheduler tick in seconds, default is 1.')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=12345)
+    args = read_args()
+    scheduler = InProcessCheckScheduler(state_file=args.state_file, max_workers=args.workers, tick=args.tick)
+    scheduler.start()
+    app.run(host=args.host, port=args.port)
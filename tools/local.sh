@@ -40,4 +40,6 @@ cat <<EOF > "$META_FILE"
   "log_stdout": "$STDOUT_LOG",
   "log_stderr": "$STDERR_LOG"
 }
-EOF
\ No newline at end of file
+EOF
+
+exit $RET_CODE
@@ -73,12 +73,48 @@ class PredictModel:
 
         if 'user_df_dic' in self.config_dic:
             self.user_df_dic = self.read_binary_file(self.config_dic['user_df_dic'])
+            self.user_max_mem_mean_dic = {key: value['user_max_mem_mean'] for key, value in self.user_df_dic.items()}
+            self.user_max_mem_median_dic = {key: value['user_max_mem_median'] for key, value in self.user_df_dic.items()}
         else:
             logger.error("Could not find user max memory dict in model config, please check!")
 
+        # Base models and cluster models are loaded once, {column: {model: (feature model, loaded model, loaded cluster model)}}
+        self.base_model_dic = self.load_base_models()
+        self.lsf_unit_for_limits = None
+
+    def load_base_models(self):
+        base_model_dic = {}
+
+        for column in self.config_dic.get('base_model', {}).keys():
+            text_column = r'%s_text' % column
+            base_model_dic[column] = {}
+
+            for (model, model_config) in self.config_dic['base_model'][column].items():
+                if model == 'word2vec':
+                    feature_model = common_model.Word2VecModel(text_column, model_config['emb_size'], model_config['model_path'])
+                elif model == 'glove':
+                    feature_model = common_model.GloVeModel(text_column, model_config['emb_size'], model_config['corpus_path'], model_config['model_path'])
+                else:
+                    continue
+
+                cluster_model = None
+
+                if 'cluster_model_path' in model_config.keys():
+                    cluster_model = self.read_binary_file(model_config['cluster_model_path'])
+
+                base_model_dic[column][model] = (feature_model, feature_model.load_model(), cluster_model)
+
+        return base_model_dic
+
+    def get_lsf_unit_for_limits(self):
+        if self.lsf_unit_for_limits is None:
+            self.lsf_unit_for_limits = common_lsf.get_lsf_unit_for_limits()
+
+        return self.lsf_unit_for_limits
+
     @common.timer
     def predict(self, debug, job_info_dic):
-        logger.info("predict max memory ... unit: %s" % str(common_lsf.get_lsf_unit_for_limits()))
+        logger.info("predict max memory ... unit: %s" % str(self.get_lsf_unit_for_limits()))
 
         if debug:
             logger.debug("Debug mode, tool maybe crash.")
@@ -91,15 +127,47 @@ class PredictModel:
                 logger.error("Error: %s" % str(error))
                 predict_memory = 1
 
-        lsf_unit_for_limits = common_lsf.get_lsf_unit_for_limits()
+        lsf_unit_for_limits = self.get_lsf_unit_for_limits()
         result_prediction = common.memory_unit_from_gb_other(predict_memory, unit=lsf_unit_for_limits)
 
         logger.info("predict max memory is %s %s" % (str(result_prediction), lsf_unit_for_limits))
 
         return result_prediction
 
+    @common.timer
+    def predict_batch(self, debug, job_info_list):
+        """
+        Predict max memory of all jobs in job_info_list, every pipeline stage runs once on the whole batch.
+        Jobs which could not be predicted get None (instead of a default memory which clients would take as a prediction).
+        """
+        lsf_unit_for_limits = self.get_lsf_unit_for_limits()
+        logger.info("predict max memory of %s jobs ... unit: %s" % (str(len(job_info_list)), str(lsf_unit_for_limits)))
+
+        if not job_info_list:
+            return []
+
+        if debug:
+            logger.debug("Debug mode, tool maybe crash.")
+            predict_memory_list = list(self.get_predict_memory_batch(job_info_list))
+        else:
+            try:
+                predict_memory_list = list(self.get_predict_memory_batch(job_info_list))
+            except Exception as error:
+                logger.error("Could not predict memory for these jobs, please check!")
+                logger.error("Error: %s" % str(error))
+                predict_memory_list = [None] * len(job_info_list)
+
+        return [common.memory_unit_from_gb_other(float(predict_memory), unit=lsf_unit_for_limits) if predict_memory is not None else None for predict_memory in predict_memory_list]
+
     def get_predict_memory(self, job_info_dic):
-        job_df = pd.DataFrame(job_info_dic, index=[0, ])
+        return self.get_predict_memory_batch(pd.DataFrame(job_info_dic, index=[0, ]))
+
+    def get_predict_memory_batch(self, job_info_list):
+        if isinstance(job_info_list, pd.DataFrame):
+            job_df = job_info_list.reset_index(drop=True)
+        else:
+            job_df = pd.DataFrame(list(job_info_list))
+
         job_df = self.data_preprocess(job_df)
         job_df = self.generate_feature(job_df)
         job_struct_data = self.encode(job_df)
@@ -176,11 +244,8 @@ class PredictModel:
     def gen_user_max_mem_feature(self, job_df):
         logger.info('Generate user history max memory feature ...')
 
-        user_max_mem_mean_dic = {key: value['user_max_mem_mean'] for key, value in self.user_df_dic.items()}
-        user_max_mem_median_dic = {key: value['user_max_mem_median'] for key, value in self.user_df_dic.items()}
-
-        job_df['user_max_mem_mean'] = job_df['user'].map(user_max_mem_mean_dic)
-        job_df['user_max_mem_median'] = job_df['user'].map(user_max_mem_median_dic)
+        job_df['user_max_mem_mean'] = job_df['user'].map(self.user_max_mem_mean_dic)
+        job_df['user_max_mem_median'] = job_df['user'].map(self.user_max_mem_median_dic)
 
         logger.debug("mean: %s, median: %s" % (str(job_df['user_max_mem_mean']), str(job_df['user_max_mem_median'])))
 
@@ -194,37 +259,24 @@ class PredictModel:
 
         for column in self.config_dic['base_model'].keys():
             logger.info("Process column: %s ..." % column)
-            column_values = job_df[column].values
             pattern = re.compile(r"[^a-z|^A-Z]")
-            column_sentences = [re.sub(pattern, " ", str(column_values)).split(), ]
+            # One sentence per job
+            column_sentences = [re.sub(pattern, " ", str([value])).split() for value in job_df[column].values]
             text_column = r'%s_text' % column
             df = pd.DataFrame()
-            df[text_column] = np.array(column_sentences, dtype=object).tolist()
-            model_list = list(self.config_dic['base_model'][column].keys())
+            df[text_column] = pd.Series(column_sentences, dtype=object)
 
-            for model in model_list:
+            for (model, (feature_model, loaded_model, cluster_model)) in self.base_model_dic.get(column, {}).items():
                 if model == 'word2vec':
-                    model_path = self.config_dic['base_model'][column][model]['model_path']
-                    model_size = self.config_dic['base_model'][column][model]['emb_size']
-                    word2vec_model = common_model.Word2VecModel(text_column, model_size, model_path)
-                    emb_df = word2vec_model.generate_word2vec_feature(df)
-                    job_df = pd.concat([job_df, emb_df], axis=1)
-
-                    if 'cluster_model_path' in self.config_dic['base_model'][column][model].keys():
-                        label_df = word2vec_model.gen_cluster_label(emb_df, self.config_dic['base_model'][column][model]['cluster_model_path'])
-                        job_df = pd.concat([job_df, label_df], axis=1)
-
-                if model == 'glove':
-                    model_path = self.config_dic['base_model'][column][model]['model_path']
-                    corpus_path = self.config_dic['base_model'][column][model]['corpus_path']
-                    model_size = self.config_dic['base_model'][column][model]['emb_size']
-                    glove_model = common_model.GloVeModel(text_column, model_size, corpus_path, model_path)
-                    emb_df = glove_model.generate_glove_feature(df)
-                    job_df = pd.concat([job_df, emb_df], axis=1)
-
-                    if 'cluster_model_path' in self.config_dic['base_model'][column][model].keys():
-                        label_df = glove_model.gen_cluster_label(emb_df, self.config_dic['base_model'][column][model]['cluster_model_path'])
-                        job_df = pd.concat([job_df, label_df], axis=1)
+                    emb_df = feature_model.generate_word2vec_feature(df, w2v_model=loaded_model)
+                else:
+                    emb_df = feature_model.generate_glove_feature(df, glove_model=loaded_model)
+
+                job_df = pd.concat([job_df, emb_df], axis=1)
+
+                if cluster_model is not None:
+                    label_df = feature_model.gen_cluster_label(emb_df, None, cluster_model=cluster_model)
+                    job_df = pd.concat([job_df, label_df], axis=1)
 
         logger.info("job_df: %s" % str(job_df))
 
@@ -239,7 +291,8 @@ class PredictModel:
             job_struct_data[column] = job_struct_data[column].astype('category')
 
         for column in encode_list:
-            job_struct_data[column] = job_struct_data[column].map(lambda s: np.random.choice(self.enc_cats[column].classes_, 1)[0] if s not in self.enc_cats[column].classes_ else s)
+            class_set = set(self.enc_cats[column].classes_)
+            job_struct_data[column] = job_struct_data[column].map(lambda s: np.random.choice(self.enc_cats[column].classes_, 1)[0] if s not in class_set else s)
             job_struct_data[column] = self.enc_cats[column].transform(list(job_struct_data[column].values))
             job_struct_data[column] = job_struct_data[column].astype('category')
             job_struct_data[column] = job_struct_data[column].astype('int')
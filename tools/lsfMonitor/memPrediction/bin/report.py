@@ -24,7 +24,7 @@ from collections import Counter
 sys.path.append(str(os.environ['MEM_PREDICTION_INSTALL_PATH']))
 
 from config import config
-from common import common, common_lsf
+from common import common, common_lsf, common_history
 
 USER = getpass.getuser()
 logger = common.get_logger(level=logging.DEBUG)
@@ -60,6 +60,9 @@ def merge_data(start_date='', end_date='', csv_path=os.getcwd(), mode='memory'):
         original_column_list = ['job_id', 'started_time', 'job_name', 'user', 'status', 'project', 'interactive_mode', 'processors_requested',
                                 'queue', 'cwd', 'command', 'cpu_time', 'finished_time', 'span_hosts']
 
+    if hasattr(config, 'job_format') and config.job_format.lower() == 'parquet':
+        return query_data(start_date=start_date, end_date=end_date, history_path=csv_path, column_list=original_column_list, unit=unit)
+
     if os.path.exists(csv_path):
         for file in os.listdir(csv_path):
             df = None
@@ -116,6 +119,31 @@ def merge_data(start_date='', end_date='', csv_path=os.getcwd(), mode='memory'):
     return total_df
 
 
+def query_data(start_date, end_date, history_path, column_list, unit='MB'):
+    """
+    Read DONE jobs between start_date and end_date from job history store, only date partitions in range are opened.
+    """
+    history_store = common_history.JobHistoryStore(history_path)
+    query_column_list = [column for column in column_list if column != 'pre_mem']
+
+    if 'pre_mem' in column_list:
+        query_column_list.append('job_description')
+
+    total_df = history_store.query_df(start_date, end_date, columns=query_column_list, status='DONE')
+
+    if total_df.empty:
+        logger.error("Could not find merge data result, please check data source!")
+        sys.exit(1)
+
+    if 'pre_mem' in column_list:
+        total_df['pre_mem'] = total_df['job_description'].apply(lambda x: get_mem_predict_value(x, unit=unit))
+
+    total_df = total_df.drop_duplicates(subset=['job_id'], keep='first')[column_list]
+    logger.debug("dataframe: %s\n" % str(total_df.describe()))
+
+    return total_df
+
+
 def get_mem_predict_value(job_description, unit='MB'):
     mem_predict_value = 0
 
@@ -14,6 +14,7 @@ sys.path.append(str(os.environ['MEM_PREDICTION_INSTALL_PATH']))
 from common import common
 from common import common_lsf
 from common import common_sqlite3
+from common import common_history
 from config import config
 
 logger = common.get_logger(level=logging.INFO)
@@ -31,6 +32,9 @@ def read_args():
     parser.add_argument("-d", "--db",
                         action="store_true", default=False,
                         help='Sample done job info and save as sqlite')
+    parser.add_argument("-p", "--parquet",
+                        action="store_true", default=False,
+                        help='Sample done job info and save into job history store (parquet, partitioned by date)')
 
     args = parser.parse_args()
 
@@ -182,6 +186,20 @@ class Sampling:
 
         logger.info('    Done ( %s jobs).' % str(len(job_list)))
 
+    @common.timer
+    def sampling_parquet(self):
+        """
+        sampling job infomation into job history store (<db_path>/date=YYYY-MM-DD/*.parquet)
+        """
+        logger.info('>>> Sampling job info ...')
+        history_store = common_history.JobHistoryStore(self.db_path)
+        sample_date = datetime.datetime.today().strftime('%Y-%m-%d')
+        job_id_list = history_store.query(sample_date, sample_date, columns=['job_id']).column('job_id').to_pylist()
+        bjobs_dic, job_list = self.sampling_lsf_finish_job(job_id_list=job_id_list)
+        history_store.append([common_history.get_job_history_row(bjobs_dic[job]) for job in job_list])
+
+        logger.info('    Done ( %s jobs).' % str(len(job_list)))
+
 
 #################
 # Main Function #
@@ -194,6 +212,8 @@ def main():
         my_sampling.sampling_csv()
     elif args.db:
         my_sampling.sampling_db()
+    elif args.parquet:
+        my_sampling.sampling_parquet()
 
 
 if __name__ == '__main__':
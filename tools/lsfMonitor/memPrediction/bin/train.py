@@ -28,7 +28,7 @@ from sklearn.ensemble import RandomForestRegressor
 sys.path.append(str(os.environ['MEM_PREDICTION_INSTALL_PATH']))
 
 from config import config
-from common import common, common_model
+from common import common, common_model, common_history
 
 USER = getpass.getuser()
 LOG_PATH = '/tmp/memPrediction.' + str(USER) + '.train.log'
@@ -200,6 +200,10 @@ class TrainingModel:
             logger.error("Error: %s" % str(error))
             sys.exit(1)
 
+        if hasattr(config, 'job_format') and config.job_format.lower() == 'parquet':
+            self.query_data(original_column_list)
+            return
+
         if os.path.exists(self.data_path):
             for file in os.listdir(self.data_path):
                 df = None
@@ -252,6 +256,25 @@ class TrainingModel:
 
             self.model_config_dic['training_shape'] = str(self.df.shape)
 
+    def query_data(self, column_list):
+        """
+        Read DONE jobs between start_date and end_date from job history store, only date partitions in range are opened.
+        """
+        history_store = common_history.JobHistoryStore(self.data_path)
+        self.df = history_store.query_df(self.start_date, self.end_date, columns=['job_id'] + column_list, status='DONE')
+        self.df = self.df.drop_duplicates(subset=['job_id'], keep='first')[column_list]
+        self.df['rusage_mem'] = 0
+
+        if hasattr(config, 'max_training_lines') and config.max_training_lines:
+            self.df = self.df.head(int(config.max_training_lines))
+
+        if self.df.empty:
+            logger.error("Could not find job history between %s and %s in %s, please check!" % (self.start_date, self.end_date, self.data_path))
+            sys.exit(1)
+
+        logger.info("Reading job history done, the db dateframe shape is %s" % str(self.df.shape))
+        self.model_config_dic['training_shape'] = str(self.df.shape)
+
     def drop_data(self):
         """
         drop result=Null record
@@ -41,13 +41,17 @@ class Word2VecModel:
 
         return emb_df
 
-    def generate_word2vec_feature(self, df):
+    def load_model(self):
+        return Word2Vec.load(self.model_path)
+
+    def generate_word2vec_feature(self, df, w2v_model=None):
         sentences = copy.deepcopy(df[self.sentence_col].values)
 
         for i in range(len(sentences)):
             sentences[i] = [str(x) for x in sentences[i]]
 
-        w2v_model = Word2Vec.load(self.model_path)
+        if w2v_model is None:
+            w2v_model = self.load_model()
 
         for i in tqdm(range(len(sentences))):
             sentences[i] = [w2v_model.wv[x] for x in sentences[i] if x in w2v_model.wv]
@@ -77,8 +81,10 @@ class Word2VecModel:
 
         return label_df
 
-    def gen_cluster_label(self, emb_df, cluster_model_path):
-        cluster_model = pickle.load(open(cluster_model_path, "rb"))
+    def gen_cluster_label(self, emb_df, cluster_model_path, cluster_model=None):
+        if cluster_model is None:
+            cluster_model = pickle.load(open(cluster_model_path, "rb"))
+
         emb_df = emb_df.astype('float64')
         label = cluster_model.predict(emb_df)
         label_df = pd.DataFrame()
@@ -127,17 +133,20 @@ class GloVeModel:
 
         return emb_df
 
-    def generate_glove_feature(self, df):
+    def load_model(self):
+        return Glove.load(self.model_path)
+
+    def generate_glove_feature(self, df, glove_model=None):
         sentences = copy.deepcopy(df[self.sentence_col].values)
 
         for i in range(len(sentences)):
             sentences[i] = [str(x) for x in sentences[i]]
 
-        self.glove_model = Glove.load(self.model_path)
-        vocab = list(self.glove_model.dictionary.keys())
+        self.glove_model = glove_model if glove_model is not None else self.load_model()
+        vocab = self.glove_model.dictionary
 
         for i in tqdm(range(len(sentences))):
-            sentences[i] = [self.glove_model.word_vectors[self.glove_model.dictionary[x]] for x in sentences[i] if x in vocab]
+            sentences[i] = [self.glove_model.word_vectors[vocab[x]] for x in sentences[i] if x in vocab]
 
         emb_matrix = []
 
@@ -164,8 +173,10 @@ class GloVeModel:
 
         return label_df
 
-    def gen_cluster_label(self, emb_df, cluster_model_path):
-        cluster_model = pickle.load(open(cluster_model_path, "rb"))
+    def gen_cluster_label(self, emb_df, cluster_model_path, cluster_model=None):
+        if cluster_model is None:
+            cluster_model = pickle.load(open(cluster_model_path, "rb"))
+
         emb_df = emb_df.astype('float64')
         label = cluster_model.predict(emb_df)
         label_df = pd.DataFrame()
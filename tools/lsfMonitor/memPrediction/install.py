@@ -173,10 +173,10 @@ def gen_config_file():
             default_predict_model = str(CWD) + '/db/model_db/latest'
 
             with open(config_file, 'w') as CF:
-                CF.write('''# job infomation database save directory, format: csv/sqlite.
+                CF.write('''# job infomation database save directory, format: csv/sqlite/parquet.
 db_path = "''' + str(job_db_path) + '''"
 
-# Specify job database format
+# Specify job database format, csv/json/parquet (job history store, sampled with "sample -p")
 job_format = 'csv'
 
 # job rusage analysis report template
@@ -45,6 +45,25 @@ class MemoryPredictServer(Resource):
         return predict_memory
 
 
+class MemoryPredictBatchServer(Resource):
+    def post(self):
+        """
+        Body is json {"jobs": [{<factor>: <value>, ...}, ...]}, return predicted memory of every job in the same order.
+        If model fails, return 503 instead of default memory, so clients back off and do not cache a fake prediction.
+        """
+        data = request.get_json(force=True, silent=True) or {}
+        job_info_list = data.get('jobs', []) if isinstance(data, dict) else data
+
+        try:
+            predict_memory_list = predict_model.predict_batch(False, job_info_list)
+        except Exception as error:
+            logger.error('Failed to predict memory of %d jobs: %s' % (len(job_info_list), str(error)))
+            return {'error': 'Memory prediction failed: %s' % str(error)}, 503
+
+        return predict_memory_list
+
+
 app = Flask(__name__)
 api = Api(app)
 api.add_resource(MemoryPredictServer, "/memPrediction")
+api.add_resource(MemoryPredictBatchServer, "/memPrediction/batch")